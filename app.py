@@ -1,3 +1,4 @@
+import os
 from st_on_hover_tabs import on_hover_tabs
 import streamlit as st
 # import base64
@@ -6,9 +7,17 @@ from app_pages.home_page import main as generate
 from app_utils.login import main as login_user
 from app_utils.st_constants import PAGE_CONFIG
 
+
+@st.cache_data
+def load_style(path: str, mtime: float):
+    # mtime is a part of the cache key, the file is read again when it changes
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
 st.set_page_config(**PAGE_CONFIG)
 
-st.markdown('<style>' + open('./style.css').read() + '</style>', unsafe_allow_html=True)
+st.markdown('<style>' + load_style('./style.css', os.path.getmtime('./style.css')) + '</style>', unsafe_allow_html=True)
 
 
 with st.sidebar:
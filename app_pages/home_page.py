@@ -1,10 +1,12 @@
 import streamlit as st
+from app_utils.backends import get_backend
 from app_utils.openai_llm import set_openai_api_key
 from app_utils.generation import load_examples, generate_synthetic_data_ui
 
 
 def main(admin=None):
-    set_openai_api_key(from_secrets=True, from_env=True)
+    if get_backend().requires_api_key:
+        set_openai_api_key(from_secrets=True, from_env=True)
 
     st.markdown("<h4 style='text-align: center; color: green;'>⬇️ Load File with Templates</h4>", unsafe_allow_html=True)
     load_examples()
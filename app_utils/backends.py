@@ -0,0 +1,323 @@
+import os
+import re
+import json
+import random
+import asyncio
+import threading
+import httpx
+import openai
+from time import time, sleep
+from openai.types import Batch, FileObject
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from app_utils.clients import get_shared_client, get_shared_async_client
+from app_utils.rate_limit import estimate_tokens
+
+
+class LLMBackend:
+    """
+    Backend interface: a backend gives sync and async clients with the subset of the OpenAI client API
+    used by `openai_llm` (chat.completions.create / with_raw_response / with_streaming_response, files, batches)
+    """
+    name = "base"
+    requires_api_key = True
+
+    def client(self, api_key: str = None, base_url: str = None):
+        raise NotImplementedError
+
+    def async_client(self, api_key: str = None, base_url: str = None):
+        raise NotImplementedError
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Real OpenAI (or OpenAI-compatible) API through the shared client pool
+    """
+    name = "openai"
+
+    def client(self, api_key: str = None, base_url: str = None):
+        return get_shared_client(api_key, base_url=base_url)
+
+    def async_client(self, api_key: str = None, base_url: str = None):
+        return get_shared_async_client(api_key, base_url=base_url)
+
+
+class _RawResponse:
+    """
+    Stands for both `with_raw_response` and `with_streaming_response` results of the OpenAI client
+    """
+
+    def __init__(self, response, headers: dict):
+        self.headers = headers
+        self._response = response
+
+    def parse(self):
+        return self._response
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class _AsyncStreamingResponse:
+    def __init__(self, request):
+        self._request = request
+        self._response = None
+
+    async def parse(self):
+        return self._response
+
+    async def __aenter__(self):
+        self._response = await self._request
+        self.headers = {}
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class FakeBackend(LLMBackend):
+    """
+    In-process fake of the OpenAI API for offline load testing.
+
+    :param latency: seconds per request, ("lognormal", median, sigma), ("uniform", low, high) or ("fixed", value)
+    :param error_rates: probability of every failure, keys are 429, 500 and "timeout"
+    :param output_tokens: number of generated tokens, same formats as `latency`
+    :param seed: seed of the internal random generator
+    """
+    name = "fake"
+    requires_api_key = False
+
+    def __init__(self,
+                 latency=("lognormal", 1.0, 0.5),
+                 error_rates: dict = None,
+                 output_tokens=("uniform", 200, 800),
+                 seed: int = None):
+        self.latency = latency
+        self.error_rates = {int(k) if str(k).isdigit() else k: v for k, v in (error_rates or {}).items()}
+        self.output_tokens = output_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._files = {}
+        self._batches = {}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Reads the config from SDG_FAKE_BACKEND env variable, e.g. '{"latency": ["fixed", 0.1], "error_rates": {"429": 0.05}}'
+        """
+        config = json.loads(os.getenv("SDG_FAKE_BACKEND", "{}"))
+        return cls(**{k: tuple(v) if isinstance(v, list) else v for k, v in config.items()})
+
+    def _draw(self, distribution):
+        if isinstance(distribution, (int, float)):
+            return distribution
+        kind, *params = distribution
+        with self._lock:
+            if kind == "lognormal":
+                return self._random.lognormvariate(0, params[1]) * params[0]
+            if kind == "uniform":
+                return self._random.uniform(params[0], params[1])
+            if kind == "fixed":
+                return params[0]
+        raise ValueError(f"Unknown distribution '{kind}'")
+
+    def _draw_error(self):
+        with self._lock:
+            for error, rate in self.error_rates.items():
+                if self._random.random() < rate:
+                    return error
+        return None
+
+    def _raise(self, error, model: str):
+        request = httpx.Request("POST", "http://fake-backend/v1/chat/completions")
+        if error == "timeout":
+            raise openai.APITimeoutError(request=request)
+        response = httpx.Response(error, request=request, headers={"retry-after": "1"})
+        error_class = openai.RateLimitError if error == 429 else openai.InternalServerError
+        raise error_class(f"Fake backend error {error} for {model}", response=response, body=None)
+
+    def _completion(self, model: str, messages: list, response_format: dict = None):
+        completion_tokens = max(1, int(self._draw(self.output_tokens)))
+        prompt_tokens = estimate_tokens(messages)
+        content = " ".join(f"token{i % 97}" for i in range(completion_tokens))
+        if response_format and response_format.get("type") == "json_object" and '"replacements"' in messages[-1]["content"]:
+            # context request of the chunked generation
+            content = json.dumps({"replacements": {f"token{i}": f"fake{i}" for i in range(min(completion_tokens, 20))}})
+        elif response_format and response_format.get("type") == "json_object":
+            # multi-variant prompts ask for "exactly N documents"
+            variants = re.search(r"exactly (\d+) documents", messages[-1]["content"])
+            variants = int(variants.group(1)) if variants else 1
+            completion_tokens *= variants
+            content = json.dumps({"documents": [f"variant{i} {content}" for i in range(variants)]})
+        return ChatCompletion.model_validate({
+            "id": f"fake-{int(time() * 1e6)}",
+            "object": "chat.completion",
+            "created": int(time()),
+            "model": model,
+            "choices": [{"index": 0,
+                         "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens,
+                      "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        latency = self._draw(self.latency)
+        if stream:
+            return self._stream(model, messages, latency)
+        sleep(latency)
+        error = self._draw_error()
+        if error:
+            self._raise(error, model)
+        return self._completion(model, messages, kwargs.get("response_format"))
+
+    def _stream(self, model: str, messages: list, latency: float, chunks: int = 20):
+        """
+        The first token comes after 20% of the latency, the rest of the text in `chunks` equal parts
+        """
+        sleep(latency * 0.2)
+        error = self._draw_error()
+        if error:
+            self._raise(error, model)
+        completion = self._completion(model, messages)
+        content = completion.choices[0].message.content
+        step = max(1, len(content) // chunks)
+        base = {"id": completion.id, "object": "chat.completion.chunk", "created": completion.created, "model": model}
+        for start in range(0, len(content), step):
+            sleep(latency * 0.8 / chunks)
+            yield ChatCompletionChunk.model_validate({
+                **base, "choices": [{"index": 0, "delta": {"content": content[start:start + step]}}]})
+        yield ChatCompletionChunk.model_validate({
+            **base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        yield ChatCompletionChunk.model_validate({**base, "choices": [], "usage": completion.usage.model_dump()})
+
+    async def acreate(self, model: str, messages: list, **kwargs):
+        await asyncio.sleep(self._draw(self.latency))
+        error = self._draw_error()
+        if error:
+            self._raise(error, model)
+        return self._completion(model, messages, kwargs.get("response_format"))
+
+    def create_file(self, file, purpose: str):
+        content = file.read()
+        with self._lock:
+            file_id = f"file-fake-{len(self._files)}"
+            self._files[file_id] = content if isinstance(content, bytes) else content.encode("utf-8")
+        return FileObject(id=file_id, bytes=len(self._files[file_id]), created_at=int(time()),
+                          filename=getattr(file, "name", file_id), object="file", purpose=purpose,
+                          status="processed")
+
+    def create_batch(self, input_file_id: str, endpoint: str, completion_window: str, metadata: dict = None):
+        """
+        Batches are processed right away, without latency and errors
+        """
+        output = []
+        for line in self._files[input_file_id].decode("utf-8").splitlines():
+            request = json.loads(line)
+            body = request["body"]
+            response = self._completion(body["model"], body["messages"], body.get("response_format"))
+            output.append(json.dumps({"id": f"batch-req-{len(output)}",
+                                      "custom_id": request["custom_id"],
+                                      "response": {"status_code": 200, "body": response.model_dump()},
+                                      "error": None}))
+        output_file = self.create_file(_NamedBytes("\n".join(output).encode("utf-8"), "output.jsonl"), "batch_output")
+        with self._lock:
+            batch = Batch(id=f"batch-fake-{len(self._batches)}", object="batch", endpoint=endpoint,
+                          input_file_id=input_file_id, completion_window=completion_window, status="completed",
+                          created_at=int(time()), output_file_id=output_file.id, metadata=metadata)
+            self._batches[batch.id] = batch
+        return batch
+
+    def client(self, api_key: str = None, base_url: str = None):
+        return _FakeClient(self)
+
+    def async_client(self, api_key: str = None, base_url: str = None):
+        return _FakeAsyncClient(self)
+
+
+class _NamedBytes:
+    def __init__(self, content: bytes, name: str):
+        self.content = content
+        self.name = name
+
+    def read(self):
+        return self.content
+
+
+class _Namespace:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _FakeClient:
+    def __init__(self, backend: FakeBackend):
+        create = backend.create
+        raw_create = _Namespace(create=lambda **kw: _RawResponse(create(**kw), {}))
+        self.chat = _Namespace(completions=_Namespace(create=create,
+                                                      with_raw_response=raw_create,
+                                                      with_streaming_response=raw_create))
+        self.files = _Namespace(create=backend.create_file,
+                                content=lambda file_id: _Namespace(text=backend._files[file_id].decode("utf-8")))
+        self.batches = _Namespace(create=backend.create_batch,
+                                  retrieve=lambda batch_id: backend._batches[batch_id])
+
+    def close(self):
+        pass
+
+
+class _FakeAsyncClient:
+    def __init__(self, backend: FakeBackend):
+        async def create_raw(**kwargs):
+            return _RawResponse(await backend.acreate(**kwargs), {})
+
+        self.chat = _Namespace(completions=_Namespace(
+            create=backend.acreate,
+            with_raw_response=_Namespace(create=create_raw),
+            with_streaming_response=_Namespace(create=lambda **kw: _AsyncStreamingResponse(backend.acreate(**kw)))))
+
+    async def close(self):
+        pass
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "fake": FakeBackend.from_env,
+}
+_backends = {}
+_default_backend = None
+_backends_lock = threading.Lock()
+
+
+def register_backend(name: str, backend):
+    """
+    Registers a backend instance (or a factory without arguments) under the name
+    """
+    with _backends_lock:
+        BACKENDS[name] = (lambda: backend) if isinstance(backend, LLMBackend) else backend
+        _backends.pop(name, None)
+
+
+def set_default_backend(name: str = None):
+    """
+    Sets the backend used when no name is given, None restores the SDG_BACKEND env variable default
+    """
+    global _default_backend
+    _default_backend = name
+
+
+def get_backend(name: str = None) -> LLMBackend:
+    """
+    Returns the backend instance by name, the default one is set with `set_default_backend`
+    or SDG_BACKEND env variable (openai)
+    """
+    name = name or _default_backend or os.getenv("SDG_BACKEND", "openai")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', available: {list(BACKENDS)}")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
@@ -0,0 +1,151 @@
+import os
+import json
+from time import time, sleep
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# Limits of one batch input file
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_BYTES = 190 * 1024 ** 2
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Batch API requests are billed at half of the regular price
+BATCH_PRICE_FACTOR = 0.5
+
+
+def compile_batch_files(requests: list, path_prefix: str):
+    """
+    Writes planned requests to JSONL batch files, splitting them by the per-file limits.
+    Every request is a dict with `custom_id`, `model` and `messages` keys
+    """
+    paths = []
+    f, count, size = None, 0, 0
+    try:
+        for request in requests:
+            line = json.dumps({"custom_id": request["custom_id"],
+                               "method": "POST",
+                               "url": BATCH_ENDPOINT,
+                               "body": {"model": request["model"], "messages": request["messages"]}},
+                              ensure_ascii=False) + "\n"
+            line_size = len(line.encode("utf-8"))
+            if f is None or count >= MAX_BATCH_REQUESTS or size + line_size > MAX_BATCH_BYTES:
+                if f is not None:
+                    f.close()
+                paths.append(f"{path_prefix}_part{len(paths):03d}.jsonl")
+                f = open(paths[-1], "w", encoding="utf-8")
+                count, size = 0, 0
+            f.write(line)
+            count += 1
+            size += line_size
+    finally:
+        if f is not None:
+            f.close()
+    return paths
+
+
+def submit_batch(client: OpenAI, path: str, metadata: dict = None):
+    with open(path, "rb") as f:
+        batch_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id,
+                                  endpoint=BATCH_ENDPOINT,
+                                  completion_window=COMPLETION_WINDOW,
+                                  metadata=metadata)
+    print(f"\033[096mSubmitted batch {batch.id} ({os.path.basename(path)})\033[0m")
+    return batch.id
+
+
+def wait_for_batches(client: OpenAI, batch_ids: list, poll_interval: float = 30, timeout: float = None):
+    """
+    Polls the batches until all of them reach a final status, returns the batch objects
+    """
+    start_time = time()
+    pending = list(batch_ids)
+    finished = {}
+    while pending:
+        for batch_id in list(pending):
+            batch = client.batches.retrieve(batch_id)
+            if batch.status in FINAL_STATUSES:
+                finished[batch_id] = batch
+                pending.remove(batch_id)
+                print(f"\033[096mBatch {batch_id}: {batch.status}\033[0m")
+        if pending:
+            if timeout is not None and time() - start_time > timeout:
+                raise TimeoutError(f"Batches {pending} are not finished after {timeout} seconds")
+            sleep(poll_interval)
+    return [finished[batch_id] for batch_id in batch_ids]
+
+
+def download_batch_results(client: OpenAI, batch):
+    """
+    Returns {custom_id: ChatCompletion} for the successful requests of the batch
+    """
+    results = {}
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                print(f"\033[091mRequest {item.get('custom_id')} failed: {item.get('error') or response}\033[0m")
+                continue
+            results[item["custom_id"]] = ChatCompletion.model_validate(response["body"])
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            if line.strip():
+                item = json.loads(line)
+                print(f"\033[091mRequest {item.get('custom_id')} failed: {item.get('error') or item.get('response')}\033[0m")
+    return results
+
+
+def _save_state(state_path: str, state: dict):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, state_path)
+
+
+def run_batch_job(client: OpenAI, requests: list, path_prefix: str, poll_interval: float = 30,
+                  timeout: float = None):
+    """
+    Compiles, submits and waits for the batch job. Returns {custom_id: ChatCompletion},
+    failed requests are missing from the result.
+    The request files and the IDs of the submitted batches are saved to `<path_prefix>_batches.json`
+    after every submit. If the file exists, the job reattaches to its batches and submits only the files
+    that were not submitted yet, so a restarted job doesn't pay for the same requests twice.
+    Remove the file with `clear_batch_state` once the results are saved
+    """
+    state_path = f"{path_prefix}_batches.json"
+    state = {"files": [], "batch_ids": {}}
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if not all(os.path.exists(path) for path in state["files"]):
+            state = {"files": [], "batch_ids": {}}
+        elif state["batch_ids"]:
+            print(f"\033[096mReattaching to {len(state['batch_ids'])} submitted batches of {path_prefix}\033[0m")
+    if not state["files"]:
+        state["files"] = compile_batch_files(requests, path_prefix)
+        _save_state(state_path, state)
+    for path in state["files"]:
+        if path not in state["batch_ids"]:
+            state["batch_ids"][path] = submit_batch(client, path, metadata={"file": os.path.basename(path)})
+            _save_state(state_path, state)
+
+    results = {}
+    batch_ids = [state["batch_ids"][path] for path in state["files"]]
+    for batch in wait_for_batches(client, batch_ids, poll_interval=poll_interval, timeout=timeout):
+        results.update(download_batch_results(client, batch))
+    return results
+
+
+def clear_batch_state(path_prefix: str):
+    """
+    Forgets the batches of the job, the next run of `run_batch_job` with the prefix submits new ones
+    """
+    state_path = f"{path_prefix}_batches.json"
+    if os.path.exists(state_path):
+        os.remove(state_path)
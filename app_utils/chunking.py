@@ -0,0 +1,81 @@
+import os
+import re
+from functools import lru_cache
+
+from app_utils.rate_limit import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Templates longer than this are generated in chunks, the answer of one request stays within the output limit
+MAX_TEMPLATE_TOKENS = int(os.getenv("SDG_MAX_TEMPLATE_TOKENS", 2500))
+CHUNK_TOKENS = int(os.getenv("SDG_CHUNK_TOKENS", 1500))
+
+_SECTION_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Exact count with tiktoken if it is installed, the rough estimation otherwise
+    """
+    if tiktoken is None:
+        return estimate_tokens(text)
+    return len(_get_encoding(model).encode(text))
+
+
+def _split_long_section(section: str, max_tokens: int, model: str):
+    """
+    Splits a section that doesn't fit into one chunk by lines, then by sentences
+    """
+    pieces = section.split("\n")
+    if len(pieces) == 1:
+        pieces = _SENTENCE_END.split(section)
+    if len(pieces) == 1:
+        return pieces
+    return _group(pieces, max_tokens, model, separator="\n" if "\n" in section else " ")
+
+
+def _group(pieces: list, max_tokens: int, model: str, separator: str):
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece, model)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_long_section(piece, max_tokens, model))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+@lru_cache(maxsize=1024)
+def split_template(template: str, max_tokens: int = CHUNK_TOKENS, model: str = "gpt-4o"):
+    """
+    Splits the template into chunks of up to `max_tokens` tokens along section (blank line) boundaries.
+    Sections longer than `max_tokens` are split by lines and sentences
+    """
+    sections = [section.strip() for section in _SECTION_BREAK.split(template) if section.strip()]
+    return tuple(_group(sections, max_tokens, model, separator="\n\n"))
+
+
+@lru_cache(maxsize=1024)
+def needs_chunking(template: str, model: str = "gpt-4o", max_tokens: int = MAX_TEMPLATE_TOKENS) -> bool:
+    return count_tokens(template, model) > max_tokens
@@ -0,0 +1,276 @@
+"""
+Headless batch runner of the synthetic data generation.
+
+Usage (from the repository root):
+    python -m app_utils.cli generate --examples examples.json --count 10000 --concurrency 32
+    python -m app_utils.cli generate --examples examples.json --count 10000 --seed 7 --shard-index 0 --shard-count 4
+    python -m app_utils.cli merge gen_data/generated_data_shard*.csv --output generated_data.csv
+    python -m app_utils.cli enqueue --examples examples.json --count 10000 --seed 7
+    python -m app_utils.cli work --processes 8
+    python -m app_utils.cli export --job <job id> --output generated_data.csv
+
+The examples file is a JSON list of {"text": ..., "entities": [...]} objects (or of strings), or a JSONL file
+with one such object per line. Every shard of a job gets the same arguments except --shard-index,
+it writes gen_data/<output stem>_shardIII-of-NNN (a csv file or a dataset directory with --format) and can be
+restarted with --resume. With the task queue (gen_data/.queue/tasks.sqlite by default) any number of
+`work` processes share the job, a crashed worker's tasks are leased again after the visibility timeout
+"""
+import os
+import sys
+import argparse
+from time import time
+
+from app_utils.backends import get_backend
+from app_utils.dedup import DEDUP_ACTION, DEDUP_ACTIONS, DEDUP_THRESHOLD, INDEX_SUFFIX
+from app_utils.examples import ExampleStore
+from app_utils.leaks import LEAK_ACTION, LEAK_ACTIONS
+from app_utils.router import ModelRouter
+from app_utils.openai_llm import DEFAULT_AUGMENTATIONS, LANGUAGES, generate_synthetic_data_batch, \
+    set_openai_api_key
+from app_utils.task_queue import DEFAULT_QUEUE_PATH, MAX_ATTEMPTS, VISIBILITY_TIMEOUT, TaskQueue, enqueue_plan, \
+    run_workers
+from app_utils.writer import OUTPUT_FORMATS, merge_outputs
+
+
+def read_examples(path: str, text_key: str = None):
+    """
+    The examples stay on disk, only the offset index is loaded (built next to the file on the first run)
+    """
+    store = ExampleStore.open(path, text_key=text_key)
+    if store.text_key is None and store.keys:
+        raise KeyError(f"Can't detect the text key of {path}, use --text-key with one of {store.keys}")
+    return store
+
+
+def read_augmentations(path: str = None):
+    if path is None:
+        return DEFAULT_AUGMENTATIONS
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def shard_file_name(output: str, shard_index: int, shard_count: int):
+    if shard_count <= 1:
+        return output
+    stem, ext = os.path.splitext(output)
+    return f"{stem}_shard{shard_index:03d}-of-{shard_count:03d}{ext}"
+
+
+def generate(args):
+    examples = read_examples(args.examples, args.text_key)
+    augmentations = read_augmentations(args.augmentations)
+    data_file = shard_file_name(args.output, args.shard_index, args.shard_count)
+    router = None
+    if args.models or args.budget is not None or args.deadline is not None:
+        # every shard gets its part of the budget
+        router = ModelRouter(args.models, budget=args.budget / args.shard_count if args.budget is not None else None,
+                             deadline=args.deadline, concurrency=args.concurrency)
+    # all shards of the job dedupe against one MinHash index
+    dedup_path = os.path.join(os.getcwd(), "gen_data", os.path.splitext(args.output)[0] + INDEX_SUFFIX)
+    if get_backend().requires_api_key:
+        set_openai_api_key(from_secrets=False, from_env=True)
+
+    print(f"\033[096m{len(examples)} examples | {len(augmentations)} augmentations | "
+          f"shard {args.shard_index + 1} / {args.shard_count} -> gen_data/{data_file}\033[0m")
+    start_time = time()
+    generated_file = generate_synthetic_data_batch(examples,
+                                                   data_size=args.count,
+                                                   data_file=data_file,
+                                                   gpt4_share=args.gpt4_share,
+                                                   save_every=args.save_every,
+                                                   augmentations=augmentations,
+                                                   language=_language(args.language),
+                                                   concurrency=args.concurrency,
+                                                   return_dataframe=False,
+                                                   cache_mode=args.cache_mode,
+                                                   use_batch_api=args.batch_api,
+                                                   variants=args.variants,
+                                                   verbose=not args.quiet,
+                                                   resume=args.resume,
+                                                   seed=args.seed,
+                                                   shard_index=args.shard_index,
+                                                   shard_count=args.shard_count,
+                                                   output_format=args.format,
+                                                   leak_action=args.leak_action,
+                                                   dedup_action=args.dedup_action,
+                                                   dedup_threshold=args.dedup_threshold,
+                                                   dedup_path=dedup_path,
+                                                   router=router)
+    print(f"\033[092mData saved to {generated_file} in {time() - start_time:.1f} seconds\033[0m")
+    return 0
+
+
+def merge(args):
+    output_path = _output_path(args.output)
+    if os.path.exists(output_path):
+        print(f"\033[091m{output_path} already exists\033[0m")
+        return 1
+    rows = merge_outputs(sorted(args.inputs), output_path, output_format=args.format)
+    print(f"\033[092m{rows} rows from {len(args.inputs)} files saved to {output_path}\033[0m")
+    return 0
+
+
+def _language(languages: list):
+    # a single language keeps the job parameters (and the seeded job IDs) of the single language jobs
+    return languages[0] if len(languages) == 1 else languages
+
+
+def _output_path(output: str):
+    return os.path.join(os.getcwd(), "gen_data", output) if os.path.dirname(output) == "" else output
+
+
+def enqueue(args):
+    examples = read_examples(args.examples, args.text_key)
+    queue = TaskQueue(args.queue)
+    try:
+        job_id = enqueue_plan(queue, examples, args.count, gpt4_share=args.gpt4_share,
+                              augmentations=read_augmentations(args.augmentations),
+                              language=_language(args.language),
+                              seed=args.seed)
+    finally:
+        queue.close()
+    print(job_id)
+    return 0
+
+
+def work(args):
+    if get_backend().requires_api_key:
+        set_openai_api_key(from_secrets=False, from_env=True)
+    exit_codes = run_workers(args.queue, processes=args.processes, stop_when_empty=not args.keep_running,
+                             visibility_timeout=args.visibility_timeout, max_attempts=args.max_attempts,
+                             cache_mode=args.cache_mode, leak_action=args.leak_action)
+    return 0 if all(code == 0 for code in exit_codes) else 1
+
+
+def export(args):
+    output_path = _output_path(args.output)
+    if os.path.exists(output_path):
+        print(f"\033[091m{output_path} already exists\033[0m")
+        return 1
+    queue = TaskQueue(args.queue)
+    try:
+        stats = queue.stats(args.job)
+        rows = queue.export(args.job, output_path, output_format=args.format)
+    finally:
+        queue.close()
+    print(f"\033[092m{rows} rows of job {args.job} saved to {output_path}\033[0m")
+    if stats.get("pending") or stats.get("leased") or stats.get("dead"):
+        print(f"\033[093mThe job is not complete: {stats}\033[0m")
+    return 0
+
+
+def queue_status(args):
+    queue = TaskQueue(args.queue)
+    try:
+        print(queue.stats(args.job))
+        if args.requeue_dead:
+            print(f"{queue.requeue_dead(args.job)} dead-letter tasks requeued")
+    finally:
+        queue.close()
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless synthetic data generation")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    gen = subparsers.add_parser("generate", help="generate a dataset or one shard of it")
+    gen.add_argument("--examples", required=True, help="JSON or JSONL file with the examples")
+    gen.add_argument("--text-key", default=None, help="key of the example text (detected by default)")
+    gen.add_argument("--augmentations", default=None, help="text file with one augmentation per line")
+    gen.add_argument("--language", default=["RU"], nargs="+", choices=list(LANGUAGES),
+                     help="one or more languages, the documents are split between them equally")
+    gen.add_argument("--gpt4-share", type=float, default=0.5, help="share of the documents generated with GPT-4o")
+    gen.add_argument("--count", type=int, default=200, help="number of documents in the whole job")
+    gen.add_argument("--output", default="generated_data.csv", help="data file name in gen_data")
+    gen.add_argument("--format", default="csv", choices=OUTPUT_FORMATS,
+                     help="csv file or a directory of Parquet (zstd) / JSONL.gz part files")
+    gen.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    gen.add_argument("--variants", type=int, default=1, help="documents per request")
+    gen.add_argument("--save-every", type=int, default=10, help="fsync the data file every N rows")
+    gen.add_argument("--cache-mode", default=None, help="off, read_through, write_only or replay_only")
+    gen.add_argument("--batch-api", action="store_true", help="send the requests through the Batch API")
+    gen.add_argument("--seed", type=int, default=None, help="seed of the plan, required for sharding")
+    gen.add_argument("--shard-index", type=int, default=0, help="index of this shard, from 0")
+    gen.add_argument("--shard-count", type=int, default=1, help="number of shards of the job")
+    gen.add_argument("--resume", action="store_true", help="continue the unfinished job of the output file")
+    gen.add_argument("--leak-action", default=LEAK_ACTION, choices=LEAK_ACTIONS,
+                     help="what to do with documents that contain entities of the examples")
+    gen.add_argument("--dedup-action", default=DEDUP_ACTION, choices=DEDUP_ACTIONS,
+                     help="what to do with near-duplicates of the template or of the generated documents")
+    gen.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                     help="MinHash similarity of near-duplicates")
+    gen.add_argument("--models", nargs="+", default=None,
+                     help="route every request to one of these models (preferred first) instead of --gpt4-share")
+    gen.add_argument("--budget", type=float, default=None, help="target spend of the job in USD, enables routing")
+    gen.add_argument("--deadline", type=float, default=None,
+                     help="target duration of the job in seconds, enables routing")
+    gen.add_argument("--quiet", action="store_true", help="no per-document logs")
+    gen.set_defaults(func=generate)
+
+    mrg = subparsers.add_parser("merge", help="merge the shard outputs into one dataset")
+    mrg.add_argument("inputs", nargs="+", help="data files or dataset directories of the shards")
+    mrg.add_argument("--output", required=True, help="merged data file (a name in gen_data or a path)")
+    mrg.add_argument("--format", default="csv", choices=OUTPUT_FORMATS, help="format of the merged data")
+    mrg.set_defaults(func=merge)
+
+    enq = subparsers.add_parser("enqueue", help="add the planned documents of a job to the task queue")
+    enq.add_argument("--examples", required=True, help="JSON or JSONL file with the examples")
+    enq.add_argument("--text-key", default=None, help="key of the example text (detected by default)")
+    enq.add_argument("--augmentations", default=None, help="text file with one augmentation per line")
+    enq.add_argument("--language", default=["RU"], nargs="+", choices=list(LANGUAGES),
+                     help="one or more languages, the documents are split between them equally")
+    enq.add_argument("--gpt4-share", type=float, default=0.5, help="share of the documents generated with GPT-4o")
+    enq.add_argument("--count", type=int, default=200, help="number of documents in the job")
+    enq.add_argument("--seed", type=int, default=None,
+                     help="seed of the plan, enqueueing a seeded job twice is a no-op")
+    enq.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="SQLite file of the queue")
+    enq.set_defaults(func=enqueue)
+
+    wrk = subparsers.add_parser("work", help="run worker processes until the queue is drained")
+    wrk.add_argument("--processes", type=int, default=None, help="worker processes (one per core by default)")
+    wrk.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="SQLite file of the queue")
+    wrk.add_argument("--visibility-timeout", type=float, default=VISIBILITY_TIMEOUT,
+                     help="seconds before the task of a silent worker is leased again")
+    wrk.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="attempts before the dead-letter table")
+    wrk.add_argument("--cache-mode", default=None, help="off, read_through, write_only or replay_only")
+    wrk.add_argument("--leak-action", default=LEAK_ACTION, choices=LEAK_ACTIONS,
+                     help="what to do with documents that contain entities of the examples")
+    wrk.add_argument("--keep-running", action="store_true", help="wait for new tasks instead of exiting")
+    wrk.set_defaults(func=work)
+
+    exp = subparsers.add_parser("export", help="save the results of a queued job")
+    exp.add_argument("--job", required=True, help="job ID printed by enqueue")
+    exp.add_argument("--output", required=True, help="data file (a name in gen_data or a path)")
+    exp.add_argument("--format", default="csv", choices=OUTPUT_FORMATS, help="format of the data")
+    exp.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="SQLite file of the queue")
+    exp.set_defaults(func=export)
+
+    sts = subparsers.add_parser("queue-status", help="task counts by status")
+    sts.add_argument("--job", default=None, help="only the tasks of this job")
+    sts.add_argument("--requeue-dead", action="store_true", help="move the dead-letter tasks back to the queue")
+    sts.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="SQLite file of the queue")
+    sts.set_defaults(func=queue_status)
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        if args.shard_count > 1 and args.seed is None:
+            parser.error("--seed is required with --shard-count > 1, all shards must draw the same plan")
+        if not 0 <= args.shard_index < args.shard_count:
+            parser.error("--shard-index must be in [0, --shard-count)")
+    return args
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+
+    # Set root directory to the parent-parent directory of the current file
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    load_dotenv(os.path.join(root_dir, ".env"))
+
+    args = parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import os
+import asyncio
+import threading
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+# Connection pool settings, can be overridden with env variables or `configure_pool`
+POOL_SETTINGS = {
+    "pool_size": int(os.getenv("OPENAI_POOL_SIZE", 20)),
+    "timeout": float(os.getenv("OPENAI_TIMEOUT", 120)),
+    "connect_timeout": float(os.getenv("OPENAI_CONNECT_TIMEOUT", 10)),
+    "keepalive_expiry": float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 60)),
+}
+
+_lock = threading.Lock()
+_clients = {}
+_async_clients = {}
+
+
+def configure_pool(pool_size: int = None, timeout: float = None, connect_timeout: float = None,
+                   keepalive_expiry: float = None):
+    """
+    Updates pool settings. Clients created before the call keep their settings, so the registry is cleared
+    """
+    updates = {"pool_size": pool_size, "timeout": timeout, "connect_timeout": connect_timeout,
+               "keepalive_expiry": keepalive_expiry}
+    with _lock:
+        POOL_SETTINGS.update({k: v for k, v in updates.items() if v is not None})
+        _clients.clear()
+        _async_clients.clear()
+
+
+def _http_options():
+    limits = httpx.Limits(max_connections=POOL_SETTINGS["pool_size"],
+                          max_keepalive_connections=POOL_SETTINGS["pool_size"],
+                          keepalive_expiry=POOL_SETTINGS["keepalive_expiry"])
+    timeout = httpx.Timeout(POOL_SETTINGS["timeout"], connect=POOL_SETTINGS["connect_timeout"])
+    return limits, timeout
+
+
+def _registry_key(api_key: str, base_url: str = None):
+    return api_key, base_url or os.getenv("OPENAI_BASE_URL")
+
+
+def get_shared_client(api_key: str, base_url: str = None) -> OpenAI:
+    """
+    Returns a process-wide OpenAI client for the api key / base url pair.
+    The client keeps its http connections alive, so the TLS handshake is paid only once per connection.
+    Built-in retries are disabled, they are handled together with rate limiting in `openai_llm`
+    """
+    key = _registry_key(api_key, base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        if key not in _clients:
+            limits, timeout = _http_options()
+            _clients[key] = OpenAI(api_key=key[0],
+                                   base_url=key[1],
+                                   timeout=timeout,
+                                   max_retries=0,
+                                   http_client=httpx.Client(limits=limits, timeout=timeout))
+        return _clients[key]
+
+
+def get_shared_async_client(api_key: str, base_url: str = None) -> AsyncOpenAI:
+    """
+    Returns an AsyncOpenAI client shared by all tasks of the running event loop.
+    Async connections can't be moved between event loops, so there is one client per loop
+    """
+    loop = asyncio.get_running_loop()
+    key = (*_registry_key(api_key, base_url), loop)
+    client = _async_clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        for stale_key in [k for k in _async_clients if k[2].is_closed()]:
+            del _async_clients[stale_key]
+        if key not in _async_clients:
+            limits, timeout = _http_options()
+            _async_clients[key] = AsyncOpenAI(api_key=key[0],
+                                              base_url=key[1],
+                                              timeout=timeout,
+                                              max_retries=0,
+                                              http_client=httpx.AsyncClient(limits=limits, timeout=timeout))
+        return _async_clients[key]
+
+
+async def close_loop_clients():
+    """
+    Closes async clients of the running event loop, should be awaited before the loop is closed
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        keys = [k for k in _async_clients if k[2] is loop]
+        clients = [_async_clients.pop(k) for k in keys]
+    for client in clients:
+        await client.close()
+
+
+def close_clients():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
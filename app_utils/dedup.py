@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import zlib
+import numpy as np
+from functools import lru_cache
+
+# "flag" saves near-duplicates with the `duplicate_of` column, "drop" skips them, "off" (the default) skips the check
+DEDUP_ACTIONS = ("off", "flag", "drop")
+DEDUP_ACTION = os.getenv("SDG_DEDUP_ACTION", "off")
+# Estimated Jaccard similarity of the word shingles above which two documents are near-duplicates
+DEDUP_THRESHOLD = float(os.getenv("SDG_DEDUP_THRESHOLD", 0.85))
+NUM_PERM = 128
+SHINGLE_WORDS = 3
+INDEX_SUFFIX = "_minhash.bin"
+# Fixed size records: the item ID (padded) and the signature
+ID_BYTES = 40
+TEMPLATE = "template"
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=4)
+def _permutations(num_perm: int, seed: int = 1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+    b = rng.randint(0, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+    return a, b
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS):
+    words = _WORD.findall(text.casefold())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text: str, num_perm: int = NUM_PERM) -> np.ndarray:
+    """
+    MinHash signature of the word shingles, one vectorized pass over all shingles and permutations
+    """
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles(text)], dtype=np.uint64)
+    if not len(hashes):
+        return np.full(num_perm, _MAX_HASH, dtype=np.uint32)
+    a, b = _permutations(num_perm)
+    with np.errstate(over="ignore"):
+        values = ((np.outer(hashes, a) + b) % _MERSENNE_PRIME) & _MAX_HASH
+    return values.min(axis=0).astype(np.uint32)
+
+
+def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    return float(np.mean(signature == other))
+
+
+def lsh_params(threshold: float, num_perm: int = NUM_PERM):
+    """
+    Bands and rows per band with the S-curve threshold (1 / bands) ** (1 / rows) closest to `threshold`
+    """
+    candidates = [(num_perm // rows, rows) for rows in range(1, num_perm + 1)]
+    return min(candidates, key=lambda p: abs((1 / p[0]) ** (1 / p[1]) - threshold))
+
+
+class DedupIndex:
+    """
+    Incremental MinHash-LSH index of the generated documents. The signatures are appended to a binary file
+    next to the output (fixed size records written with one O_APPEND write), so a resumed job loads them
+    instead of reading the documents again, and the shards of one job can share the file:
+    records appended by the other processes are picked up before every query
+    """
+
+    def __init__(self, path: str, threshold: float = DEDUP_THRESHOLD, num_perm: int = NUM_PERM):
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.record_bytes = ID_BYTES + 4 * num_perm
+        self.item_ids = []
+        self.signatures = []
+        self._buckets = [{} for _ in range(self.bands)]
+        self._offset = 0
+
+        meta_path = path + ".json"
+        meta = {"num_perm": num_perm, "shingle_words": SHINGLE_WORDS}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved != meta:
+                raise ValueError(f"The dedup index {path} was built with other parameters: {saved}")
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        self._file = open(path, "ab")
+        self.refresh()
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def refresh(self):
+        """
+        Loads the records appended since the last call, a record cut by a crash is ignored
+        """
+        size = os.path.getsize(self.path)
+        complete = size - (size - self._offset) % self.record_bytes
+        if complete <= self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = np.frombuffer(f.read(complete - self._offset), dtype=np.uint8).reshape(-1, self.record_bytes)
+        self._offset = complete
+        for record in data:
+            item_id = record[:ID_BYTES].tobytes().rstrip(b"\0").decode("utf-8")
+            self._insert(item_id, record[ID_BYTES:].view(np.uint32))
+
+    def _band_keys(self, signature: np.ndarray):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _insert(self, item_id: str, signature: np.ndarray):
+        position = len(self.item_ids)
+        self.item_ids.append(item_id)
+        self.signatures.append(signature)
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(position)
+
+    def query(self, signature: np.ndarray, exclude: str = None):
+        """
+        Returns (item_id, similarity) of the most similar indexed document above the threshold or None
+        """
+        self.refresh()
+        candidates = {position for bucket, key in zip(self._buckets, self._band_keys(signature))
+                      for position in bucket.get(key, ())}
+        best = None
+        for position in candidates:
+            if self.item_ids[position] == exclude:
+                continue
+            score = similarity(signature, self.signatures[position])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (self.item_ids[position], score)
+        return best
+
+    def add(self, item_id: str, signature: np.ndarray):
+        """
+        Appends the record to the file (flushed, the OS writes it on its own). The record is indexed when
+        it is read back with the records other processes appended before it, so the offset always matches the file
+        """
+        key = item_id.encode("utf-8")[:ID_BYTES].ljust(ID_BYTES, b"\0")
+        self._file.write(key + signature.astype(np.uint32).tobytes())
+        self._file.flush()
+        self.refresh()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class DuplicateChecker:
+    """
+    Finds near-duplicates of a generated document among the documents of the index and its template
+    """
+
+    def __init__(self, index: DedupIndex):
+        self.index = index
+        self._template_signature = lru_cache(maxsize=1024)(lambda text: minhash(text, index.num_perm))
+
+    def check(self, item_id: str, document: str, template: str = None):
+        """
+        Returns (duplicate_of, signature): the item ID of the similar document, "template" or ""
+        """
+        signature = minhash(document, self.index.num_perm)
+        if template is not None and similarity(signature, self._template_signature(template)) >= self.index.threshold:
+            return TEMPLATE, signature
+        match = self.index.query(signature, exclude=item_id)
+        return (match[0] if match else ""), signature
+
+    def add(self, item_id: str, signature: np.ndarray):
+        self.index.add(item_id, signature)
+
+    def close(self):
+        self.index.close()
+
+
+def open_checker(path: str, dedup_action: str = DEDUP_ACTION, threshold: float = DEDUP_THRESHOLD):
+    """
+    Returns None if the check is off
+    """
+    if dedup_action not in DEDUP_ACTIONS:
+        raise ValueError(f"Unknown dedup action {dedup_action!r}, use one of {DEDUP_ACTIONS}")
+    if dedup_action == "off":
+        return None
+    return DuplicateChecker(DedupIndex(path, threshold))
@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import random
+import hashlib
+import tempfile
+import numpy as np
+from collections import Counter
+from functools import lru_cache
+
+EXAMPLES_DIR = os.path.join("gen_data", ".examples")
+READ_CHUNK_BYTES = 4 * 1024 ** 2
+SAMPLE_RECORDS = 100
+
+_JSON_SPECIAL = re.compile(rb'[\[\]{}"\\]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+
+def scan_json_array(f, chunk_bytes: int = READ_CHUNK_BYTES):
+    """
+    Yields (start, end) byte offsets of the elements of a top level JSON array without parsing them.
+    Only brackets, braces, quotes and backslashes are looked at, the file is read in chunks
+    """
+    depth, in_string, escaped = 0, False, False
+    start = None
+    position = 0
+    while True:
+        chunk = f.read(chunk_bytes)
+        if not chunk:
+            break
+        i = 0
+        while i < len(chunk):
+            if escaped:
+                escaped = False
+                i += 1
+                continue
+            match = (_STRING_SPECIAL if in_string else _JSON_SPECIAL).search(chunk, i)
+            if match is None:
+                break
+            i = match.start()
+            char = chunk[i:i + 1]
+            if in_string:
+                if char == b"\\":
+                    escaped = True
+                else:
+                    in_string = False
+                    if depth == 1:
+                        yield start, position + i + 1
+            elif char == b'"':
+                in_string = True
+                if depth == 1:
+                    start = position + i
+            elif char in (b"{", b"["):
+                if depth == 1:
+                    start = position + i
+                depth += 1
+            elif char in (b"}", b"]"):
+                depth -= 1
+                if depth == 1:
+                    yield start, position + i + 1
+            i += 1
+        position += len(chunk)
+
+
+def scan_jsonl(f):
+    """
+    Yields (start, end) byte offsets of the non-empty lines
+    """
+    position = 0
+    for line in f:
+        if line.strip():
+            yield position, position + len(line)
+        position += len(line)
+
+
+def detect_keys(records: list):
+    """
+    Text key: "text" or the string field with the longest values, entities key: "entities" or the first list field
+    """
+    keys = Counter(key for record in records if isinstance(record, dict) for key in record)
+    if not keys:
+        return None, None, []
+    lengths = Counter()
+    for record in records:
+        if isinstance(record, dict):
+            for key, value in record.items():
+                if isinstance(value, str):
+                    lengths[key] += len(value)
+    text_key = "text" if "text" in keys else (lengths.most_common(1)[0][0] if lengths else None)
+    list_keys = [key for key in keys if any(isinstance(r, dict) and isinstance(r.get(key), list) for r in records)]
+    entities_key = "entities" if "entities" in keys else (list_keys[0] if list_keys else None)
+    return text_key, entities_key, [key for key, _ in keys.most_common()]
+
+
+class _FieldView:
+    """
+    Read-only sequence of one field of the examples, records are read from the file on access
+    """
+
+    def __init__(self, store, field: str):
+        self.store = store
+        self.field = field
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.store.get(i, self.field)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class ExampleStore:
+    """
+    Examples of a JSON array or JSONL file that stay on disk. The byte offsets of the records are saved
+    to `<file>.idx.npy` (with `<file>.idx.json` metadata) on the first open, then every access reads
+    only the requested records. Behaves like a list of example texts, `entities` is a list-like view
+    of the entities field
+    """
+
+    def __init__(self, path: str, offsets: np.ndarray, meta: dict, text_key: str = None, entities_key: str = None):
+        self.path = path
+        self.offsets = offsets
+        self.meta = meta
+        self.text_key = text_key or meta.get("text_key")
+        self.entities_key = entities_key or meta.get("entities_key")
+        self.entities = _FieldView(self, "entities")
+        self._read_record = lru_cache(maxsize=256)(self._read_record_uncached)
+
+    @classmethod
+    def open(cls, path: str, text_key: str = None, entities_key: str = None):
+        """
+        Loads the offset index of the file or builds it if the file is new or changed
+        """
+        meta_path, offsets_path = path + ".idx.json", path + ".idx.npy"
+        stat = os.stat(path)
+        meta = None
+        if os.path.exists(meta_path) and os.path.exists(offsets_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("size") != stat.st_size or meta.get("mtime") != stat.st_mtime:
+                meta = None
+        if meta is None:
+            meta = cls._build_index(path, offsets_path)
+            meta.update(size=stat.st_size, mtime=stat.st_mtime)
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+        store = cls(path, np.load(offsets_path, mmap_mode="r"), meta, text_key, entities_key)
+        if store.text_key not in meta["keys"] and meta["keys"]:
+            raise KeyError(f"Text key {store.text_key!r} is not in the examples, available keys: {meta['keys']}")
+        return store
+
+    @staticmethod
+    def _build_index(path: str, offsets_path: str):
+        with open(path, "rb") as f:
+            first = f.read(1024).lstrip()
+            f.seek(0)
+            is_array = first.startswith(b"[") and not path.endswith(".jsonl")
+            offsets = np.array(list(scan_json_array(f) if is_array else scan_jsonl(f)), dtype=np.uint64)
+        offsets = offsets.reshape(-1, 2)
+        np.save(offsets_path, offsets)
+
+        with open(path, "rb") as f:
+            sample = [json.loads(_read_range(f, start, end)) for start, end in offsets[:SAMPLE_RECORDS]]
+        text_key, entities_key, keys = detect_keys(sample)
+        return {"count": len(offsets), "text_key": text_key, "entities_key": entities_key, "keys": keys}
+
+    def with_keys(self, text_key: str = None, entities_key: str = None):
+        """
+        Store of the same file with other keys, the offset index is shared
+        """
+        return ExampleStore(self.path, self.offsets, self.meta, text_key or self.text_key,
+                            entities_key or self.entities_key)
+
+    @property
+    def keys(self):
+        return self.meta["keys"]
+
+    @property
+    def fingerprint(self):
+        """
+        Same value as `manifest.examples_fingerprint` of the list of texts, computed once per file and text key
+        """
+        fingerprints = self.meta.setdefault("fingerprints", {})
+        if str(self.text_key) not in fingerprints:
+            digest = hashlib.sha256()
+            for text in self:
+                digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+            fingerprints[str(self.text_key)] = digest.hexdigest()
+            with open(self.path + ".idx.json", "w", encoding="utf-8") as f:
+                json.dump(self.meta, f, ensure_ascii=False)
+        return fingerprints[str(self.text_key)]
+
+    def _read_record_uncached(self, i: int):
+        start, end = self.offsets[i]
+        with open(self.path, "rb") as f:
+            return json.loads(_read_range(f, int(start), int(end)))
+
+    def record(self, i: int):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Example index {i} is out of range")
+        return self._read_record(i)
+
+    def get(self, i: int, field: str = "text"):
+        record = self.record(i)
+        if isinstance(record, str):
+            return record if field == "text" else []
+        key = self.text_key if field == "text" else self.entities_key
+        return record.get(key, "" if field == "text" else [])
+
+    def sample(self, k: int = 1, rng: random.Random = random):
+        return [self[i] for i in rng.sample(range(len(self)), min(k, len(self)))]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.get(i, "text")
+
+    def __iter__(self):
+        # sequential scan without the record cache
+        with open(self.path, "rb") as f:
+            for start, end in self.offsets:
+                record = json.loads(_read_range(f, int(start), int(end)))
+                yield record if isinstance(record, str) else record.get(self.text_key, "")
+
+
+def _read_range(f, start: int, end: int):
+    f.seek(start)
+    return f.read(end - start)
+
+
+def save_upload(uploaded_file, folder: str = EXAMPLES_DIR):
+    """
+    Copies an uploaded file to disk in chunks, the file name is the hash of the content
+    """
+    os.makedirs(folder, exist_ok=True)
+    extension = ".jsonl" if uploaded_file.name.endswith(".jsonl") else ".json"
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    # the sessions of the app share the process, every upload gets its own temporary file
+    with tempfile.NamedTemporaryFile(dir=folder, prefix="upload-", suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+        while True:
+            chunk = uploaded_file.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    path = os.path.join(folder, digest.hexdigest()[:16] + extension)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+    return path
@@ -1,11 +1,18 @@
 # @markdown ## ▶️ Load file
 import os
-import json
+import uuid
 import random
 import streamlit as st
+import pandas as pd
+from time import sleep
+from html import escape
 from datetime import datetime
 
-from app_utils.openai_llm import generate_synthetic_data_batch, LANGUAGES
+from app_utils.examples import ExampleStore, save_upload
+from app_utils.jobs import get_job_registry
+from app_utils.leaks import LEAK_ACTION
+from app_utils.openai_llm import LANGUAGES
+from app_utils.writer import INDEX_FILE, read_output
 
 DOC1 = """
 John Doe is a smart person. He is a doctor. He works at the clinic. He lives in New York."""
@@ -17,6 +24,9 @@ DOC3 = """
 Send the parcel to DigitalOcean, 101 Avenue of the Americas, New York, NY 10013, USA."""
 ENTS3 = ["DigitalOcean", "101 Avenue of the Americas", "New York", "NY 10013", "USA"]
 
+# Refresh interval of the jobs view while a job is running
+JOB_POLL_SECONDS = 1.0
+
 
 def load_examples():
     if "file_json" not in st.session_state:
@@ -41,7 +51,7 @@ def load_examples():
 
     if st.session_state["file_json"] is None:
         st.write("""Please load a file with examples
-        File should be a JSON file with the following structure:
+        File should be a JSON file (or JSONL with one example per line) with the following structure:
         [
             {
                 "text": "Example text",
@@ -65,38 +75,30 @@ def load_examples():
             st.session_state["file_json"] = None
 
         with file_upload_placeholder:
-            file_json = st.file_uploader("Upload a JSON file", type=["json"])
-            main_key_name = "text"
-            entities_key_name = "entities"
+            file_json = st.file_uploader("Upload a JSON or JSONL file", type=["json", "jsonl"])
             if file_json:
-                data = json.load(file_json)
-                data_keys = data[0].keys()
+                store = _open_uploaded_examples(file_json)
+                data_keys = store.keys
+                main_key_name = store.text_key
+                entities_key_name = store.entities_key
 
                 with form_placeholder:
-                    if main_key_name not in data_keys:
-                        main_key_name = st.selectbox("Select the main key name", list(data_keys))
-
-                    if entities_key_name not in data_keys:
-                        entities_key_name = st.selectbox("Select the entities key name", list(data_keys))
+                    if data_keys:
+                        main_key_name = st.selectbox("Select the main key name", data_keys,
+                                                     index=data_keys.index(main_key_name)
+                                                     if main_key_name in data_keys else 0)
+                        entities_key_name = st.selectbox("Select the entities key name", data_keys,
+                                                         index=data_keys.index(entities_key_name)
+                                                         if entities_key_name in data_keys else 0)
 
                     submitted = st.button("Submit")
 
-                if submitted and main_key_name in data_keys:
-                    examples = []
-                    entities = []
-
-                    for item in data:
-                        example = item[main_key_name]
-                        entity_list = item[entities_key_name]
-                        examples.append(example)
-                        entities.append(entity_list)
-
-                    st.markdown(f"<p style='color: green;'>File loaded successfully with {len(examples)} examples.</p>",
+                if submitted:
+                    # the cached store is shared between sessions, the selected keys go to a copy
+                    store = store.with_keys(main_key_name, entities_key_name)
+                    st.markdown(f"<p style='color: green;'>File loaded successfully with {len(store)} examples.</p>",
                                 unsafe_allow_html=True)
-                    st.session_state["file_json"] = {"examples": examples, "entities": entities}
-
-                elif submitted:
-                    st.warning("Please select the main key name")
+                    st.session_state["file_json"] = {"examples": store, "entities": store.entities}
 
     if st.session_state["file_json"] and not st.session_state["random_example"]:
         st.session_state["random_example"] = random.choice(st.session_state["file_json"]["examples"])
@@ -114,6 +116,25 @@ def load_examples():
             st.write({"Examples": ex, "Entities": ent})
 
 
+def _open_uploaded_examples(uploaded_file):
+    """
+    The upload is saved to disk and indexed once, reruns reuse the store of the same upload
+    """
+    upload_key = (uploaded_file.name, uploaded_file.size, getattr(uploaded_file, "file_id", None))
+    if st.session_state.get("examples_upload") != upload_key:
+        st.session_state["examples_path"] = save_upload(uploaded_file)
+        st.session_state["examples_upload"] = upload_key
+    return _open_example_store(st.session_state["examples_path"])
+
+
+@st.cache_resource(show_spinner="Indexing the examples...")
+def _open_example_store(path: str):
+    """
+    One read-only store per file for all sessions, the file name is the hash of its content
+    """
+    return ExampleStore.open(path)
+
+
 def setup_augmentations():
     # @markdown ## ▶️ Add augmentations below
     # @markdown  - Leave the field blank if you want to disable the augmentation
@@ -163,12 +184,17 @@ def _generate_html_with_random_example(example):
     return html
 
 
+def _generate_html_with_partial_document(text):
+    html = f"<p style='color: green;'>✍️ Generating...</p><p style='white-space: pre-wrap;'>{escape(text)}</p>"
+    return html
+
+
 def generate_synthetic_data_ui():
     if "file_json" not in st.session_state or st.session_state["file_json"] is None:
         st.warning("Please load a file with examples first")
         return
     if "data_file" not in st.session_state or st.session_state["data_file"] is None:
-        st.session_state["data_file"] = f"generated_data_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.csv"
+        st.session_state["data_file"] = f"generated_data_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
 
     examples = st.session_state["file_json"]["examples"]
     entities = st.session_state["file_json"]["entities"]
@@ -187,42 +213,104 @@ def generate_synthetic_data_ui():
                               min_value=1, value=4, max_value=10, step=1)
         gpt4_share = st.slider("GPT-4 share: select 0 for GPT-3.5 Turbo for all examples, 1 for GPT-4.0 for all",
                                min_value=0.0, max_value=1.0, value=0.5, step=0.1)
+        regenerate_leaks = st.checkbox("Regenerate documents that contain entities of the examples",
+                                       value=LEAK_ACTION == "regenerate")
 
         # Default values
         save_every = 10  # st.number_input("Save every", min_value=1, value=10)
         data_file = st.session_state["data_file"]
 
     if st.button("Generate synthetic data"):
-        st.info("Please wait while the data is being generated...")
-        col1, col2 = st.columns((6, 1))
-        with col2:
-            status_placeholder = st.empty()
-            progress = st.progress(0)
+        try:
+            get_job_registry().submit(examples, data_size, data_file,
+                                      owner=_get_session_id(),
+                                      stream=True,
+                                      gpt4_share=gpt4_share,
+                                      save_every=save_every,
+                                      augmentations=augmentations,
+                                      language=language,
+                                      entities=entities,
+                                      leak_action="regenerate" if regenerate_leaks else LEAK_ACTION)
+            # the next job of the session writes to a new file
+            st.session_state["data_file"] = None
+        except ValueError as e:
+            st.warning(str(e))
 
-        with col1:
-            with st.spinner("Generating synthetic data..."):
-                for i in range(data_size):
-                    with status_placeholder:
-                        st.markdown(f"<p style='color: green;'>Generating example {i + 1} / {data_size}</p>",
-                                    unsafe_allow_html=True)
-                    progress.progress((i + 1) / data_size)
-                    data = generate_synthetic_data_batch(examples,
-                                                         1,
-                                                         data_file,
-                                                         gpt4_share,
-                                                         save_every,
-                                                         augmentations,
-                                                         language)
-
-                st.markdown(f"<p style='color: green;'>Data generated successfully with {data_size} examples.</p>",
-                            unsafe_allow_html=True)
-
-        st.success("Data generated successfully!")
-        st.dataframe(data)
-
-        st.download_button(
-            label="Download data",
-            data=data.to_csv(index=False),
-            file_name=data_file,
-            mime="text/csv"
-        )
+    show_jobs()
+
+
+def _get_session_id():
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+    return st.session_state["session_id"]
+
+
+def _rerun():
+    rerun = getattr(st, "rerun", None) or st.experimental_rerun
+    rerun()
+
+
+def _output_mtime(path: str):
+    return os.path.getmtime(os.path.join(path, INDEX_FILE) if os.path.isdir(path) else path)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _output_csv(path: str, mtime: float) -> bytes:
+    """
+    Csv bytes of a data file for the download button, read again only when the file changes
+    (the jobs view reruns every second while a job is running). Csv files are sent as they are
+    """
+    if not os.path.isdir(path) and path.endswith(".csv"):
+        with open(path, "rb") as f:
+            return f.read()
+    return read_output(path).to_csv(index=False).encode("utf-8")
+
+
+def show_jobs():
+    """
+    Progress, partial results and controls of the background jobs of the session.
+    The page polls the registry while any of the jobs is running
+    """
+    registry = get_job_registry()
+    jobs = registry.list(owner=_get_session_id())
+    if not jobs:
+        return
+
+    st.markdown("<h4 style='text-align: center; color: green;'>⏳ Jobs</h4>", unsafe_allow_html=True)
+    for job in jobs:
+        snapshot = job.snapshot()
+        title = f"{job.data_file} | {snapshot['status']} | {snapshot['completed']} / {snapshot['total']}"
+        with st.expander(title, expanded=job.is_active):
+            col1, col2 = st.columns((6, 1))
+            with col1:
+                st.progress(job.progress)
+                if job.partial_document:
+                    st.markdown(_generate_html_with_partial_document(job.partial_document), unsafe_allow_html=True)
+                if job.rows:
+                    st.dataframe(pd.DataFrame(list(job.rows)))
+                if job.error:
+                    st.error(job.error)
+                if job.status == "done":
+                    st.success(f"Data generated successfully with {snapshot['completed']} examples "
+                               f"in {snapshot['elapsed']:.0f} seconds.")
+                    st.download_button(label="Download data",
+                                       data=_output_csv(job.result, _output_mtime(job.result)),
+                                       file_name=f"{os.path.splitext(job.data_file)[0]}.csv",
+                                       mime="text/csv",
+                                       key=f"download_{job.job_id}")
+            with col2:
+                if job.is_active and st.button("Cancel", key=f"cancel_{job.job_id}"):
+                    registry.cancel(job.job_id)
+                if job.status in ("cancelled", "failed") and st.button("Resume", key=f"resume_{job.job_id}"):
+                    try:
+                        registry.resume(job.job_id)
+                        _rerun()
+                    except ValueError as e:
+                        st.warning(str(e))
+                if not job.is_active and st.button("Remove", key=f"remove_{job.job_id}"):
+                    registry.remove(job.job_id)
+                    _rerun()
+
+    if any(job.is_active for job in jobs):
+        sleep(JOB_POLL_SECONDS)
+        _rerun()
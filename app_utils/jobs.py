@@ -0,0 +1,184 @@
+import os
+import uuid
+import threading
+from time import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from app_utils.openai_llm import generate_synthetic_data_batch
+
+# Jobs running at the same time in the process, the others wait in the queue
+MAX_JOBS = int(os.getenv("SDG_MAX_JOBS", 4))
+# Last rows kept in memory for the progress view
+PREVIEW_ROWS = 100
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    State of one background generation job, updated by the worker thread and read by the pages
+    """
+
+    def __init__(self, job_id: str, data_file: str, total: int, owner: str = None, params: dict = None):
+        self.job_id = job_id
+        self.data_file = data_file
+        self.total = total
+        self.owner = owner
+        self.params = params or {}
+        self.status = "queued"
+        self.completed = 0
+        self.rows = deque(maxlen=PREVIEW_ROWS)
+        self.partial_document = ""
+        self.result = None
+        self.error = None
+        self.created = time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def is_active(self):
+        return self.status in ACTIVE_STATUSES
+
+    @property
+    def progress(self):
+        return min(self.completed / self.total, 1.0) if self.total else 0.0
+
+    def cancel(self):
+        """
+        The job stops after the item in flight, its manifest keeps the pending items for a resume
+        """
+        self.cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.status = "cancelled"
+            self.finished = time()
+
+    def snapshot(self):
+        return {"job_id": self.job_id,
+                "data_file": self.data_file,
+                "status": self.status,
+                "completed": self.completed,
+                "total": self.total,
+                "error": self.error,
+                "elapsed": (self.finished or time()) - (self.started or self.created)}
+
+
+class JobRegistry:
+    """
+    Runs generation jobs in a thread pool that outlives the Streamlit script runs.
+    The registry is shared by all sessions of the process, every job is found by its ID
+    """
+
+    def __init__(self, max_jobs: int = MAX_JOBS):
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="sdg-job")
+        self.jobs = {}
+
+    def submit(self, examples: list, data_size: int, data_file: str, owner: str = None, stream: bool = False,
+               **kwargs) -> Job:
+        """
+        Starts `generate_synthetic_data_batch` in the background, `kwargs` are passed to it.
+        With `stream` the document in progress is available as `job.partial_document`
+        """
+        with self._lock:
+            if any(job.data_file == data_file and job.is_active for job in self.jobs.values()):
+                raise ValueError(f"A job is already writing to {data_file}")
+            job = Job(uuid.uuid4().hex[:12], data_file, data_size, owner,
+                      params=dict(examples=examples, stream=stream, **kwargs))
+            self.jobs[job.job_id] = job
+            job.future = self._executor.submit(self._run, job, examples, data_size, data_file, stream, kwargs)
+        return job
+
+    def resume(self, job_id: str) -> Job:
+        """
+        Submits a new job that continues the cancelled or failed job from its manifest
+        """
+        job = self.get(job_id)
+        if job is None:
+            raise ValueError(f"Unknown job {job_id}")
+        if job.is_active:
+            raise ValueError(f"The job {job_id} is still running")
+        params = {**job.params, "resume": True}
+        resumed = self.submit(data_size=job.total, data_file=job.data_file, owner=job.owner, **params)
+        # the items saved by the previous runs count too
+        resumed.completed = job.completed
+        # the old job is forgotten only once the new one is submitted
+        self.remove(job_id)
+        return resumed
+
+    @staticmethod
+    def _run(job: Job, examples: list, data_size: int, data_file: str, stream: bool, kwargs: dict):
+        if job.cancel_event.is_set():
+            return
+        job.status = "running"
+        job.started = time()
+
+        def track_item(row, elapsed_time):
+            job.rows.append(row)
+            job.completed += 1
+            job.partial_document = ""
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+
+        def track_delta(text):
+            job.partial_document = text
+
+        try:
+            job.result = generate_synthetic_data_batch(examples, data_size, data_file,
+                                                       return_dataframe=False,
+                                                       verbose=False,
+                                                       on_item=track_item,
+                                                       on_delta=track_delta if stream else None,
+                                                       **kwargs)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            print(f"\033[091mJob {job.job_id} failed: {job.error}\033[0m")
+        finally:
+            job.finished = time()
+
+    def get(self, job_id: str) -> Job:
+        return self.jobs.get(job_id)
+
+    def list(self, owner: str = None):
+        with self._lock:
+            jobs = [job for job in self.jobs.values() if owner is None or job.owner == owner]
+        return sorted(jobs, key=lambda job: job.created, reverse=True)
+
+    def cancel(self, job_id: str):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def remove(self, job_id: str):
+        """
+        Forgets a finished job, the data file stays on disk
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None and not job.is_active:
+                del self.jobs[job_id]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_job_registry() -> JobRegistry:
+    """
+    Returns the process-wide registry, Streamlit keeps the module (and the running jobs) between reruns
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = JobRegistry()
+        return _registry
@@ -0,0 +1,122 @@
+import os
+import re
+from collections import deque
+
+# "flag" saves leaking documents with the `leaked_entities` column, "regenerate" requests them again
+# (up to LEAK_RETRIES times, then they are saved with the flag), "off" (the default) skips the check
+LEAK_ACTIONS = ("off", "flag", "regenerate")
+LEAK_ACTION = os.getenv("SDG_LEAK_ACTION", "off")
+LEAK_RETRIES = int(os.getenv("SDG_LEAK_RETRIES", 2))
+# Shorter entities ("a", "NY") match too many unrelated words
+MIN_ENTITY_CHARS = int(os.getenv("SDG_MIN_ENTITY_CHARS", 3))
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """
+    Case and whitespace insensitive form used for both the entities and the documents
+    """
+    return _SPACES.sub(" ", text.casefold()).strip()
+
+
+def _entity_text(entity):
+    # entities are strings or {"text": ..., "label": ...} objects
+    if isinstance(entity, dict):
+        entity = entity.get("text") or entity.get("value")
+    return entity if isinstance(entity, str) else None
+
+
+class EntityMatcher:
+    """
+    Aho-Corasick automaton over the source entities: it is built once per job and finds all entities
+    in a document in one pass over its characters, whatever the number of entities.
+    Matches must start and end at word boundaries
+    """
+
+    def __init__(self, entities):
+        self.entities = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        seen = set()
+        for entity in entities:
+            text = _entity_text(entity)
+            pattern = normalize(text) if text else ""
+            if len(pattern) < MIN_ENTITY_CHARS or pattern in seen:
+                continue
+            seen.add(pattern)
+            self._add(pattern, len(self.entities))
+            self.entities.append(_SPACES.sub(" ", text).strip())
+        self._pattern_lengths = [len(normalize(entity)) for entity in self.entities]
+        self._build_links()
+
+    @classmethod
+    def from_examples(cls, entities_lists):
+        """
+        Matcher over the entities of all examples (a list of entity lists, e.g. `ExampleStore.entities`)
+        """
+        return cls(entity for entities in entities_lists if entities for entity in entities)
+
+    def _add(self, pattern: str, index: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] = (index,)
+
+    def _build_links(self):
+        # breadth-first, the failure link of a state points to a shallower state
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                if state:
+                    fail = self._fail[state]
+                    while fail and char not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    self._fail[next_state] = self._goto[fail].get(char, 0)
+                # every entity that is a suffix of the current one matches too
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def __len__(self):
+        return len(self.entities)
+
+    def find(self, text: str) -> list:
+        """
+        Source entities found in the text, in the order of their first occurrence
+        """
+        if not self.entities or not text:
+            return []
+        text = normalize(text)
+        goto, fail, output = self._goto, self._fail, self._output
+        found = {}
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                start = end - self._pattern_lengths[index]
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    found.setdefault(index, start)
+        return [self.entities[index] for index in sorted(found, key=found.get)]
+
+
+def build_matcher(entities_lists, leak_action: str = LEAK_ACTION):
+    """
+    Returns None if the check is off or there are no entities
+    """
+    if leak_action not in LEAK_ACTIONS:
+        raise ValueError(f"Unknown leak action {leak_action!r}, use one of {LEAK_ACTIONS}")
+    if leak_action == "off" or entities_lists is None:
+        return None
+    matcher = EntityMatcher.from_examples(entities_lists)
+    return matcher if len(matcher) else None
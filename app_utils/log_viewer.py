@@ -0,0 +1,362 @@
+import io
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from collections import Counter, OrderedDict
+
+from app_utils.writer import INDEX_FILE, iter_output, read_index
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Columns counted in the summary of a data file
+SUMMARY_COLUMNS = ('model', 'augmentation', 'language')
+ROWS_SUFFIX = ".rows"
+STATS_FILE = "_viewer_stats.json"
+READ_CHUNK_BYTES = 4 * 1024 ** 2
+# Rows parsed at once while the stats are updated or the rows are searched
+SCAN_ROWS = 20_000
+# Decoded Parquet row groups / JSONL parts kept in memory by a dataset view
+CACHED_BLOCKS = 8
+
+_QUOTE, _NEWLINE = ord('"'), ord("\n")
+
+
+def scan_csv_rows(f, start: int, chunk_bytes: int = READ_CHUNK_BYTES):
+    """
+    Yields the end offsets of the complete csv rows after `start` (which must be a row start).
+    A newline ends a row only outside of quoted fields: the parity of the quotes before it is even.
+    Quotes and newlines are found with NumPy, one chunk at a time
+    """
+    f.seek(start)
+    position, quotes = start, 0
+    while True:
+        chunk = f.read(chunk_bytes)
+        if not chunk:
+            break
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        quote_counts = np.cumsum(data == _QUOTE) + quotes
+        newlines = np.flatnonzero(data == _NEWLINE)
+        yield from (position + newlines[quote_counts[newlines] % 2 == 0] + 1).tolist()
+        quotes = int(quote_counts[-1]) if len(quote_counts) else quotes
+        position += len(chunk)
+
+
+def _update_stats(stats: dict, df: pd.DataFrame, rows: int = None):
+    stats['rows'] = stats.get('rows', 0) + (len(df) if rows is None else rows)
+    for column in SUMMARY_COLUMNS:
+        if column in df.columns:
+            counts = Counter(stats.get(column, {}))
+            counts.update(df[column].fillna("").astype(str).tolist())
+            stats[column] = dict(counts)
+    if 'cost' in df.columns:
+        stats['cost'] = stats.get('cost', 0.0) + float(pd.to_numeric(df['cost'], errors="coerce").fillna(0).sum())
+    return stats
+
+
+def _matches(df: pd.DataFrame, query: str):
+    text = df.astype(str)
+    mask = np.zeros(len(df), dtype=bool)
+    for column in text.columns:
+        mask |= text[column].str.contains(query, case=False, regex=False).to_numpy()
+    return df[mask]
+
+
+class CsvView:
+    """
+    Paged access to a csv data file. The byte offsets of the rows are appended to `<file>.rows`
+    (raw uint64, with `<file>.rows.json` metadata) and extended when the file grows, so opening
+    a file again only scans the new rows. The row counts by model, augmentation and language
+    are updated the same way. Reading a page parses only its rows
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets_path = path + ROWS_SUFFIX
+        self.meta_path = self.offsets_path + ".json"
+        self.meta = None
+        self.offsets = np.zeros(0, dtype=np.uint64)
+        # the view is shared by the sessions of the app
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def columns(self):
+        return self.meta['columns']
+
+    @property
+    def stats(self):
+        return self.meta['stats']
+
+    def __len__(self):
+        return max(len(self.offsets) - 1, 0)
+
+    def _read_header(self):
+        with open(self.path, "rb") as f:
+            header = f.readline()
+        return header
+
+    def refresh(self):
+        """
+        Indexes the rows appended since the last call, the index is rebuilt if the file was replaced
+        """
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        size = os.path.getsize(self.path)
+        header = self._read_header()
+        if self.meta is None and os.path.exists(self.meta_path) and os.path.exists(self.offsets_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+            self.offsets = np.fromfile(self.offsets_path, dtype=np.uint64)
+        if self.meta is None or self.meta['header'] != header.decode("utf-8") or size < self.meta['indexed_bytes'] \
+                or len(self.offsets) != self.meta['rows'] + 1:
+            columns = pd.read_csv(io.BytesIO(header), nrows=0).columns.tolist() if header.strip() else []
+            self.meta = {'header': header.decode("utf-8"), 'columns': columns, 'indexed_bytes': len(header),
+                         'rows': 0, 'stats': {}}
+            self.offsets = np.array([len(header)], dtype=np.uint64)
+            self.offsets.tofile(self.offsets_path)
+        if size == self.meta['indexed_bytes']:
+            return self
+
+        with open(self.path, "rb") as f:
+            ends = np.fromiter(scan_csv_rows(f, self.meta['indexed_bytes']), dtype=np.uint64)
+        if not len(ends):
+            return self
+        first_new = len(self)
+        with open(self.offsets_path, "ab") as f:
+            f.write(ends.tobytes())
+        self.offsets = np.concatenate([self.offsets, ends])
+        summary_columns = [c for c in self.columns if c in SUMMARY_COLUMNS + ('cost',)]
+        for start in range(first_new, len(self), SCAN_ROWS):
+            stop = min(start + SCAN_ROWS, len(self))
+            df = self.page(start, stop, summary_columns) if summary_columns else pd.DataFrame()
+            _update_stats(self.meta['stats'], df, rows=stop - start)
+        self.meta.update(indexed_bytes=int(ends[-1]), rows=len(self))
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+        return self
+
+    def _read_rows(self, start: int, stop: int):
+        with open(self.path, "rb") as f:
+            f.seek(int(self.offsets[start]))
+            return f.read(int(self.offsets[stop]) - int(self.offsets[start]))
+
+    def page(self, start: int, stop: int, columns: list = None) -> pd.DataFrame:
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return pd.DataFrame(columns=columns or self.columns)
+        data = self.meta['header'].encode("utf-8") + self._read_rows(start, stop)
+        df = pd.read_csv(io.BytesIO(data), usecols=columns)
+        df.index = range(start, start + len(df))
+        return df
+
+    def search(self, query: str, columns: list = None, start: int = 0, limit: int = 100):
+        """
+        Rows from `start` that contain `query` (case insensitive) in the shown columns.
+        Rows without the query in their raw bytes are skipped before parsing.
+        Returns the found rows and the row to continue from (None at the end of the file)
+        """
+        # bytes.lower() changes only ascii letters, other queries are looked for in the decoded rows
+        needle = query.lower().encode("utf-8") if query.isascii() else query.lower()
+        found, count = [], 0
+        for chunk_start in range(start, len(self), SCAN_ROWS):
+            chunk_stop = min(chunk_start + SCAN_ROWS, len(self))
+            data = self._read_rows(chunk_start, chunk_stop)
+            bounds = (self.offsets[chunk_start:chunk_stop + 1] - self.offsets[chunk_start]).astype(np.int64).tolist()
+            rows = [data[bounds[i]:bounds[i + 1]] for i in range(chunk_stop - chunk_start)]
+            candidates = [i for i, row in enumerate(rows)
+                          if needle in (row.lower() if query.isascii() else row.decode("utf-8", "replace").lower())]
+            if not candidates:
+                continue
+            df = pd.read_csv(io.BytesIO(self.meta['header'].encode("utf-8") + b"".join(rows[i] for i in candidates)),
+                             usecols=columns)
+            df.index = [chunk_start + i for i in candidates]
+            df = _matches(df, query)
+            found.append(df)
+            count += len(df)
+            if count >= limit:
+                df = pd.concat(found)
+                return df.iloc[:limit], int(df.index[limit - 1]) + 1
+        return (pd.concat(found) if found else pd.DataFrame(columns=columns or self.columns)), None
+
+
+class DatasetView:
+    """
+    Paged access to a partitioned dataset: the row counts of the parts are in its index, a page reads
+    only the blocks it overlaps: the row groups of Parquet parts (only the shown columns) or whole JSONL parts.
+    The last decoded blocks are kept in memory, the parts don't change once written. Part stats are computed once
+    per part and saved to `_viewer_stats.json`, the rows appended to the pending file are read on every refresh
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = None
+        self._pending_path = None
+        self._pending_offset = 0
+        # (part, row group, rows) of the parts, the footer of a Parquet part is read once
+        self._part_blocks = {}
+        self._blocks = OrderedDict()
+        # the view is shared by the sessions of the app, the refresh reads the blocks of the new parts
+        self._lock = threading.RLock()
+        self.refresh()
+
+    @property
+    def columns(self):
+        return self.index['columns']
+
+    def __len__(self):
+        return int(self.bounds[-1])
+
+    def _refresh_pending(self):
+        pending_path = os.path.join(self.path, f"_pending-{len(self.index['parts']):05d}.jsonl")
+        size = os.path.getsize(pending_path) if os.path.exists(pending_path) else 0
+        if pending_path != self._pending_path or size < self._pending_offset:
+            # the pending rows were compacted into a part
+            self._pending_path, self._pending_offset = pending_path, 0
+            self.pending = pd.DataFrame(columns=self.columns)
+        if size == self._pending_offset:
+            return
+        with open(pending_path, "rb") as f:
+            f.seek(self._pending_offset)
+            data = f.read(size - self._pending_offset)
+        # the last line can be still being written
+        data = data[:data.rfind(b"\n") + 1]
+        rows = []
+        for line in data.splitlines():
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        self._pending_offset += len(data)
+        if rows:
+            new_rows = pd.DataFrame(rows, columns=self.columns)
+            self.pending = pd.concat([self.pending, new_rows], ignore_index=True) if len(self.pending) else new_rows
+
+    def _blocks_of_part(self, number: int):
+        part = self.index['parts'][number]
+        if part['file'] not in self._part_blocks:
+            if self.index['format'] == "parquet":
+                metadata = pq.ParquetFile(os.path.join(self.path, part['file'])).metadata
+                groups = [(number, group, metadata.row_group(group).num_rows)
+                          for group in range(metadata.num_row_groups)]
+            else:
+                groups = [(number, None, part['rows'])]
+            self._part_blocks[part['file']] = groups
+        return self._part_blocks[part['file']]
+
+    def refresh(self):
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        self.index = read_index(self.path)
+        self._refresh_pending()
+        self.blocks = [block for number in range(len(self.index['parts'])) for block in self._blocks_of_part(number)]
+        self.blocks.append((len(self.index['parts']), None, len(self.pending)))
+        self.bounds = np.cumsum([0] + [rows for _, _, rows in self.blocks])
+
+        stats_path = os.path.join(self.path, STATS_FILE)
+        part_stats = {}
+        if os.path.exists(stats_path):
+            with open(stats_path, "r", encoding="utf-8") as f:
+                part_stats = json.load(f)
+        changed = False
+        summary_columns = [c for c in self.columns if c in SUMMARY_COLUMNS + ('cost',)]
+        for number, part in enumerate(self.index['parts']):
+            if part['file'] not in part_stats:
+                # a JSONL part is one block, the pages of the new part are read from memory afterwards
+                df = self._read_part(number, summary_columns) if self.index['format'] == "parquet" \
+                    else self._read_block(number, summary_columns)
+                part_stats[part['file']] = _update_stats({}, df)
+                changed = True
+        if changed:
+            with open(stats_path, "w", encoding="utf-8") as f:
+                json.dump(part_stats, f, ensure_ascii=False)
+
+        self.stats = _update_stats({}, self.pending)
+        for stats in part_stats.values():
+            self.stats['rows'] += stats.get('rows', 0)
+            self.stats['cost'] = self.stats.get('cost', 0.0) + stats.get('cost', 0.0)
+            for column in SUMMARY_COLUMNS:
+                if column in stats:
+                    self.stats[column] = dict(Counter(self.stats.get(column, {})) + Counter(stats[column]))
+        return self
+
+    def _read_part(self, number: int, columns: list = None):
+        return next(iter_output(self.path, columns=columns, parts=[number]))
+
+    def _read_block(self, block: int, columns: list = None):
+        number, group, _ = self.blocks[block]
+        if number == len(self.index['parts']):
+            return self.pending[columns] if columns else self.pending
+        # a JSONL part is decoded whole whatever the columns, the stats and all pages share it
+        key = (number, group, tuple(columns or ())) if group is not None else (number, None, ())
+        with self._lock:
+            df = self._blocks.get(key)
+            if df is not None:
+                self._blocks.move_to_end(key)
+            else:
+                df = self._decode_block(number, group, columns)
+                self._blocks[key] = df
+                while len(self._blocks) > CACHED_BLOCKS:
+                    self._blocks.popitem(last=False)
+        return df.reindex(columns=columns) if columns and group is None else df
+
+    def _decode_block(self, number: int, group: int = None, columns: list = None):
+        if group is None:
+            return self._read_part(number)
+        parquet = pq.ParquetFile(os.path.join(self.path, self.index['parts'][number]['file']))
+        # columns missing from a part are read as empty, like in `iter_output`
+        present = [c for c in columns if c in parquet.schema_arrow.names] if columns else None
+        df = parquet.read_row_group(group, columns=present).to_pandas()
+        return df.reindex(columns=columns) if columns else df
+
+    def page(self, start: int, stop: int, columns: list = None) -> pd.DataFrame:
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return pd.DataFrame(columns=columns or self.columns)
+        chunks = []
+        first = int(np.searchsorted(self.bounds, start, side="right")) - 1
+        last = int(np.searchsorted(self.bounds, stop - 1, side="right")) - 1
+        for block in range(first, last + 1):
+            df = self._read_block(block, columns)
+            chunks.append(df.iloc[max(start - self.bounds[block], 0):stop - self.bounds[block]])
+        df = pd.concat(chunks, ignore_index=True)
+        df.index = range(start, start + len(df))
+        return df
+
+    def search(self, query: str, columns: list = None, start: int = 0, limit: int = 100):
+        found = []
+        position = start
+        while position < len(self):
+            block = int(np.searchsorted(self.bounds, position, side="right")) - 1
+            stop = int(self.bounds[block + 1])
+            df = _matches(self.page(position, stop, columns), query)
+            found.append(df)
+            if sum(len(d) for d in found) >= limit:
+                df = pd.concat(found)
+                return df.iloc[:limit], int(df.index[limit - 1]) + 1
+            position = stop
+        return (pd.concat(found) if found else pd.DataFrame(columns=columns or self.columns)), None
+
+
+def list_data_files(folder: str):
+    """
+    Csv data files and partitioned datasets of the folder, newest first
+    """
+    paths = [os.path.join(folder, name) for name in os.listdir(folder)]
+    paths = [p for p in paths if (p.endswith(".csv") and os.path.isfile(p))
+             or (os.path.isdir(p) and os.path.exists(os.path.join(p, INDEX_FILE)))]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def open_view(path: str):
+    return DatasetView(path) if os.path.isdir(path) else CsvView(path)
@@ -2,24 +2,72 @@ import os
 import streamlit as st
 import pandas as pd
 from app_utils.st_auth import auth_basic
+from app_utils.log_viewer import SUMMARY_COLUMNS, list_data_files, open_view
 
 LOGS_OLD = "./logs"
 LOGS = "./gen_data"
 ADMIN = "mary"
+PAGE_SIZES = (50, 100, 500)
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _get_view(path: str):
+    return open_view(path)
+
+
+def show_stats(stats: dict):
+    st.markdown(f"**{stats.get('rows', 0)}** rows, cost **${stats.get('cost', 0.0):.4f}**")
+    columns = st.columns(len(SUMMARY_COLUMNS))
+    for column, name in zip(columns, SUMMARY_COLUMNS):
+        if stats.get(name):
+            counts = pd.Series(stats[name], name="rows").sort_values(ascending=False)
+            column.dataframe(counts.rename_axis(name), use_container_width=True)
+
+
+def _turn_filter_page(state: dict, step: int, next_start: int = None):
+    if step > 0:
+        state["starts"] = state["starts"][:state["page"] + 1] + [next_start]
+    state["page"] += step
 
 
 def show_logs():
     """
-    - File selector for dir ./gen_data/*.csv
-    - Read selected file and display it as a dataframe
+    - File selector for dir ./gen_data/*.csv and partitioned datasets (Parquet / JSONL.gz parts)
+    - Summary stats and one page of the selected file, with column projection and text filtering.
+      Rows are read through the row offset index of the file, only the shown page is in memory
     """
-    logs = [os.path.join(LOGS, f) for f in os.listdir(LOGS)]
-    log_keys = [f.split("_")[-1].replace(".csv", "") for f in logs]
+    logs = list_data_files(LOGS)
+    if not logs:
+        st.info("No data files yet")
+        return
+    log = st.selectbox("Выберите лог", logs, format_func=os.path.basename)
+
+    view = _get_view(log).refresh()
+    show_stats(view.stats)
 
-    log_key = st.selectbox("Выберите лог", log_keys)
-    log = [f for f in logs if log_key in f][0]
+    col1, col2, col3 = st.columns((4, 2, 1))
+    with col1:
+        columns = st.multiselect("Columns", view.columns, default=view.columns, key=f"columns_{log}")
+    with col2:
+        query = st.text_input("Filter", key=f"query_{log}").strip()
+    with col3:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, key=f"page_size_{log}")
+    columns = columns or view.columns
 
-    df = pd.read_csv(log)
+    if query:
+        # pages of the filtered rows are found one after another, the starts of the visited pages are kept
+        state = st.session_state.setdefault(f"filter_{log}", {})
+        if state.get("query") != (query, tuple(columns)):
+            state.update(query=(query, tuple(columns)), starts=[0], page=0)
+        df, next_start = view.search(query, columns, start=state["starts"][state["page"]], limit=page_size)
+        col1, col2, col3 = st.columns((1, 1, 4))
+        col1.button("Previous page", on_click=_turn_filter_page, args=(state, -1), disabled=state["page"] == 0)
+        col2.button("Next page", on_click=_turn_filter_page, args=(state, 1, next_start), disabled=next_start is None)
+        col3.caption(f"Rows matching '{query}', page {state['page'] + 1}" + (" (last)" if next_start is None else ""))
+    else:
+        pages = max(-(-len(view) // page_size), 1)
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"page_{log}") - 1
+        df = view.page(page * page_size, (page + 1) * page_size, columns)
     st.dataframe(df, width=1000, use_container_width=True)
 
 
@@ -0,0 +1,142 @@
+import os
+import json
+import uuid
+import hashlib
+from datetime import datetime
+
+MANIFEST_SUFFIX = "_manifest.jsonl"
+DONE_SUFFIX = "_done.log"
+ITEM_FIELDS = ("item_id", "example_index", "augmentation", "model", "language")
+
+
+def examples_fingerprint(examples: list) -> str:
+    """
+    Resuming is allowed only with the same examples, the plan refers to them by index
+    """
+    if hasattr(examples, "fingerprint"):
+        # ExampleStore computes it once per file
+        return examples.fingerprint
+    digest = hashlib.sha256()
+    for example in examples:
+        digest.update(hashlib.sha256(example.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+def plan_job_id(examples: list, **params) -> str:
+    """
+    Job ID of a seeded plan, the same for all shards and restarts of the job
+    """
+    digest = hashlib.sha256(examples_fingerprint(examples).encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+class JobManifest:
+    """
+    Planned items of a generation job: example index, augmentation, model and language with a stable item ID.
+    The manifest is a JSONL file next to the data file: the header line with the job parameters and one line
+    per item. IDs of the saved items are appended to the small `_done.log` file, so the completed set
+    is known without reading the data file
+    """
+
+    def __init__(self, path: str, header: dict, items: list, fsync_every: int = 10):
+        self.path = path
+        self.done_path = path[:-len(MANIFEST_SUFFIX)] + DONE_SUFFIX if path.endswith(MANIFEST_SUFFIX) \
+            else path + DONE_SUFFIX
+        self.header = header
+        self.items = items
+        self.fsync_every = max(fsync_every, 1)
+        self.done = self._read_done(self.done_path)
+        self._done_file = None
+        self._marked = 0
+
+    @staticmethod
+    def path_for(data_path: str) -> str:
+        return os.path.splitext(data_path)[0] + MANIFEST_SUFFIX
+
+    @property
+    def job_id(self) -> str:
+        return self.header["job_id"]
+
+    @property
+    def is_complete(self) -> bool:
+        return all(item["item_id"] in self.done for item in self.items)
+
+    @classmethod
+    def create(cls, path: str, items: list, examples: list = None, fsync_every: int = 10, job_id: str = None,
+               **params):
+        """
+        Assigns IDs to the planned items (items with `item_id` keep it) and writes a new manifest,
+        the done log of the previous job is removed
+        """
+        job_id = job_id or uuid.uuid4().hex[:12]
+        items = [{"item_id": item.get("item_id") or f"{job_id}-{i:06d}", **{k: item[k] for k in ITEM_FIELDS[1:]}}
+                 for i, item in enumerate(items)]
+        header = {"job_id": job_id,
+                  "created": datetime.now().isoformat(),
+                  "items": len(items),
+                  "examples_fingerprint": examples_fingerprint(examples) if examples is not None else None,
+                  "params": params}
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        manifest = cls(path, header, items, fsync_every=fsync_every)
+        if os.path.exists(manifest.done_path):
+            os.remove(manifest.done_path)
+        manifest.done = set()
+        return manifest
+
+    @classmethod
+    def load(cls, path: str, fsync_every: int = 10):
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            items = [json.loads(line) for line in f if line.strip()]
+        return cls(path, header, items, fsync_every=fsync_every)
+
+    @staticmethod
+    def _read_done(path: str):
+        if not os.path.exists(path):
+            return set()
+        with open(path, "r", encoding="utf-8") as f:
+            # a line cut by a crash doesn't match any item ID
+            return {line.strip() for line in f if line.strip()}
+
+    def check_examples(self, examples: list):
+        expected = self.header.get("examples_fingerprint")
+        if expected is not None and expected != examples_fingerprint(examples):
+            raise ValueError(f"The examples differ from the examples of job {self.job_id} ({self.path})")
+
+    def pending(self):
+        return [item for item in self.items if item["item_id"] not in self.done]
+
+    def mark_done(self, item_id: str):
+        """
+        Called after the row is written to the data file
+        """
+        if self._done_file is None:
+            self._done_file = open(self.done_path, "a", encoding="utf-8")
+        self._done_file.write(item_id + "\n")
+        self._done_file.flush()
+        self.done.add(item_id)
+        self._marked += 1
+        if self._marked % self.fsync_every == 0:
+            os.fsync(self._done_file.fileno())
+
+    def close(self):
+        if self._done_file is not None and not self._done_file.closed:
+            self._done_file.flush()
+            os.fsync(self._done_file.fileno())
+            self._done_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
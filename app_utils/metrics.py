@@ -0,0 +1,153 @@
+import os
+import json
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+class PhaseTimer:
+    """
+    Accumulates time spent in the named phases of the pipeline (prompt building, API wait, persistence, ...).
+    With concurrent generation the phases overlap, so the totals can be bigger than the wall time
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.totals[name] += seconds
+            self.counts[name] += 1
+
+    def reset(self):
+        with self._lock:
+            self.totals.clear()
+            self.counts.clear()
+
+    def summary(self):
+        with self._lock:
+            return {name: {"total_seconds": total,
+                           "count": self.counts[name],
+                           "mean_seconds": total / self.counts[name] if self.counts[name] else 0.0}
+                    for name, total in self.totals.items()}
+
+
+# Process-wide timer used by `openai_llm`
+PHASE_TIMER = PhaseTimer()
+
+
+def timed(name: str):
+    return PHASE_TIMER.phase(name)
+
+
+# USD per 1M tokens (prompt, completion), override or extend with SDG_MODEL_PRICES env variable (json)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4o": (5.0, 15.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4": (30.0, 60.0),
+    "gpt-3.5-turbo": (0.5, 1.5),
+}
+MODEL_PRICES.update({k: tuple(v) for k, v in json.loads(os.getenv("SDG_MODEL_PRICES", "{}")).items()})
+
+USAGE_COLUMNS = ['prompt_tokens',
+                 'completion_tokens',
+                 'latency',
+                 'ttfb',
+                 'finish_reason',
+                 'cost']
+
+
+def get_model_price(model: str):
+    """
+    Returns (prompt, completion) price per 1M tokens, dated model versions like 'gpt-4o-2024-05-13'
+    use the price of the longest matching prefix
+    """
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    prefixes = [name for name in MODEL_PRICES if model and model.startswith(name)]
+    return MODEL_PRICES[max(prefixes, key=len)] if prefixes else (0.0, 0.0)
+
+
+def compute_cost(model: str, prompt_tokens: int, completion_tokens: int):
+    prompt_price, completion_price = get_model_price(model)
+    return ((prompt_tokens or 0) * prompt_price + (completion_tokens or 0) * completion_price) / 1e6
+
+
+def usage_fields(response, ttfb: float = None, cached: bool = False):
+    """
+    Usage columns of the output row, cached responses cost nothing
+    """
+    usage = response.usage
+    prompt_tokens = usage.prompt_tokens if usage else None
+    completion_tokens = usage.completion_tokens if usage else None
+    return {'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'ttfb': ttfb,
+            'finish_reason': response.choices[0].finish_reason,
+            'cost': 0.0 if cached else compute_cost(response.model, prompt_tokens, completion_tokens)}
+
+
+class UsageSummary:
+    """
+    Aggregates tokens, latency and cost of the generated rows by model and augmentation
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.groups = defaultdict(lambda: defaultdict(float))
+
+    def add(self, row: dict):
+        with self._lock:
+            group = self.groups[(row.get('model'), row.get('augmentation'))]
+            group['documents'] += 1
+            for column in ('prompt_tokens', 'completion_tokens', 'latency', 'cost'):
+                group[column] += row.get(column) or 0
+
+    def rows(self):
+        with self._lock:
+            return [{'model': model,
+                     'augmentation': augmentation,
+                     'documents': int(group['documents']),
+                     'prompt_tokens': int(group['prompt_tokens']),
+                     'completion_tokens': int(group['completion_tokens']),
+                     'mean_latency': group['latency'] / group['documents'],
+                     'cost': group['cost']}
+                    for (model, augmentation), group in sorted(self.groups.items(), key=lambda g: str(g[0]))]
+
+    def totals_by(self, key: str):
+        totals = defaultdict(lambda: defaultdict(float))
+        for row in self.rows():
+            for column in ('documents', 'prompt_tokens', 'completion_tokens', 'cost'):
+                totals[row[key]][column] += row[column]
+        return {name: dict(values) for name, values in totals.items()}
+
+    def pretty_print(self):
+        rows = self.rows()
+        if not rows:
+            return
+        print("\n\033[096mUsage summary by model and augmentation:\033[0m")
+        for row in rows:
+            print(f"\033[090mModel: {row['model']}\033[0m | \033[096mAugmentation: {row['augmentation']}\033[0m | "
+                  f"{row['documents']} docs | {row['prompt_tokens']} + {row['completion_tokens']} tokens | "
+                  f"{row['mean_latency']:.2f} s/doc | ${row['cost']:.4f}")
+        for model, total in self.totals_by('model').items():
+            print(f"\033[095mTotal {model}: {int(total['documents'])} docs | "
+                  f"{int(total['prompt_tokens'])} + {int(total['completion_tokens'])} tokens | ${total['cost']:.4f}\033[0m")
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"by_model_and_augmentation": self.rows(),
+                       "by_model": self.totals_by('model'),
+                       "by_augmentation": self.totals_by('augmentation')}, f, ensure_ascii=False, indent=2)
@@ -1,13 +1,31 @@
 import os
 import json
 import random
+import asyncio
 import openai
 import streamlit as st
-import pandas as pd
-import numpy as np
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from tqdm import tqdm
-from time import time
+from time import time, sleep
+from typing import NamedTuple
+from collections import Counter, deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from openai.types.chat import ChatCompletion
+
+from app_utils.batch_api import BATCH_PRICE_FACTOR, clear_batch_state, run_batch_job
+from app_utils.backends import get_backend
+from app_utils.chunking import needs_chunking, split_template
+from app_utils.clients import close_loop_clients
+from app_utils.dedup import DEDUP_ACTION, DEDUP_THRESHOLD, INDEX_SUFFIX, open_checker
+from app_utils.leaks import LEAK_ACTION, LEAK_RETRIES, build_matcher
+from app_utils.manifest import JobManifest, plan_job_id
+from app_utils.metrics import USAGE_COLUMNS, UsageSummary, timed, usage_fields
+from app_utils.planner import plan_table, table_items, upper_languages
+from app_utils.rate_limit import ModelRateLimiter, backoff_delay, estimate_tokens, get_rate_limiter, parse_duration
+from app_utils.response_cache import ResponseCache, CacheMissError, get_response_cache
+from app_utils.router import ModelRouter, get_model_stats
+from app_utils.writer import open_writer
 
 DEFAULT_AUGMENTATIONS = [
     "Add more information about the topic.",
@@ -19,6 +37,12 @@ DEFAULT_AUGMENTATIONS = [
     "Add more sources",
 ]
 
+# Retries are done here (with the shared rate limiter), not inside the openai client
+MAX_RETRIES = 6
+# Parallel requests for the chunks of one long template outside of a batch (the batch has its own limit)
+CHUNK_CONCURRENCY = 8
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
 LANGUAGES = {
     "RU": "RUSSIAN",
     "EN": "ENGLISH",
@@ -33,6 +57,13 @@ LANGUAGES = {
 }
 
 
+class CompletionResult(NamedTuple):
+    response: ChatCompletion
+    # time to the response headers, 0 for cached responses
+    ttfb: float = None
+    cached: bool = False
+
+
 def set_openai_api_key(from_secrets: bool = True, from_env: bool = True):
     if from_secrets:
         try:
@@ -62,26 +93,36 @@ def check_available_models(model_id: str = "gpt-4", print_all: bool = False):
             print(model.id)
 
 
-def get_client(api_key: str = None):
+def _resolve_api_key(api_key: str = None):
     if api_key:
-        openai.api_key = api_key
-    else:
+        return api_key
+    if not openai.api_key:
         set_openai_api_key(from_secrets=True, from_env=True)
-    return OpenAI(api_key=openai.api_key)
+    return openai.api_key
 
 
-def generate_synthetic_data(
-        template: str,
-        api_key: str = None,
-        model: str = "gpt-4o",
-        use_random_augmentation: bool = True,
-        augmentations: list = None,
-        language: str = "RU"
-):
-    # @markdown ## ▶️ Initialize openai functions
-    client = get_client(api_key=api_key)
-    augmentations = DEFAULT_AUGMENTATIONS if not augmentations else augmentations
-    augmentation = random.choice(augmentations) if use_random_augmentation else ''
+def get_client(api_key: str = None, base_url: str = None) -> OpenAI:
+    """
+    Returns the client of the active backend (shared, pooled OpenAI client by default),
+    the key is resolved from secrets/env only once
+    """
+    backend = get_backend()
+    if backend.requires_api_key:
+        api_key = _resolve_api_key(api_key)
+    return backend.client(api_key, base_url=base_url)
+
+
+def get_async_client(api_key: str = None, base_url: str = None) -> AsyncOpenAI:
+    """
+    Returns the async client of the active backend for the running event loop
+    """
+    backend = get_backend()
+    if backend.requires_api_key:
+        api_key = _resolve_api_key(api_key)
+    return backend.async_client(api_key, base_url=base_url)
+
+
+def build_prompt(template: str, augmentation: str = '', language: str = "RU"):
     language = LANGUAGES.get(language, "RUSSIAN")
     prompt = f"""
     TASK:
@@ -95,20 +136,585 @@ def generate_synthetic_data(
 
     NEW_DOCUMENT:
     """
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": f"You are a helpful assistant."},
-            {"role": "user", "content": prompt},
-        ]
-    )
-    return process_result(response), augmentation
+    return [
+        {"role": "system", "content": f"You are a helpful assistant."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def build_multi_variant_prompt(template: str, augmentations: list, language: str = "RU"):
+    """
+    Prompt for len(augmentations) documents from one template in a single request,
+    the answer is a json object {"documents": [...]} in the order of the augmentations
+    """
+    language = LANGUAGES.get(language, "RUSSIAN")
+    requirements = "\n".join(f"    {i + 1}. {augmentation} in the document {i + 1}, this should look natural."
+                              for i, augmentation in enumerate(augmentations))
+    prompt = f"""
+    TASK:
+    Generate {len(augmentations)} new documents from the given template. Use the similar structure. Change all the personal data (name, phone, email), dates, organizations, urls and numbers to generated data.
+    - Generated data should be similar to real. Do not use numbers like this: 'phone 555-555-555' or very general names like 'Ivanov'. Use various names, surnames, etc.
+    - Every document should use its own generated data, different from the other documents.
+    - The main language of the new documents is {language}. Translate all the text to the {language} if needed.
+    Additional requirements for every document:
+{requirements}
+
+    Return a JSON object {{"documents": ["<document 1>", "<document 2>", ...]}} with exactly {len(augmentations)} documents.
+
+    TEMPLATE:
+    {template}
+    """
+    return [
+        {"role": "system", "content": f"You are a helpful assistant that answers in JSON."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def build_context_prompt(template: str, language: str = "RU"):
+    """
+    First step of the chunked generation: the replacement data shared by all chunks of the document
+    """
+    language = LANGUAGES.get(language, "RUSSIAN")
+    prompt = f"""
+    TASK:
+    Read the template and invent the data for a new document. For every personal data item (name, phone, email, address), date, organization, url and number in the template choose a new value.
+    - Generated data should be similar to real. Do not use numbers like this: 'phone 555-555-555' or very general names like 'Ivanov'. Use various names, surnames, etc.
+    - New values should be in {language}.
+    Return a JSON object {{"replacements": {{"<value from the template>": "<new value>", ...}}}}.
+
+    TEMPLATE:
+    {template}
+    """
+    return [
+        {"role": "system", "content": f"You are a helpful assistant that answers in JSON."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def build_chunk_prompt(chunk: str, part: int, parts: int, replacements: dict, augmentation: str = '',
+                       language: str = "RU"):
+    language = LANGUAGES.get(language, "RUSSIAN")
+    replacements = "\n".join(f"    {old} -> {new}" for old, new in replacements.items())
+    prompt = f"""
+    TASK:
+    Generate part {part} of {parts} of a new document from the given part of the template. Use the similar structure. Change all the personal data (name, phone, email), dates, organizations, urls and numbers to generated data.
+    - Use exactly these replacements, so that all parts of the document are consistent:
+{replacements}
+    - Other data that is not in the list should be changed to realistic generated data.
+    - The main language of the new document is {language}. Translate all the text to the {language} if needed.
+    - Return only the new part, without comments.
+    {augmentation + " in this part of the document, this should look natural." if augmentation else ""}
+
+    PART OF THE TEMPLATE:
+    {chunk}
+
+    NEW_PART:
+    """
+    return [
+        {"role": "system", "content": f"You are a helpful assistant."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _cache_lookup(cache: ResponseCache, model: str, messages: list, item_key: str = None, **params):
+    """
+    Returns (cache key, cached response or None), raises CacheMissError for a miss in replay mode.
+    `item_key` (the ID of the planned item) keeps the answers of the items with the same prompt apart
+    """
+    if cache is None:
+        return None, None
+    key = ResponseCache.make_key(model, messages, item_key=item_key, **params)
+    response = cache.get(key) if cache.readable else None
+    if response is None and cache.mode == "replay_only":
+        raise CacheMissError(key)
+    return key, response
+
+
+def _retry_delay(model: str, limiter: ModelRateLimiter, estimated_tokens: int, attempt: int, max_retries: int,
+                 error: Exception, verbose: bool = True) -> float:
+    """
+    Handles a failed attempt: the reserved tokens are given back, a 429 pauses the whole model,
+    server and connection errors back off the failed request only.
+    Returns the delay before the next attempt, raises the error after the last one
+    """
+    get_model_stats().record(model, error=True)
+    limiter.refund(model, estimated_tokens)
+    if attempt == max_retries:
+        raise error
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if isinstance(error, openai.RateLimitError):
+        delay = limiter.on_rate_limited(model, attempt, headers)
+    else:
+        retry_after = parse_duration(headers.get("retry-after")) if headers else 0
+        delay = max(retry_after, backoff_delay(attempt))
+    if verbose:
+        print(f"\033[093m{type(error).__name__} for {model}, retry in {delay:.1f} seconds\033[0m")
+    return delay
+
+
+def _send_with_retries(model: str, limiter: ModelRateLimiter, estimated_tokens: int, max_retries: int, send,
+                       verbose: bool = True):
+    """
+    Calls `send()` (one attempt, returns (response, ttfb)) with rate limiting and retries,
+    returns (response, ttfb, latency)
+    """
+    for attempt in range(max_retries + 1):
+        with timed("rate_limit_wait"):
+            limiter.acquire(model, estimated_tokens)
+        try:
+            with timed("api"):
+                start_time = time()
+                response, ttfb = send()
+            return response, ttfb, time() - start_time
+        except RETRYABLE_ERRORS as e:
+            delay = _retry_delay(model, limiter, estimated_tokens, attempt, max_retries, e, verbose)
+            with timed("retry_backoff"):
+                sleep(delay)
+
+
+async def _send_with_retries_async(model: str, limiter: ModelRateLimiter, estimated_tokens: int, max_retries: int,
+                                   send, semaphore: asyncio.Semaphore = None, verbose: bool = True):
+    """
+    Async version of `_send_with_retries`, `send` is a coroutine function.
+    `semaphore` is held during the request only, not during the backoff
+    """
+    for attempt in range(max_retries + 1):
+        with timed("rate_limit_wait"):
+            await limiter.acquire_async(model, estimated_tokens)
+        try:
+            async with semaphore if semaphore is not None else nullcontext():
+                with timed("api"):
+                    start_time = time()
+                    response, ttfb = await send()
+                latency = time() - start_time
+            return response, ttfb, latency
+        except RETRYABLE_ERRORS as e:
+            delay = _retry_delay(model, limiter, estimated_tokens, attempt, max_retries, e, verbose)
+            with timed("retry_backoff"):
+                await asyncio.sleep(delay)
+
+
+def _finish_completion(model: str, limiter: ModelRateLimiter, estimated_tokens: int, response: ChatCompletion,
+                       ttfb: float, latency: float, cache: ResponseCache = None, key: str = None):
+    usage = response.usage
+    limiter.record_usage(model, estimated_tokens, usage.total_tokens if usage else None)
+    get_model_stats().record(model, latency, usage.completion_tokens if usage else None)
+    if cache is not None and cache.writable:
+        with timed("cache"):
+            cache.put(key, model, response)
+    return CompletionResult(response, ttfb=ttfb, cached=False)
+
+
+def create_completion(model: str, messages: list, api_key: str = None, cache: ResponseCache = None,
+                      limiter: ModelRateLimiter = None, max_retries: int = MAX_RETRIES, item_key: str = None,
+                      verbose: bool = True, **params) -> CompletionResult:
+    """
+    Sends the chat request with rate limiting and retries, `params` are extra request parameters (response_format...).
+    `item_key` is added to the cache key, `verbose` switches the retry logs
+    """
+    with timed("cache"):
+        key, response = _cache_lookup(cache, model, messages, item_key, **params)
+    if response is not None:
+        return CompletionResult(response, ttfb=0.0, cached=True)
+    client = get_client(api_key=api_key)
+    limiter = limiter or get_rate_limiter()
+    estimated_tokens = 2 * estimate_tokens(messages)
+
+    def send():
+        start_time = time()
+        with client.chat.completions.with_streaming_response.create(model=model, messages=messages,
+                                                                    **params) as raw:
+            ttfb = time() - start_time
+            limiter.update_from_headers(model, raw.headers)
+            return raw.parse(), ttfb
+
+    response, ttfb, latency = _send_with_retries(model, limiter, estimated_tokens, max_retries, send, verbose)
+    return _finish_completion(model, limiter, estimated_tokens, response, ttfb, latency, cache, key)
+
+
+async def create_completion_async(model: str, messages: list, api_key: str = None, cache: ResponseCache = None,
+                                  limiter: ModelRateLimiter = None, max_retries: int = MAX_RETRIES,
+                                  semaphore: asyncio.Semaphore = None, item_key: str = None,
+                                  verbose: bool = True, **params) -> CompletionResult:
+    """
+    `semaphore` bounds the requests in flight, e.g. all requests of a batch (it is not held during the backoff)
+    """
+    with timed("cache"):
+        key, response = _cache_lookup(cache, model, messages, item_key, **params)
+    if response is not None:
+        return CompletionResult(response, ttfb=0.0, cached=True)
+    client = get_async_client(api_key=api_key)
+    limiter = limiter or get_rate_limiter()
+    estimated_tokens = 2 * estimate_tokens(messages)
+
+    async def send():
+        start_time = time()
+        async with client.chat.completions.with_streaming_response.create(model=model, messages=messages,
+                                                                          **params) as raw:
+            ttfb = time() - start_time
+            limiter.update_from_headers(model, raw.headers)
+            return await raw.parse(), ttfb
+
+    response, ttfb, latency = await _send_with_retries_async(model, limiter, estimated_tokens, max_retries, send,
+                                                             semaphore, verbose)
+    return _finish_completion(model, limiter, estimated_tokens, response, ttfb, latency, cache, key)
+
+
+def create_completion_stream(model: str, messages: list, on_delta, api_key: str = None,
+                             cache: ResponseCache = None, limiter: ModelRateLimiter = None,
+                             max_retries: int = MAX_RETRIES, item_key: str = None,
+                             verbose: bool = True) -> CompletionResult:
+    """
+    Streams the completion and calls `on_delta(text_so_far)` as tokens arrive.
+    The streamed chunks are assembled into a regular ChatCompletion, so the result (and the cache entry)
+    is the same as for `create_completion`. After a retry the text starts again from the beginning
+    """
+    with timed("cache"):
+        key, response = _cache_lookup(cache, model, messages, item_key)
+    if response is not None:
+        on_delta(process_result(response))
+        return CompletionResult(response, ttfb=0.0, cached=True)
+    client = get_client(api_key=api_key)
+    limiter = limiter or get_rate_limiter()
+    estimated_tokens = 2 * estimate_tokens(messages)
+
+    def send():
+        start_time = time()
+        raw = client.chat.completions.with_raw_response.create(model=model, messages=messages, stream=True,
+                                                               stream_options={"include_usage": True})
+        limiter.update_from_headers(model, raw.headers)
+        text, ttfb, finish_reason, usage, chunk = "", None, None, None, None
+        for chunk in raw.parse():
+            usage = chunk.usage or usage
+            if not chunk.choices:
+                continue
+            finish_reason = chunk.choices[0].finish_reason or finish_reason
+            delta = chunk.choices[0].delta.content
+            if delta:
+                ttfb = time() - start_time if ttfb is None else ttfb
+                text += delta
+                on_delta(text)
+        response = ChatCompletion.model_validate({
+            "id": chunk.id if chunk else "",
+            "object": "chat.completion",
+            "created": chunk.created if chunk else int(time()),
+            "model": chunk.model if chunk else model,
+            "choices": [{"index": 0,
+                         "finish_reason": finish_reason or "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": usage.model_dump() if usage else None,
+        })
+        return response, ttfb
+
+    response, ttfb, latency = _send_with_retries(model, limiter, estimated_tokens, max_retries, send, verbose)
+    return _finish_completion(model, limiter, estimated_tokens, response, ttfb, latency, cache, key)
+
+
+def _parse_replacements(result: CompletionResult):
+    content = process_result(result.response)
+    try:
+        replacements = json.loads(content).get("replacements") or {}
+        return {str(old): str(new) for old, new in replacements.items()}
+    except (json.JSONDecodeError, AttributeError):
+        print(f"\033[091mCan't parse the replacements: {content[:200]}\033[0m")
+        return {}
+
+
+def _merge_chunks(context: CompletionResult, parts: list, augmentation: str, context_time: float):
+    """
+    Stitches the generated parts into one record, the usage and cost of all requests are summed up
+    """
+    usages = [usage_fields(r.response, ttfb=r.ttfb, cached=r.cached) for r in [context, *parts]]
+    finish_reasons = [usage['finish_reason'] for usage in usages[1:]]
+    return {'new_document': "\n\n".join(process_result(r.response).strip() for r in parts),
+            'augmentation': augmentation,
+            'prompt_tokens': sum(usage['prompt_tokens'] or 0 for usage in usages),
+            'completion_tokens': sum(usage['completion_tokens'] or 0 for usage in usages),
+            # the first token of the document comes after the context request and the fastest part
+            'ttfb': context_time + min((r.ttfb or 0) for r in parts),
+            'finish_reason': "length" if "length" in finish_reasons else finish_reasons[-1],
+            'cost': sum(usage['cost'] for usage in usages)}
+
+
+def _generate_chunked(template: str, model: str, augmentation: str, language: str, api_key: str = None,
+                      cache: ResponseCache = None, item_key: str = None, verbose: bool = True):
+    """
+    Long templates: the replacement data is generated first, then all chunks are generated in parallel
+    with the same replacements and stitched back together
+    """
+    start_time = time()
+    chunks = split_template(template, model=model)
+    with timed("prompt"):
+        context_messages = build_context_prompt(template, language)
+    context = create_completion(model, context_messages, api_key=api_key, cache=cache, item_key=item_key,
+                                verbose=verbose, response_format={"type": "json_object"})
+    replacements = _parse_replacements(context)
+    context_time = time() - start_time
+
+    augmented_part = random.randrange(len(chunks))
+    with timed("prompt"):
+        messages = [build_chunk_prompt(chunk, i + 1, len(chunks), replacements,
+                                       augmentation if i == augmented_part else '', language)
+                    for i, chunk in enumerate(chunks)]
+    with ThreadPoolExecutor(max_workers=min(len(chunks), CHUNK_CONCURRENCY)) as pool:
+        parts = list(pool.map(lambda m: create_completion(model, m, api_key=api_key, cache=cache,
+                                                          item_key=item_key, verbose=verbose), messages))
+    return _merge_chunks(context, parts, augmentation, context_time)
+
+
+async def _generate_chunked_async(template: str, model: str, augmentation: str, language: str,
+                                  api_key: str = None, cache: ResponseCache = None,
+                                  semaphore: asyncio.Semaphore = None, item_key: str = None,
+                                  verbose: bool = True):
+    """
+    The chunk requests share `semaphore` (CHUNK_CONCURRENCY requests if None)
+    """
+    semaphore = semaphore or asyncio.Semaphore(CHUNK_CONCURRENCY)
+    start_time = time()
+    chunks = split_template(template, model=model)
+    with timed("prompt"):
+        context_messages = build_context_prompt(template, language)
+    context = await create_completion_async(model, context_messages, api_key=api_key, cache=cache,
+                                            semaphore=semaphore, item_key=item_key, verbose=verbose,
+                                            response_format={"type": "json_object"})
+    replacements = _parse_replacements(context)
+    context_time = time() - start_time
+
+    augmented_part = random.randrange(len(chunks))
+    with timed("prompt"):
+        messages = [build_chunk_prompt(chunk, i + 1, len(chunks), replacements,
+                                       augmentation if i == augmented_part else '', language)
+                    for i, chunk in enumerate(chunks)]
+    parts = await asyncio.gather(*[create_completion_async(model, m, api_key=api_key, cache=cache,
+                                                           semaphore=semaphore, item_key=item_key, verbose=verbose)
+                                   for m in messages])
+    return _merge_chunks(context, parts, augmentation, context_time)
+
+
+def _make_record(result: CompletionResult, augmentation: str):
+    return {'new_document': process_result(result.response),
+            'augmentation': augmentation,
+            **usage_fields(result.response, ttfb=result.ttfb, cached=result.cached)}
+
+
+def generate_synthetic_record(
+        template: str,
+        api_key: str = None,
+        model: str = "gpt-4o",
+        use_random_augmentation: bool = True,
+        augmentations: list = None,
+        language: str = "RU",
+        cache: ResponseCache = None,
+        on_delta=None,
+        augmentation: str = None,
+        item_key: str = None,
+        verbose: bool = True
+):
+    """
+    Generates one document, returns a dict with the document, the augmentation and the usage columns
+    (prompt/completion tokens, time to first byte, finish reason, cost).
+    With `on_delta` the completion is streamed and `on_delta(text_so_far)` is called as tokens arrive.
+    Templates longer than MAX_TEMPLATE_TOKENS are generated in chunks (not streamed).
+    `augmentation` fixes the augmentation instead of the random choice, `item_key` (the ID of the planned item)
+    gives every item of a job its own cached answer
+    """
+    if augmentation is None:
+        augmentations = DEFAULT_AUGMENTATIONS if not augmentations else augmentations
+        augmentation = random.choice(augmentations) if use_random_augmentation else ''
+    if needs_chunking(template, model):
+        record = _generate_chunked(template, model, augmentation, language, api_key=api_key, cache=cache,
+                                   item_key=item_key, verbose=verbose)
+        if on_delta is not None:
+            on_delta(record['new_document'])
+        return record
+    with timed("prompt"):
+        messages = build_prompt(template, augmentation, language)
+    if on_delta is not None:
+        result = create_completion_stream(model, messages, on_delta, api_key=api_key, cache=cache,
+                                          item_key=item_key, verbose=verbose)
+    else:
+        result = create_completion(model, messages, api_key=api_key, cache=cache, item_key=item_key,
+                                   verbose=verbose)
+    return _make_record(result, augmentation)
+
+
+async def generate_synthetic_record_async(
+        template: str,
+        api_key: str = None,
+        model: str = "gpt-4o",
+        use_random_augmentation: bool = True,
+        augmentations: list = None,
+        language: str = "RU",
+        cache: ResponseCache = None,
+        augmentation: str = None,
+        semaphore: asyncio.Semaphore = None,
+        item_key: str = None,
+        verbose: bool = True
+):
+    """
+    Async version of `generate_synthetic_record`, concurrent calls share the client of the running event loop.
+    `semaphore` bounds the requests in flight (the chunks of a long template too)
+    """
+    if augmentation is None:
+        augmentations = DEFAULT_AUGMENTATIONS if not augmentations else augmentations
+        augmentation = random.choice(augmentations) if use_random_augmentation else ''
+    if needs_chunking(template, model):
+        return await _generate_chunked_async(template, model, augmentation, language, api_key=api_key, cache=cache,
+                                             semaphore=semaphore, item_key=item_key, verbose=verbose)
+    with timed("prompt"):
+        messages = build_prompt(template, augmentation, language)
+    result = await create_completion_async(model, messages, api_key=api_key, cache=cache, semaphore=semaphore,
+                                           item_key=item_key, verbose=verbose)
+    return _make_record(result, augmentation)
+
+
+def _pick_augmentations(augmentations: list, variants: int, rng: random.Random = random):
+    """
+    Different augmentations for the variants while the list is long enough
+    """
+    if variants <= len(augmentations):
+        return rng.sample(augmentations, variants)
+    return rng.sample(augmentations, len(augmentations)) + rng.choices(augmentations,
+                                                                      k=variants - len(augmentations))
+
+
+def _group_key(item_keys: list):
+    """
+    Cache key part of a multi-variant request, None if the items have no IDs
+    """
+    return "|".join(item_keys) if all(item_keys) else None
+
+
+def _split_variants(result: CompletionResult, augmentations: list):
+    """
+    Splits the json answer into one record per variant. The request usage and cost are shared equally
+    between the variants, missing variants are dropped
+    """
+    content = process_result(result.response)
+    try:
+        documents = json.loads(content).get("documents") or []
+    except (json.JSONDecodeError, AttributeError):
+        print(f"\033[091mCan't parse the multi-variant answer: {content[:200]}\033[0m")
+        documents = []
+    documents = [d.get("document", "") if isinstance(d, dict) else str(d) for d in documents][:len(augmentations)]
+
+    usage = usage_fields(result.response, ttfb=result.ttfb, cached=result.cached)
+    share = len(documents) or 1
+    records = []
+    for document, augmentation in zip(documents, augmentations):
+        records.append({'new_document': document,
+                        'augmentation': augmentation,
+                        **usage,
+                        'prompt_tokens': round(usage['prompt_tokens'] / share) if usage['prompt_tokens'] else None,
+                        'completion_tokens': round(usage['completion_tokens'] / share)
+                        if usage['completion_tokens'] else None,
+                        'cost': usage['cost'] / share})
+    return records
+
+
+def generate_synthetic_variants(
+        template: str,
+        variants: int,
+        api_key: str = None,
+        model: str = "gpt-4o",
+        augmentations: list = None,
+        language: str = "RU",
+        cache: ResponseCache = None,
+        planned_augmentations: list = None,
+        item_keys: list = None,
+        verbose: bool = True
+):
+    """
+    Generates `variants` documents from one template in a single request (the template tokens are paid once),
+    every variant gets its own augmentation. Returns a list of records like `generate_synthetic_record`.
+    Long templates don't fit K documents into one answer, they are generated one by one in chunks.
+    `planned_augmentations` fixes the augmentations of the variants (and their number),
+    `item_keys` are the IDs of the planned items of the variants
+    """
+    augmentations = list(planned_augmentations) if planned_augmentations else \
+        _pick_augmentations(DEFAULT_AUGMENTATIONS if not augmentations else augmentations, variants)
+    item_keys = item_keys or [None] * len(augmentations)
+    if needs_chunking(template, model):
+        return [_generate_chunked(template, model, augmentation, language, api_key=api_key, cache=cache,
+                                  item_key=item_key, verbose=verbose)
+                for augmentation, item_key in zip(augmentations, item_keys)]
+    with timed("prompt"):
+        messages = build_multi_variant_prompt(template, augmentations, language)
+    result = create_completion(model, messages, api_key=api_key, cache=cache, item_key=_group_key(item_keys),
+                               verbose=verbose, response_format={"type": "json_object"})
+    return _split_variants(result, augmentations)
+
+
+async def generate_synthetic_variants_async(
+        template: str,
+        variants: int,
+        api_key: str = None,
+        model: str = "gpt-4o",
+        augmentations: list = None,
+        language: str = "RU",
+        cache: ResponseCache = None,
+        planned_augmentations: list = None,
+        semaphore: asyncio.Semaphore = None,
+        item_keys: list = None,
+        verbose: bool = True
+):
+    """
+    Async version of `generate_synthetic_variants`, the chunks of all variants share `semaphore`
+    (CHUNK_CONCURRENCY requests if None)
+    """
+    augmentations = list(planned_augmentations) if planned_augmentations else \
+        _pick_augmentations(DEFAULT_AUGMENTATIONS if not augmentations else augmentations, variants)
+    item_keys = item_keys or [None] * len(augmentations)
+    if needs_chunking(template, model):
+        semaphore = semaphore or asyncio.Semaphore(CHUNK_CONCURRENCY)
+        return list(await asyncio.gather(*[_generate_chunked_async(template, model, augmentation, language,
+                                                                   api_key=api_key, cache=cache, semaphore=semaphore,
+                                                                   item_key=item_key, verbose=verbose)
+                                           for augmentation, item_key in zip(augmentations, item_keys)]))
+    with timed("prompt"):
+        messages = build_multi_variant_prompt(template, augmentations, language)
+    result = await create_completion_async(model, messages, api_key=api_key, cache=cache, semaphore=semaphore,
+                                           item_key=_group_key(item_keys), verbose=verbose,
+                                           response_format={"type": "json_object"})
+    return _split_variants(result, augmentations)
+
+
+def generate_synthetic_data(
+        template: str,
+        api_key: str = None,
+        model: str = "gpt-4o",
+        use_random_augmentation: bool = True,
+        augmentations: list = None,
+        language: str = "RU",
+        cache: ResponseCache = None
+):
+    # @markdown ## ▶️ Initialize openai functions
+    record = generate_synthetic_record(template, api_key=api_key, model=model,
+                                       use_random_augmentation=use_random_augmentation,
+                                       augmentations=augmentations, language=language, cache=cache)
+    return record['new_document'], record['augmentation']
+
+
+async def generate_synthetic_data_async(
+        template: str,
+        api_key: str = None,
+        model: str = "gpt-4o",
+        use_random_augmentation: bool = True,
+        augmentations: list = None,
+        language: str = "RU",
+        cache: ResponseCache = None
+):
+    """
+    Async version of `generate_synthetic_data`
+    """
+    record = await generate_synthetic_record_async(template, api_key=api_key, model=model,
+                                                   use_random_augmentation=use_random_augmentation,
+                                                   augmentations=augmentations, language=language, cache=cache)
+    return record['new_document'], record['augmentation']
 
 
 def process_result(response):
-    result = response.json()
-    result = json.loads(result)
-    return result['choices'][0]['message']['content']
+    return response.choices[0].message.content
 
 
 def test_generation(use_index: int | None = None,
@@ -136,6 +742,200 @@ def test_generation(use_index: int | None = None,
     return new_document
 
 
+def pretty_print(iteration, data_size, augmentation, model, elapsed_time):
+    iteration_str = f"\033[095mIteration {iteration:03d} / {data_size}\033[0m"
+    augmentation_str = f"\033[096mAugmentation: {augmentation}\033[0m"
+    model_str = f"\033[090mModel: {model}\033[0m"
+    time_str = f"\033[090m{elapsed_time:.2f} seconds\033[0m"
+    print(f"{iteration_str} | {augmentation_str} | {model_str} | {time_str}")
+
+
+def plan_items(examples: list, data_size: int, gpt4_share: float, augmentations: list, language,
+               variants: int = 1, seed: int = None, models: dict = None):
+    """
+    Assigns the example, model, augmentation and language of every item of the job up front
+    (see `planner.plan_table`), the same `seed` gives the same plan. `language` is a code, a list of codes
+    or a dict of shares, `models` ({model: share}) replaces the `gpt4_share` split.
+    With `variants` > 1 the items come in groups sharing the example and the model, with different augmentations
+    """
+    models = models or {"gpt-3.5-turbo": 1 - gpt4_share, "gpt-4o": gpt4_share}
+    table = plan_table(len(examples), data_size, models, augmentations, language, variants, seed)
+    return table_items(table)
+
+
+def shard_items(items: list, shard_index: int, shard_count: int, variants: int = 1):
+    """
+    Disjoint slice of the plan for one of `shard_count` processes, groups of variants stay in one shard
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} is out of range for {shard_count} shards")
+    return [item for i, item in enumerate(items) if (i // variants) % shard_count == shard_index]
+
+
+def _request_key(item: dict):
+    return item['example_index'], item['model'], item['language']
+
+
+def _group_items(items: list, variants: int):
+    """
+    Groups of up to `variants` consecutive items with the same example, model and language, one request per group.
+    The groups keep the plan order, so an interrupted job has done a prefix of its plan
+    """
+    groups = deque()
+    for item in items:
+        if groups and len(groups[-1]) < variants and _request_key(groups[-1][0]) == _request_key(item):
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    return groups
+
+
+def _generate_group(examples: list, group: list, cache: ResponseCache = None, on_delta=None, verbose: bool = True):
+    item = group[0]
+    if item.get('regenerate'):
+        # the cached answer is the rejected one
+        cache = None
+    if len(group) > 1:
+        return generate_synthetic_variants(examples[item['example_index']], len(group), model=item['model'],
+                                           language=item['language'], cache=cache,
+                                           planned_augmentations=[i['augmentation'] for i in group],
+                                           item_keys=[i.get('item_id') for i in group], verbose=verbose)
+    return [generate_synthetic_record(examples[item['example_index']], model=item['model'],
+                                      language=item['language'], cache=cache, on_delta=on_delta,
+                                      augmentation=item['augmentation'], item_key=item.get('item_id'),
+                                      verbose=verbose)]
+
+
+async def _generate_group_async(examples: list, group: list, cache: ResponseCache = None,
+                                semaphore: asyncio.Semaphore = None, verbose: bool = True):
+    item = group[0]
+    if item.get('regenerate'):
+        cache = None
+    if len(group) > 1:
+        return await generate_synthetic_variants_async(examples[item['example_index']], len(group),
+                                                       model=item['model'], language=item['language'], cache=cache,
+                                                       planned_augmentations=[i['augmentation'] for i in group],
+                                                       semaphore=semaphore,
+                                                       item_keys=[i.get('item_id') for i in group], verbose=verbose)
+    return [await generate_synthetic_record_async(examples[item['example_index']], model=item['model'],
+                                                  language=item['language'], cache=cache,
+                                                  augmentation=item['augmentation'], semaphore=semaphore,
+                                                  item_key=item.get('item_id'), verbose=verbose)]
+
+
+def _generate_batch_sequential(examples: list, items: list, on_result, cache: ResponseCache = None,
+                               variants: int = 1, on_delta=None, route=None, verbose: bool = True):
+    """
+    Generates the planned items one request at a time: on_result(item, record, elapsed_time),
+    an item is generated again if `on_result` returns False. `route(group)` can change the model of the request
+    """
+    groups = _group_items(items, 1 if on_delta is not None else variants)
+    while groups:
+        group = groups.popleft()
+        if route is not None:
+            group = route(group)
+        start_time = time()
+        records = _generate_group(examples, group, cache, on_delta, verbose)
+        rejected = [item for item, record in zip(group, records)
+                    if on_result(item, record, time() - start_time) is False]
+        # variants missing from the answer are requested again one by one
+        groups.extend([item] for item in group[len(records):])
+        groups.extend([{**item, 'regenerate': True}] for item in rejected)
+
+
+async def _generate_batch_async(
+        examples: list,
+        items: list,
+        concurrency: int,
+        on_result,
+        cache: ResponseCache = None,
+        variants: int = 1,
+        route=None,
+        verbose: bool = True
+):
+    """
+    Keeps up to `concurrency` requests in flight and passes every finished item to `on_result`
+    in completion order: on_result(item, record, elapsed_time), an item is generated again if it returns False.
+    With `variants` > 1 every request returns up to `variants` items, `route(group)` can change the model.
+    The chunks of long templates count towards `concurrency` too.
+    `on_result` runs in one writer thread (the results are still saved one at a time), so the leak check,
+    the MinHash index and the file writes don't block the requests in flight
+    """
+    groups = _group_items(items, variants)
+    semaphore = asyncio.Semaphore(concurrency)
+    writer_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sdg-writer")
+    loop = asyncio.get_running_loop()
+
+    async def worker():
+        while groups:
+            group = groups.popleft()
+            if route is not None:
+                group = route(group)
+            start_time = time()
+            records = await _generate_group_async(examples, group, cache, semaphore, verbose)
+            elapsed_time = time() - start_time
+            rejected = [item for item, record in zip(group, records)
+                        if await loop.run_in_executor(writer_thread, on_result, item, record, elapsed_time) is False]
+            # variants missing from the answer are requested again one by one
+            groups.extend([item] for item in group[len(records):])
+            groups.extend([{**item, 'regenerate': True}] for item in rejected)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(groups)))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for w in workers:
+            w.cancel()
+        # the result being saved is finished before the writer and the manifest are closed
+        writer_thread.shutdown(wait=True)
+        await close_loop_clients()
+
+
+def _generate_batch_offline(
+        examples: list,
+        items: list,
+        on_result,
+        path_prefix: str,
+        poll_interval: float = 30
+):
+    """
+    Sends all planned items through the provider Batch API and passes the results to `on_result`
+    in the plan order. Failed and rejected requests are reported and skipped, they stay pending in the manifest.
+    A restarted job with the same `path_prefix` waits for the batches it already submitted.
+    Long templates need the replacements of their first request in every chunk, they are generated
+    in chunks with regular requests (at the regular price) before the batch is sent
+    """
+    start_time = time()
+    long_items = [item for item in items if needs_chunking(examples[item['example_index']], item['model'])]
+    if long_items:
+        print(f"\033[093m{len(long_items)} templates are too long for one request, "
+              f"they are generated in chunks outside of the batch\033[0m")
+    rejected = 0
+    for item in long_items:
+        record = _generate_chunked(examples[item['example_index']], item['model'], item['augmentation'],
+                                   item['language'], item_key=item['item_id'])
+        rejected += on_result(item, record, time() - start_time) is False
+    long_ids = {item['item_id'] for item in long_items}
+    items = [item for item in items if item['item_id'] not in long_ids]
+    requests = [{"custom_id": item['item_id'],
+                 "model": item['model'],
+                 "messages": build_prompt(examples[item['example_index']], item['augmentation'], item['language'])}
+                for item in items]
+
+    results = run_batch_job(get_client(), requests, path_prefix, poll_interval=poll_interval) if items else {}
+    for item in items:
+        if item['item_id'] in results:
+            record = _make_record(CompletionResult(results[item['item_id']]), item['augmentation'])
+            record['cost'] *= BATCH_PRICE_FACTOR
+            rejected += on_result(item, record, time() - start_time) is False
+    # all results are saved, the next run of the job sends its pending items in new batches
+    clear_batch_state(path_prefix)
+    print(f"\033[096m{sum(item['item_id'] in results for item in items)} / {len(items)} batch requests "
+          f"succeeded\033[0m")
+    if rejected:
+        print(f"\033[093m{rejected} documents were rejected, resume the job to generate them again\033[0m")
+
+
 def generate_synthetic_data_batch(
         examples: list,
         data_size: int = 200,
@@ -143,61 +943,205 @@ def generate_synthetic_data_batch(
         gpt4_share: float = 0.5,
         save_every: int = 10,
         augmentations: list = None,
-        language: str = "RU"
+        language: str = "RU",
+        concurrency: int = 1,
+        return_dataframe: bool = True,
+        cache_mode: str = None,
+        use_batch_api: bool = False,
+        poll_interval: float = 30,
+        on_item=None,
+        on_delta=None,
+        variants: int = 1,
+        verbose: bool = True,
+        resume: bool = False,
+        seed: int = None,
+        shard_index: int = 0,
+        shard_count: int = 1,
+        output_format: str = "csv",
+        entities: list = None,
+        leak_action: str = LEAK_ACTION,
+        dedup_action: str = DEDUP_ACTION,
+        dedup_threshold: float = DEDUP_THRESHOLD,
+        dedup_path: str = None,
+        router: ModelRouter = None
 ):
+    """
+    Generates `data_size` new documents and appends them to gen_data/`data_file`.
+    With `concurrency` > 1 the requests are sent with AsyncOpenAI, keeping up to `concurrency` of them in flight.
+    Rows are streamed to the file as they are ready, the whole file is read back into a DataFrame
+    only if `return_dataframe` is True, otherwise the path to the file is returned.
+    `cache_mode` is one of "off", "read_through", "write_only", "replay_only" (default: SDG_CACHE_MODE env).
+    With `use_batch_api` the requests are compiled to JSONL files in gen_data/batches, sent to the provider
+    Batch API (cheaper, higher quotas, up to 24h latency) and the function polls until the results are merged.
+    A resumed batch job waits for the batches it already submitted, long templates are generated in chunks
+    with regular requests.
+    `on_item(row, elapsed_time)` is called after every saved row, `verbose` switches tqdm, per-item and retry logs.
+    With `on_delta(text_so_far)` the documents are streamed token by token (sequential generation only).
+    With `variants` > 1 one request generates up to `variants` documents from the same template,
+    each with its own augmentation (not used with the Batch API and streaming).
+    Every row has token usage, latency, time to first byte, finish reason and cost,
+    the usage summary by model and augmentation is saved next to the data file.
+    The plan is drawn up front with exact quotas per example, augmentation, model and `language`
+    (a code, a list of codes or a dict of shares) and saved to the job manifest next to the data file,
+    with `resume` the unfinished job
+    of `data_file` continues with its pending items (the plan of the manifest is used, not `data_size`).
+    With `shard_count` > 1 the plan is drawn with `seed` and only the items of shard `shard_index` are generated,
+    so several processes with the same arguments and different shard indexes produce disjoint parts of one job.
+    `output_format` "parquet" or "jsonl.gz" writes a directory gen_data/<data_file stem> of rolling part files
+    with an index file instead of one csv.
+    Every document is checked for the source entities (`entities`: entity lists of the examples, by default
+    `examples.entities` of an ExampleStore), the found ones are saved to the `leaked_entities` column.
+    `leak_action` "regenerate" requests leaking documents again up to LEAK_RETRIES times, "off" skips the check.
+    Near-duplicates (MinHash similarity >= `dedup_threshold`) of the template or of any document in the MinHash
+    index are saved with the `duplicate_of` column, `dedup_action` "drop" skips them, "off" skips the check.
+    The index is kept at `dedup_path` (default: <data file stem>_minhash.bin in gen_data), shards of one job
+    can share it.
+    With a `router` the model of every request is chosen when it is sent (by the prompt size, the rolling
+    latency and error rates of the models and the cost or deadline budget) instead of the planned one
+    (not used with the Batch API)
+    """
+    if shard_count > 1 and seed is None:
+        raise ValueError("A seed is required for sharded jobs, all shards must draw the same plan")
     augmentations = DEFAULT_AUGMENTATIONS if not augmentations else augmentations
-    language = language.upper()
+    language = upper_languages(language)
+    cache = get_response_cache(cache_mode)
+    # one automaton over the entities of all examples, built before the first request
+    matcher = build_matcher(entities if entities is not None else getattr(examples, "entities", None), leak_action)
+    leak_retries = Counter()
+    leaks = 0
 
     # Create csv for a new dataset or append to the existing one
     data_folder = os.path.join(os.getcwd(), "gen_data")
     if not os.path.exists(data_folder):
         os.makedirs(data_folder)
-    generated_file = os.path.join(data_folder, data_file)
-    if os.path.exists(generated_file):
-        generated_data = pd.read_csv(generated_file)
-    else:
-        generated_data = pd.DataFrame(columns=['original_index',
-                                               'original_text',
-                                               'new_document',
-                                               'augmentation',
-                                               'model'])
-
-    def pretty_print(iteration, data_size, augmentation, model, elapsed_time):
-        iteration_str = f"\033[095mIteration {iteration:03d} / {data_size}\033[0m"
-        augmentation_str = f"\033[096mAugmentation: {augmentation}\033[0m"
-        model_str = f"\033[090mModel: {model}\033[0m"
-        time_str = f"\033[090m{elapsed_time:.2f} seconds\033[0m"
-        print(f"{iteration_str} | {augmentation_str} | {model_str} | {time_str}")
+    generated_file = os.path.join(data_folder, data_file if output_format == "csv" else os.path.splitext(data_file)[0])
+
+    manifest_path = JobManifest.path_for(generated_file)
+    params = dict(data_size=data_size, gpt4_share=gpt4_share, language=language,
+                  augmentations=augmentations, variants=variants, seed=seed)
+    # the plan of a seeded job is known in advance, restarts and shards share its ID
+    job_id = plan_job_id(examples, **params) if seed is not None else None
+    manifest = None
+    if resume and os.path.exists(manifest_path):
+        manifest = JobManifest.load(manifest_path, fsync_every=save_every)
+        manifest.check_examples(examples)
+        if manifest.is_complete and manifest.job_id != job_id:
+            print(f"\033[090mJob {manifest.job_id} is complete, planning a new job\033[0m")
+            manifest = None
+        elif verbose:
+            print(f"\033[096mResuming job {manifest.job_id}: "
+                  f"{len(manifest.done)} / {len(manifest.items)} items are done\033[0m")
+    if manifest is None:
+        items = plan_items(examples, data_size, gpt4_share, augmentations, language, variants, seed)
+        if job_id is not None:
+            # the IDs are assigned to the whole plan, so the items of all shards are unique
+            items = [{'item_id': f"{job_id}-{i:06d}", **item} for i, item in enumerate(items)]
+        items = shard_items(items, shard_index, shard_count, variants)
+        manifest = JobManifest.create(manifest_path, items, examples=examples, fsync_every=save_every,
+                                      job_id=job_id, data_file=data_file, shard_index=shard_index,
+                                      shard_count=shard_count, **params)
+    items = manifest.pending()
+    data_size = len(manifest.items)
+
+    writer = open_writer(generated_file, output_format, fsync_every=save_every)
+    checker = open_checker(dedup_path or os.path.splitext(generated_file)[0] + INDEX_SUFFIX, dedup_action,
+                           dedup_threshold)
+    duplicates = 0
+    summary = UsageSummary()
+
+    progress = tqdm(total=data_size, initial=data_size - len(items), disable=not verbose)
+    completed = data_size - len(items)
+
+    def add_result(item, record, elapsed_time):
+        nonlocal completed, leaks, duplicates
+        leaked = matcher.find(record['new_document']) if matcher is not None else []
+        regenerate = leaked and leak_action == "regenerate" and leak_retries[item['item_id']] < LEAK_RETRIES
+        if router is not None:
+            router.observe(record.get('cost'), finished=not regenerate)
+        if regenerate:
+            leak_retries[item['item_id']] += 1
+            if verbose:
+                print(f"\033[093mThe document contains source entities ({'; '.join(leaked[:5])}), "
+                      f"generating it again\033[0m")
+            return False
+        leaks += bool(leaked)
+        duplicate_of, signature = "", None
+        if checker is not None:
+            with timed("dedup"):
+                duplicate_of, signature = checker.check(item['item_id'], record['new_document'],
+                                                        examples[item['example_index']])
+            duplicates += bool(duplicate_of)
+            if duplicate_of and dedup_action == "drop":
+                # nothing to save, the item is done
+                manifest.mark_done(item['item_id'])
+                progress.update(1)
+                completed += 1
+                return
+        row = {'item_id': item['item_id'],
+               'original_index': item['example_index'],
+               'original_text': examples[item['example_index']],
+               'new_document': record['new_document'],
+               'augmentation': record['augmentation'],
+               'model': item['model'],
+               'language': item['language'],
+               **{column: record.get(column) for column in USAGE_COLUMNS},
+               'latency': elapsed_time,
+               'leaked_entities': "; ".join(leaked),
+               'duplicate_of': duplicate_of}
+        with timed("persistence"):
+            writer.write(row)
+            manifest.mark_done(item['item_id'])
+        if signature is not None and not duplicate_of:
+            checker.add(item['item_id'], signature)
+        summary.add(row)
+        if verbose:
+            pretty_print(completed, data_size, row['augmentation'], row['model'], elapsed_time)
+        progress.update(1)
+        completed += 1
+        if on_item is not None:
+            on_item(row, elapsed_time)
+
+    def route(group):
+        return router.route(group, examples[group[0]['example_index']])
+
+    if router is not None:
+        router.start(len(items))
 
     # Create new datapoints
+    try:
+        if use_batch_api and items:
+            batch_folder = os.path.join(data_folder, "batches")
+            os.makedirs(batch_folder, exist_ok=True)
+            # the batches of the job are found again when it is resumed
+            path_prefix = os.path.join(batch_folder, f"{os.path.splitext(data_file)[0]}_{manifest.job_id}")
+            _generate_batch_offline(examples, items, add_result, path_prefix, poll_interval)
+        elif concurrency > 1 and on_delta is None:
+            asyncio.run(_generate_batch_async(examples, items, concurrency, add_result, cache, variants,
+                                              route if router is not None else None, verbose))
+        else:
+            _generate_batch_sequential(examples, items, add_result, cache, variants, on_delta,
+                                       route if router is not None else None, verbose)
+    finally:
+        progress.close()
+        # the last rows of an unfinished job stay in the write-ahead file of a partitioned output
+        writer.close(finish=manifest.is_complete)
+        manifest.close()
+        if checker is not None:
+            checker.close()
+        if summary.rows():
+            summary.save(os.path.splitext(generated_file)[0] + "_summary.json")
+        if verbose:
+            summary.pretty_print()
+            if router is not None:
+                print(f"\033[096mRouter: ${router.spent:.4f} spent of ${router.budget or 0:.2f} budget, "
+                      f"{time() - router.started:.1f} of {router.deadline or 0:.0f} seconds deadline\033[0m")
+        if leaks:
+            print(f"\033[093m{leaks} documents contain source entities, see the leaked_entities column\033[0m")
+        if duplicates:
+            print(f"\033[093m{duplicates} near-duplicate documents were "
+                  f"{'dropped' if dedup_action == 'drop' else 'flagged in the duplicate_of column'}\033[0m")
 
-    for i in tqdm(range(data_size)):
-        start_time = time()
-        random_index = random.randint(0, len(examples) - 1)
-        random_model = np.random.choice(["gpt-3.5-turbo", "gpt-4o"],
-                                        p=[1 - gpt4_share, gpt4_share])
-        original_text = examples[random_index]
-        new_document, augmentation = generate_synthetic_data(
-            original_text,
-            model=random_model,
-            augmentations=augmentations,
-            language=language
-        )
-        generated_data = pd.concat([generated_data,
-                                    pd.DataFrame({'original_index': [random_index],
-                                                  'original_text': [original_text],
-                                                  'new_document': [new_document],
-                                                  'augmentation': [augmentation],
-                                                  'model': [random_model]})],
-                                   ignore_index=True)
-        pretty_print(i, data_size, augmentation, random_model, time() - start_time)
-
-        # save data each N iterations
-        if i % save_every == 0:
-            generated_data.to_csv(generated_file, index=False)
-
-    generated_data.to_csv(generated_file, index=False)
-    return generated_data
+    return writer.to_dataframe() if return_dataframe else generated_file
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+PLAN_COLUMNS = ['group', 'example_index', 'augmentation', 'model', 'language']
+
+
+def normalize_shares(value) -> dict:
+    """
+    {key: share} from a key, a list of keys (equal shares) or a dict of weights
+    """
+    if isinstance(value, str):
+        return {value: 1.0}
+    if not isinstance(value, dict):
+        value = {key: 1.0 for key in value}
+    total = sum(value.values())
+    if not value or total <= 0:
+        raise ValueError(f"The shares must be positive: {value}")
+    return {key: weight / total for key, weight in value.items() if weight > 0}
+
+
+def upper_languages(language):
+    if isinstance(language, str):
+        return language.upper()
+    if isinstance(language, dict):
+        return {key.upper(): share for key, share in language.items()}
+    return [key.upper() for key in language]
+
+
+def quota_counts(total: int, shares: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Integer quotas proportional to `shares` that sum to `total`: the floors plus one for the largest
+    remainders, ties are broken at random so small jobs don't always favour the first keys
+    """
+    shares = np.asarray(shares, dtype=float)
+    exact = shares / shares.sum() * total
+    counts = np.floor(exact).astype(np.int64)
+    missing = total - counts.sum()
+    if missing:
+        remainders = exact - counts + rng.random(len(shares)) * 1e-9
+        counts[np.argsort(-remainders)[:missing]] += 1
+    return counts
+
+
+def stratified_draw(total: int, shares: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    `total` indexes of the shares in random order, every index appears exactly its quota times
+    """
+    return rng.permutation(np.repeat(np.arange(len(shares)), quota_counts(total, shares, rng)))
+
+
+def plan_table(n_examples: int, data_size: int, models, augmentations: list, languages, variants: int = 1,
+               seed: int = None, example_weights: list = None) -> pd.DataFrame:
+    """
+    Assignment table of a job, one row per document. Requests (groups of up to `variants` rows) are spread
+    over the examples, models and languages by exact quotas (uniform over the examples or by `example_weights`),
+    augmentations are dealt in a shuffled cycle, so every augmentation gets the same number of documents
+    and the variants of one request get different ones while there are enough of them.
+    All columns are drawn with one vectorized pass each, the same `seed` gives the same table
+    """
+    rng = np.random.default_rng(seed)
+    models, languages = normalize_shares(models), normalize_shares(languages)
+    variants = max(variants, 1)
+    groups = -(-data_size // variants)
+
+    group_examples = stratified_draw(groups, np.ones(n_examples) if example_weights is None
+                                     else np.asarray(example_weights, dtype=float), rng)
+    group_models = np.array(list(models))[stratified_draw(groups, np.array(list(models.values())), rng)]
+    group_languages = np.array(list(languages))[stratified_draw(groups, np.array(list(languages.values())), rng)]
+
+    group = np.repeat(np.arange(groups), variants)[:data_size]
+    order = rng.permutation(len(augmentations))
+    augmentation_index = order[np.arange(data_size) % len(augmentations)]
+    return pd.DataFrame({'group': group,
+                         'example_index': group_examples[group],
+                         'augmentation': np.array(augmentations, dtype=object)[augmentation_index],
+                         'model': group_models[group],
+                         'language': group_languages[group]},
+                        columns=PLAN_COLUMNS)
+
+
+def table_items(table: pd.DataFrame) -> list:
+    """
+    Rows of the table as the item dicts of the manifest, with plain Python values
+    """
+    columns = {column: table[column].tolist() for column in PLAN_COLUMNS[1:]}
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
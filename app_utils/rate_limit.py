@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import random
+import asyncio
+import threading
+from time import time, sleep
+
+# Requests / tokens per minute for each model, override with SDG_RATE_LIMITS env variable (json)
+DEFAULT_RATE_LIMITS = {
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 160_000},
+    "gpt-4o": {"rpm": 500, "tpm": 30_000},
+    "default": {"rpm": 500, "tpm": 30_000},
+}
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def estimate_tokens(messages) -> int:
+    """
+    Rough prompt size estimation: ~4 bytes of utf-8 per token plus a few tokens per message.
+    Utf-8 bytes are used instead of characters, so cyrillic texts are not underestimated
+    """
+    if isinstance(messages, str):
+        return len(messages.encode("utf-8")) // 4 + 1
+    return sum(len(m["content"].encode("utf-8")) // 4 + 4 for m in messages) + 3
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parses rate limit reset values like '20ms', '1s', '6m0s'
+    """
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(n) * _DURATION_UNITS[unit] for n, unit in _DURATION_PART.findall(value))
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """
+    Exponential backoff with full jitter
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """
+    Bucket that refills `capacity` units per minute. Reservations are taken immediately and may push
+    the bucket below zero, the caller gets the time it should wait before sending the request
+    """
+
+    def __init__(self, capacity: float):
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time()
+
+    @property
+    def rate(self):
+        return self.capacity / 60
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def sync(self, remaining: float, reset_seconds: float, now: float, limit: float = None):
+        """
+        Aligns the bucket with the server view from the rate limit headers
+        """
+        if limit:
+            self.capacity = float(limit)
+        self._refill(now)
+        # the server state doesn't know about the requests that are still in flight, so only lower the level
+        self.tokens = min(self.tokens, remaining)
+        if remaining <= 0 and reset_seconds:
+            self.tokens = min(self.tokens, -reset_seconds * self.rate)
+
+
+class ModelRateLimiter:
+    """
+    Keeps separate RPM / TPM budgets for every model and a shared pause after the server pushed back
+    """
+
+    def __init__(self, limits: dict = None):
+        self.limits = limits or load_rate_limits()
+        self._buckets = {}
+        self._paused_until = {}
+        self._lock = threading.Lock()
+
+    def _get_buckets(self, model: str):
+        if model not in self._buckets:
+            limits = self.limits.get(model) or self.limits.get("default") or DEFAULT_RATE_LIMITS["default"]
+            self._buckets[model] = (TokenBucket(limits["rpm"]), TokenBucket(limits["tpm"]))
+        return self._buckets[model]
+
+    def reserve(self, model: str, tokens: int) -> float:
+        """
+        Reserves one request and `tokens` tokens, returns the delay before the request can be sent
+        """
+        now = time()
+        with self._lock:
+            requests_bucket, tokens_bucket = self._get_buckets(model)
+            wait = max(requests_bucket.reserve(1, now), tokens_bucket.reserve(tokens, now))
+            return max(wait, self._paused_until.get(model, 0) - now)
+
+    def acquire(self, model: str, tokens: int):
+        delay = self.reserve(model, tokens)
+        if delay > 0:
+            sleep(delay)
+
+    async def acquire_async(self, model: str, tokens: int):
+        delay = self.reserve(model, tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_usage(self, model: str, estimated_tokens: int, used_tokens: int):
+        """
+        Corrects the token budget after the real usage is known
+        """
+        if used_tokens is None:
+            return
+        with self._lock:
+            _, tokens_bucket = self._get_buckets(model)
+            tokens_bucket.tokens -= used_tokens - estimated_tokens
+
+    def refund(self, model: str, tokens: int):
+        """
+        Gives back the tokens reserved for a request that failed without using them (429, overload, connection).
+        The request itself stays counted, the server counts rejected requests too
+        """
+        with self._lock:
+            _, tokens_bucket = self._get_buckets(model)
+            # the reservation was capped at the capacity
+            refund = min(tokens, tokens_bucket.capacity)
+            tokens_bucket.tokens = min(tokens_bucket.capacity, tokens_bucket.tokens + refund)
+
+    def update_from_headers(self, model: str, headers):
+        if not headers:
+            return
+        now = time()
+        with self._lock:
+            requests_bucket, tokens_bucket = self._get_buckets(model)
+            for bucket, kind in ((requests_bucket, "requests"), (tokens_bucket, "tokens")):
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining is None:
+                    continue
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                bucket.sync(float(remaining),
+                            parse_duration(headers.get(f"x-ratelimit-reset-{kind}")),
+                            now,
+                            limit=float(limit) if limit else None)
+
+    def on_rate_limited(self, model: str, attempt: int, headers=None) -> float:
+        """
+        Pauses the model after a 429 / overload answer, returns the delay for the failed request
+        """
+        retry_after = parse_duration(headers.get("retry-after")) if headers else 0
+        delay = max(retry_after, backoff_delay(attempt))
+        self.update_from_headers(model, headers)
+        with self._lock:
+            self._paused_until[model] = max(self._paused_until.get(model, 0), time() + delay)
+        return delay
+
+
+def load_rate_limits():
+    limits = dict(DEFAULT_RATE_LIMITS)
+    limits.update(json.loads(os.getenv("SDG_RATE_LIMITS", "{}")))
+    return limits
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> ModelRateLimiter:
+    """
+    Returns the process-wide limiter, so all batches and threads share the same budgets
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = ModelRateLimiter()
+        return _rate_limiter
@@ -0,0 +1,145 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from time import time
+from openai.types.chat import ChatCompletion
+
+CACHE_MODES = ("off", "read_through", "write_only", "replay_only")
+DEFAULT_CACHE_PATH = os.path.join("gen_data", ".cache", "responses.sqlite")
+
+
+class CacheMissError(KeyError):
+    """
+    Raised in `replay_only` mode when the request is not in the cache
+    """
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of chat completions stored in SQLite.
+    The key is a hash of the model, the messages, the request parameters and the planned item, so the items
+    of a job with the same prompt get their own answers and a rerun of the job replays them.
+
+    Modes:
+    - read_through: return cached responses, call the API and store the response on a miss
+    - write_only: always call the API, store every response
+    - replay_only: never call the API, raise CacheMissError on a miss
+    """
+
+    def __init__(self,
+                 path: str = DEFAULT_CACHE_PATH,
+                 mode: str = "read_through",
+                 max_entries: int = 100_000,
+                 max_bytes: int = 2 * 1024 ** 3,
+                 max_age_days: float = 90,
+                 evict_every: int = 1000):
+        if mode not in CACHE_MODES or mode == "off":
+            raise ValueError(f"Unknown cache mode '{mode}', use one of {CACHE_MODES[1:]}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 3600
+        self.evict_every = evict_every
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created_at REAL,
+                accessed_at REAL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)")
+        self.evict()
+
+    @property
+    def readable(self):
+        return self.mode in ("read_through", "replay_only")
+
+    @property
+    def writable(self):
+        return self.mode in ("read_through", "write_only")
+
+    @staticmethod
+    def make_key(model: str, messages: list, item_key: str = None, **params):
+        request = {"model": model, "messages": messages, "params": params}
+        if item_key is not None:
+            request["item"] = item_key
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Returns the cached ChatCompletion or None
+        """
+        now = time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return ChatCompletion.model_validate_json(row[0])
+
+    def put(self, key: str, model: str, response: ChatCompletion):
+        data = response.model_dump_json()
+        now = time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, model, data, len(data), now, now))
+            self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries, then the least recently used ones until the cache fits the size limits
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time() - self.max_age,))
+            count, total_size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if count <= self.max_entries and total_size <= self.max_bytes:
+                return
+            removed, removed_size = 0, 0
+            cursor = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at")
+            to_delete = []
+            for key, size in cursor:
+                if count - removed <= self.max_entries and total_size - removed_size <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                removed += 1
+                removed_size += size
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(mode: str = None, path: str = None):
+    """
+    Returns the process-wide cache for the mode, or None if caching is off.
+    Defaults come from SDG_CACHE_MODE (off) and SDG_CACHE_PATH env variables
+    """
+    mode = mode or os.getenv("SDG_CACHE_MODE", "off")
+    path = path or os.getenv("SDG_CACHE_PATH", DEFAULT_CACHE_PATH)
+    if mode == "off":
+        return None
+    with _caches_lock:
+        if (mode, path) not in _caches:
+            _caches[(mode, path)] = ResponseCache(path=path, mode=mode)
+        return _caches[(mode, path)]
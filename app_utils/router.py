@@ -0,0 +1,141 @@
+import os
+import threading
+from time import time
+from collections import deque
+
+from app_utils.metrics import compute_cost
+from app_utils.rate_limit import estimate_tokens
+
+# Candidate models from the preferred (best quality) to the fallback, override with SDG_MODELS="model1,model2"
+DEFAULT_MODELS = [m.strip() for m in os.getenv("SDG_MODELS", "gpt-4o,gpt-3.5-turbo").split(",") if m.strip()]
+# Requests per model in the rolling statistics
+STATS_WINDOW = 50
+# Models failing more often than this are used only if all models do
+MAX_ERROR_RATE = 0.5
+# Instructions of the prompt around the template
+INSTRUCTION_TOKENS = 250
+# Expected completion tokens per template token: the new document is about as long as the template
+COMPLETION_RATIO = 1.0
+# Generation speed before the first responses of the model are seen
+PRIOR_SECONDS_PER_TOKEN = {"gpt-4o": 0.02, "gpt-4o-mini": 0.01, "gpt-3.5-turbo": 0.01}
+PRIOR_OVERHEAD_SECONDS = 0.5
+
+
+class ModelStats:
+    """
+    Rolling latency and error statistics of the last STATS_WINDOW requests of every model,
+    shared by all requests of the process
+    """
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._requests = {}
+
+    def record(self, model: str, latency: float = None, completion_tokens: int = None, error: bool = False):
+        with self._lock:
+            self._requests.setdefault(model, deque(maxlen=self._window)).append((error, latency, completion_tokens))
+
+    def error_rate(self, model: str) -> float:
+        with self._lock:
+            requests = list(self._requests.get(model, ()))
+        return sum(error for error, _, _ in requests) / len(requests) if requests else 0.0
+
+    def seconds_per_token(self, model: str):
+        """
+        Mean latency per completion token of the successful requests, None before the first one
+        """
+        with self._lock:
+            requests = [(latency, tokens) for error, latency, tokens in self._requests.get(model, ())
+                        if not error and latency is not None and tokens]
+        if not requests:
+            return None
+        return sum(latency for latency, _ in requests) / sum(tokens for _, tokens in requests)
+
+
+_model_stats = None
+_model_stats_lock = threading.Lock()
+
+
+def get_model_stats() -> ModelStats:
+    global _model_stats
+    with _model_stats_lock:
+        if _model_stats is None:
+            _model_stats = ModelStats()
+        return _model_stats
+
+
+class ModelRouter:
+    """
+    Chooses the model of every request instead of the planned one. The preferred model of `models` is used
+    while the estimated cost and time of the request fit the allowance of one remaining document:
+    the rest of the `budget` (USD) divided by the remaining documents, and the rest of the `deadline`
+    (seconds from the start of the job) times `concurrency` divided by the remaining documents.
+    Otherwise the next model that fits is used, or the cheapest (fastest if only the deadline is set) one.
+    The estimations use the prompt size, the model prices and the rolling latency and error rates
+    """
+
+    def __init__(self, models: list = None, budget: float = None, deadline: float = None, concurrency: int = 1,
+                 stats: ModelStats = None):
+        self.models = list(models or DEFAULT_MODELS)
+        if not self.models:
+            raise ValueError("The router needs at least one model")
+        self.budget = budget
+        self.deadline = deadline
+        self.concurrency = max(concurrency, 1)
+        self.stats = stats or get_model_stats()
+        self._lock = threading.Lock()
+        self.total = 0
+        self.finished = 0
+        self.spent = 0.0
+        self.started = time()
+
+    def start(self, total: int):
+        self.total = total
+        self.finished = 0
+        self.spent = 0.0
+        self.started = time()
+
+    def estimate(self, model: str, template_tokens: int, documents: int = 1):
+        """
+        Expected (cost, seconds) of a request, failed attempts make both larger
+        """
+        completion_tokens = int(template_tokens * COMPLETION_RATIO) * documents
+        seconds_per_token = self.stats.seconds_per_token(model) or PRIOR_SECONDS_PER_TOKEN.get(model, 0.02)
+        attempts = 1 / (1 - min(self.stats.error_rate(model), 0.9))
+        cost = compute_cost(model, template_tokens + INSTRUCTION_TOKENS, completion_tokens) * attempts
+        seconds = (PRIOR_OVERHEAD_SECONDS + completion_tokens * seconds_per_token) * attempts
+        return cost, seconds
+
+    def choose(self, template: str, documents: int = 1) -> str:
+        template_tokens = estimate_tokens(template)
+        with self._lock:
+            remaining = max(self.total - self.finished, documents)
+            cost_allowance = (self.budget - self.spent) / remaining * documents if self.budget is not None \
+                else float("inf")
+            time_allowance = (self.deadline - (time() - self.started)) * self.concurrency / remaining * documents \
+                if self.deadline is not None else float("inf")
+
+        healthy = [m for m in self.models if self.stats.error_rate(m) <= MAX_ERROR_RATE] or self.models
+        estimates = {m: self.estimate(m, template_tokens, documents) for m in healthy}
+        for model in healthy:
+            cost, seconds = estimates[model]
+            if cost <= cost_allowance and seconds <= time_allowance:
+                return model
+        by_time = self.budget is None
+        return min(healthy, key=lambda m: estimates[m][1] if by_time else estimates[m][0])
+
+    def route(self, group: list, template: str) -> list:
+        """
+        Items of the group with the chosen model
+        """
+        model = self.choose(template, len(group))
+        return [{**item, 'model': model} for item in group]
+
+    def observe(self, cost: float, finished: bool = True):
+        """
+        Called for every generated document, `finished` is False for documents that will be generated again
+        """
+        with self._lock:
+            self.spent += cost or 0.0
+            self.finished += finished
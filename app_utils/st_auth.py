@@ -1,10 +1,18 @@
+import os
+import copy
+import hashlib
+import threading
+from time import time
+import bcrypt
 import streamlit as st
 import streamlit_authenticator as stauth
 import re
 
-ADMINS = [st.secrets["ADMIN"],]
-USERNAMES = ["admin", "user", st.secrets["ADMIN"]]
-PASSWORDS = ["admin", "user", st.secrets["PASSWORD"]]
+# A session that passed the login check skips it for this many seconds
+SESSION_TTL = int(os.getenv("SDG_AUTH_SESSION_TTL", 300))
+
+# Passwords in the secrets can be stored as bcrypt hashes, they are used as is
+_BCRYPT_HASH = re.compile(r"^\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}$")
 
 
 class SysColors:
@@ -20,48 +28,129 @@ class SysColors:
 
 
 def get_users_and_passwords():
-    return USERNAMES, PASSWORDS
+    """
+    Read on every call, edited secrets apply without a restart. PASSWORD_HASH (a bcrypt hash) can replace
+    the plain PASSWORD of the admin
+    """
+    admin = st.secrets["ADMIN"]
+    password = st.secrets.get("PASSWORD_HASH") or st.secrets["PASSWORD"]
+    return ["admin", "user", admin], ["admin", "user", password]
+
+
+def credentials_fingerprint(usernames, passwords):
+    digest = hashlib.sha256()
+    for value in (*usernames, *passwords):
+        digest.update(hashlib.sha256(str(value).encode("utf-8")).digest())
+    return digest.hexdigest()
+
+
+class CredentialStore:
+    """
+    bcrypt hashes of one set of credentials, the plain passwords are not kept.
+    The fingerprint of the credentials signs the login cookies: changed credentials end all sessions
+    """
+
+    def __init__(self, usernames, passwords, admins):
+        self.fingerprint = credentials_fingerprint(usernames, passwords)
+        self.admins = list(admins)
+        self.hashes = {}
+        for username, password in zip(usernames, passwords):
+            self.hashes[username] = password if _BCRYPT_HASH.match(password) \
+                else bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+    @property
+    def usernames(self):
+        return list(self.hashes)
+
+    def verify(self, username, password):
+        hashed = self.hashes.get(username)
+        return hashed is not None and bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+    def config(self, expiration=30):
+        """
+        Every call gets its own copy, the authenticator can change it
+        """
+        users = {username: {'email': f'{username.lower()}@verified-ai.com',
+                            'name': username.title(),
+                            'password': hashed} for username, hashed in self.hashes.items()}
+        creds = {'usernames': users}
+        cookie = {'expiry_days': expiration,
+                  'key': f'verified-ai-{self.fingerprint}',
+                  'name': 'verified-ai'}
+        preauth = {'emails': ['maria@verified-ai.com', ]}
+        config = {'credentials': creds,
+                  'cookie': cookie,
+                  'preauthorized': preauth}
+        return copy.deepcopy(config)
+
+
+_credentials = None
+_credentials_lock = threading.Lock()
+
+
+def get_credentials() -> CredentialStore:
+    """
+    The credential store of the process, the passwords are hashed again only when the secrets change
+    """
+    global _credentials
+    usernames, passwords = get_users_and_passwords()
+    fingerprint = credentials_fingerprint(usernames, passwords)
+    with _credentials_lock:
+        if _credentials is None or _credentials.fingerprint != fingerprint:
+            _credentials = CredentialStore(usernames, passwords, admins=[st.secrets["ADMIN"]])
+        return _credentials
+
 
+def check_valid(user, password):
+    return get_credentials().verify(user, password)
 
-def get_config(usernames, passwords, expiration=30):
-    hashes = stauth.Hasher(passwords).generate()
-    users = {u[0]: {'email': f'{u[0].lower()}@verified-ai.com',
-                    'name': u[0].title(),
-                    'password': u[1]} for u in zip(usernames, hashes)}
-    creds = {'usernames': users}
-    cookie = {'expiry_days': expiration,
-              'key': 'verified-ai',
-              'name': 'verified-ai'}
-    preauth = {'emails': ['maria@verified-ai.com', ]}
-    config = {'credentials': creds,
-              'cookie': cookie,
-              'preauthorized': preauth}
-    return config
 
+def _forget_session():
+    for key in ("name", "username", "auth_fingerprint", "auth_verified_until"):
+        st.session_state.pop(key, None)
+    st.session_state["authentication_status"] = None
 
-def check_valid(user, password):
-    if user in USERNAMES and password in PASSWORDS:
-        return True
-    else:
-        return False
+
+def _session_is_verified(fingerprint: str):
+    """
+    The session logged in less than SESSION_TTL seconds ago with the current credentials
+    """
+    return st.session_state.get("authentication_status") is True \
+        and st.session_state.get("auth_fingerprint") == fingerprint \
+        and time() < st.session_state.get("auth_verified_until", 0)
 
 
 def auth_basic(func):
     def wrapper():
         # # authentication
-        auth_config = get_config(usernames=USERNAMES, passwords=PASSWORDS)
+        store = get_credentials()
+        fingerprint = store.fingerprint
+        if st.session_state.get("auth_fingerprint") not in (None, fingerprint):
+            # the credentials changed, the cookie of the session was signed with the old ones
+            _forget_session()
+        auth_config = store.config()
         authenticator = stauth.Authenticate(auth_config['credentials'],
                                             auth_config['cookie']['name'],
                                             auth_config['cookie']['key'],
                                             auth_config['cookie']['expiry_days'],
                                             auth_config['preauthorized']['emails'])
 
+        if _session_is_verified(fingerprint):
+            # reruns of a verified session skip the login check, the logout button still works
+            authenticator.logout('Logout', location='sidebar')
+            if st.session_state.get("authentication_status"):
+                st.write(f'Welcome *{st.session_state["username"].title()}*')
+                func()
+                return
+
         name, authentication_status, username = authenticator.login('Login', location='main')
         print(SysColors.YELLOW, name, authentication_status, SysColors.RESET)
         if authentication_status:
             st.write(f'Welcome *{name.title()}*')
             authenticator.logout('Logout', location='sidebar')
-            st.session_state.update({"username": name.lower()})
+            st.session_state.update({"username": name.lower(),
+                                     "auth_fingerprint": fingerprint,
+                                     "auth_verified_until": time() + SESSION_TTL})
             func()
         elif not authentication_status:
             st.error('Username/password is incorrect')
@@ -110,10 +199,11 @@ def auth_simple(func):
         admin = kwargs.get("admin", False)
         print(INFO, f"Authenticating {'ADMIN' if admin else 'USER'}...", end=" ")
         auth_user = _get_user()
-        if auth_user in ADMINS:
+        store = get_credentials()
+        if auth_user in store.admins:
             func()
             print(OK, "OK", RESET)
-        elif auth_user in USERNAMES and not admin:
+        elif auth_user in store.usernames and not admin:
             func()
             print(OK, "OK", RESET)
         elif auth_user is None:
@@ -0,0 +1,401 @@
+import os
+import json
+import uuid
+import sqlite3
+import threading
+import multiprocessing as mp
+from time import time, sleep
+
+from app_utils.leaks import LEAK_ACTION, LEAK_RETRIES, build_matcher
+from app_utils.planner import upper_languages
+from app_utils.rate_limit import backoff_delay
+from app_utils.writer import OUTPUT_COLUMNS, open_writer
+
+DEFAULT_QUEUE_PATH = os.path.join("gen_data", ".queue", "tasks.sqlite")
+# A leased task becomes visible to the other workers again if it is not completed in time
+VISIBILITY_TIMEOUT = float(os.getenv("SDG_VISIBILITY_TIMEOUT", 600))
+MAX_ATTEMPTS = int(os.getenv("SDG_MAX_ATTEMPTS", 5))
+POLL_INTERVAL = 1.0
+
+
+class TaskQueue:
+    """
+    Durable queue of generation tasks in SQLite, shared by worker processes of one machine.
+
+    - `lease` hands a task to one worker until the visibility timeout, an expired lease is given to another worker
+    - `complete` saves the result row and marks the task done in one transaction, only the holder
+      of the current lease can do it, so a task is never saved twice
+    - `fail` puts the task back with a backoff delay, after `max_attempts` it goes to the dead-letter table
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, visibility_timeout: float = VISIBILITY_TIMEOUT,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                examples_path TEXT,
+                text_key TEXT,
+                params TEXT,
+                created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                job_id TEXT,
+                payload TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                lease_token TEXT,
+                lease_expires REAL,
+                available_at REAL,
+                last_error TEXT,
+                created_at REAL,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, available_at);
+            CREATE TABLE IF NOT EXISTS results (
+                task_id TEXT PRIMARY KEY,
+                job_id TEXT,
+                row TEXT,
+                created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                task_id TEXT PRIMARY KEY,
+                job_id TEXT,
+                payload TEXT,
+                attempts INTEGER,
+                last_error TEXT,
+                failed_at REAL
+            );""")
+
+    def _transaction(self):
+        """
+        BEGIN IMMEDIATE takes the write lock at once, concurrent leases are serialized
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def enqueue(self, job_id: str, items: list, examples_path: str = None, text_key: str = None, params: dict = None):
+        """
+        Adds the planned items of the job as tasks, the item ID is the task ID, so enqueueing
+        the same plan again adds nothing (dead-letter tasks stay there, see `requeue_dead`).
+        Items carry the template unless the examples file is given
+        """
+        now = time()
+        conn = self._transaction()
+        try:
+            conn.execute("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?)",
+                         (job_id, examples_path, text_key, json.dumps(params or {}, ensure_ascii=False), now))
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO tasks (task_id, job_id, payload, status, available_at, created_at, updated_at) "
+                "SELECT ?, ?, ?, 'pending', ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM dead_letter WHERE task_id = ?)",
+                [(item["item_id"], job_id, json.dumps(item, ensure_ascii=False), now, now, now, item["item_id"])
+                 for item in items])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount
+
+    def lease(self, n: int = 1):
+        """
+        Returns up to `n` (task_id, lease_token, job_id, payload) tuples. Tasks with expired leases
+        are leased again, the ones that used all attempts go to the dead-letter table
+        """
+        now = time()
+        conn = self._transaction()
+        try:
+            rows = conn.execute(
+                "SELECT task_id, job_id, payload, attempts, last_error FROM tasks "
+                "WHERE (status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY available_at LIMIT ?", (now, now, n)).fetchall()
+            leased = []
+            for task_id, job_id, payload, attempts, last_error in rows:
+                if attempts >= self.max_attempts:
+                    self._bury(task_id, job_id, payload, attempts, last_error or "lease expired", now)
+                    continue
+                token = uuid.uuid4().hex
+                conn.execute("UPDATE tasks SET status = 'leased', lease_token = ?, lease_expires = ?, "
+                             "attempts = attempts + 1, updated_at = ? WHERE task_id = ?",
+                             (token, now + self.visibility_timeout, now, task_id))
+                leased.append((task_id, token, job_id, json.loads(payload)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return leased
+
+    def extend(self, task_id: str, lease_token: str):
+        """
+        Heartbeat for long tasks, returns False if the lease was lost
+        """
+        cursor = self._conn.execute("UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND lease_token = ? "
+                                    "AND status = 'leased'", (time() + self.visibility_timeout, task_id, lease_token))
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: str, lease_token: str, row: dict):
+        """
+        Saves the result, returns False (and drops the result) if the lease was lost to another worker
+        """
+        now = time()
+        conn = self._transaction()
+        try:
+            cursor = conn.execute("UPDATE tasks SET status = 'done', lease_token = NULL, updated_at = ? "
+                                  "WHERE task_id = ? AND lease_token = ? AND status = 'leased'",
+                                  (now, task_id, lease_token))
+            if cursor.rowcount == 1:
+                conn.execute("INSERT OR IGNORE INTO results SELECT task_id, job_id, ?, ? FROM tasks WHERE task_id = ?",
+                             (json.dumps(row, ensure_ascii=False, default=str), now, task_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def fail(self, task_id: str, lease_token: str, error: str):
+        now = time()
+        conn = self._transaction()
+        try:
+            row = conn.execute("SELECT job_id, payload, attempts FROM tasks WHERE task_id = ? AND lease_token = ? "
+                               "AND status = 'leased'", (task_id, lease_token)).fetchone()
+            if row is not None:
+                job_id, payload, attempts = row
+                if attempts >= self.max_attempts:
+                    self._bury(task_id, job_id, payload, attempts, error, now)
+                else:
+                    conn.execute("UPDATE tasks SET status = 'pending', lease_token = NULL, available_at = ?, "
+                                 "last_error = ?, updated_at = ? WHERE task_id = ?",
+                                 (now + backoff_delay(attempts), error, now, task_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _bury(self, task_id: str, job_id: str, payload: str, attempts: int, error: str, now: float):
+        self._conn.execute("INSERT OR REPLACE INTO dead_letter VALUES (?, ?, ?, ?, ?, ?)",
+                           (task_id, job_id, payload, attempts, error, now))
+        self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        print(f"\033[091mTask {task_id} moved to the dead-letter table after {attempts} attempts: {error}\033[0m")
+
+    def requeue_dead(self, job_id: str = None):
+        """
+        Moves the dead-letter tasks (of the job) back to the queue with fresh attempts
+        """
+        now = time()
+        conn = self._transaction()
+        try:
+            condition, args = ("WHERE job_id = ?", (job_id,)) if job_id else ("", ())
+            conn.execute("INSERT OR REPLACE INTO tasks (task_id, job_id, payload, status, attempts, available_at, "
+                         "last_error, created_at, updated_at) SELECT task_id, job_id, payload, 'pending', 0, ?, "
+                         f"last_error, ?, ? FROM dead_letter {condition}", (now, now, now, *args))
+            cursor = conn.execute(f"DELETE FROM dead_letter {condition}", args)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount
+
+    def job(self, job_id: str):
+        row = self._conn.execute("SELECT examples_path, text_key, params FROM jobs WHERE job_id = ?",
+                                 (job_id,)).fetchone()
+        return None if row is None else {"examples_path": row[0], "text_key": row[1], "params": json.loads(row[2])}
+
+    def stats(self, job_id: str = None):
+        condition, args = ("WHERE job_id = ?", (job_id,)) if job_id else ("", ())
+        stats = dict(self._conn.execute(f"SELECT status, COUNT(*) FROM tasks {condition} GROUP BY status", args))
+        stats["dead"] = self._conn.execute(f"SELECT COUNT(*) FROM dead_letter {condition}", args).fetchone()[0]
+        return stats
+
+    def is_drained(self):
+        return self._conn.execute("SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')").fetchone()[0] == 0
+
+    def iter_results(self, job_id: str):
+        for (row,) in self._conn.execute("SELECT row FROM results WHERE job_id = ? ORDER BY task_id", (job_id,)):
+            yield json.loads(row)
+
+    def export(self, job_id: str, output_path: str, output_format: str = "csv"):
+        """
+        Writes the results of the job to a data file (or a partitioned dataset), returns the number of rows
+        """
+        folder = os.path.dirname(output_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        written = 0
+        with open_writer(output_path, output_format, columns=OUTPUT_COLUMNS, flush_every=1000,
+                         fsync_every=1000) as writer:
+            for row in self.iter_results(job_id):
+                writer.write(row)
+                written += 1
+        return written
+
+    def close(self):
+        self._conn.close()
+
+
+class LeaseHeartbeat:
+    """
+    Extends the lease of a task every third of the visibility timeout while the task runs, so a generation
+    slower than the timeout (chunks, retries, rate limit waits) is not leased to another worker.
+    The thread uses its own connection, SQLite connections are not shared between threads
+    """
+
+    def __init__(self, path: str, task_id: str, lease_token: str, visibility_timeout: float = VISIBILITY_TIMEOUT):
+        self.path = path
+        self.task_id = task_id
+        self.lease_token = lease_token
+        self.visibility_timeout = visibility_timeout
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        queue = TaskQueue(self.path, visibility_timeout=self.visibility_timeout)
+        try:
+            while not self._stop.wait(self.visibility_timeout / 3):
+                if not queue.extend(self.task_id, self.lease_token):
+                    self.lost = True
+                    break
+        finally:
+            queue.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def enqueue_plan(queue: TaskQueue, examples: list, data_size: int, gpt4_share: float = 0.5,
+                 augmentations: list = None, language="RU", seed: int = None):
+    """
+    Plans the job like `generate_synthetic_data_batch` and adds its items to the queue, returns the job ID.
+    With a seed the same arguments give the same job, enqueueing it again is a no-op
+    """
+    from app_utils.examples import ExampleStore
+    from app_utils.manifest import plan_job_id
+    from app_utils.openai_llm import DEFAULT_AUGMENTATIONS, plan_items
+
+    augmentations = augmentations or DEFAULT_AUGMENTATIONS
+    language = upper_languages(language)
+    params = dict(data_size=data_size, gpt4_share=gpt4_share, language=language,
+                  augmentations=augmentations, variants=1, seed=seed)
+    job_id = plan_job_id(examples, **params) if seed is not None else uuid.uuid4().hex[:12]
+    items = plan_items(examples, data_size, gpt4_share, augmentations, language, seed=seed)
+    # a file of examples is opened by the workers, a list of texts travels in the tasks
+    is_file = isinstance(examples, ExampleStore)
+    items = [{'item_id': f"{job_id}-{i:06d}", **item} for i, item in enumerate(items)]
+    if not is_file:
+        for item in items:
+            item['template'] = examples[item['example_index']]
+    added = queue.enqueue(job_id, items,
+                          examples_path=os.path.abspath(examples.path) if is_file else None,
+                          text_key=examples.text_key if is_file else None,
+                          params=params)
+    print(f"\033[096mJob {job_id}: {added} / {len(items)} tasks added to {queue.path}\033[0m")
+    return job_id
+
+
+def _load_examples(queue: TaskQueue, job_id: str, examples: dict):
+    if job_id not in examples:
+        job = queue.job(job_id)
+        if job is not None and job["examples_path"]:
+            from app_utils.examples import ExampleStore
+            examples[job_id] = ExampleStore.open(job["examples_path"], text_key=job["text_key"])
+        else:
+            examples[job_id] = None
+    return examples[job_id]
+
+
+def work(path: str = DEFAULT_QUEUE_PATH, worker_name: str = None, stop_when_empty: bool = True,
+         visibility_timeout: float = VISIBILITY_TIMEOUT, max_attempts: int = MAX_ATTEMPTS,
+         cache_mode: str = None, leak_action: str = LEAK_ACTION):
+    """
+    Worker loop: leases one task at a time, generates the document (the lease is extended meanwhile)
+    and saves the row.
+    With `leak_action` "flag" entities of the examples file found in the document are saved to the
+    `leaked_entities` column, "regenerate" requests leaking documents again up to LEAK_RETRIES times.
+    Returns the number of completed tasks
+    """
+    from app_utils.openai_llm import generate_synthetic_record
+    from app_utils.response_cache import get_response_cache
+
+    queue = TaskQueue(path, visibility_timeout=visibility_timeout, max_attempts=max_attempts)
+    cache = get_response_cache(cache_mode)
+    worker_name = worker_name or f"worker-{os.getpid()}"
+    examples = {}
+    matchers = {}
+    completed = 0
+    try:
+        while True:
+            leased = queue.lease(1)
+            if not leased:
+                if stop_when_empty and queue.is_drained():
+                    break
+                sleep(POLL_INTERVAL)
+                continue
+
+            task_id, token, job_id, item = leased[0]
+            start_time = time()
+            try:
+                store = _load_examples(queue, job_id, examples)
+                template = item["template"] if store is None else store[item["example_index"]]
+                if job_id not in matchers:
+                    matchers[job_id] = build_matcher(store.entities if store is not None else None, leak_action)
+                matcher = matchers[job_id]
+                with LeaseHeartbeat(path, task_id, token, visibility_timeout):
+                    record = generate_synthetic_record(template, model=item["model"], language=item["language"],
+                                                       cache=cache, augmentation=item["augmentation"],
+                                                       item_key=task_id)
+                    leaked = matcher.find(record['new_document']) if matcher is not None else []
+                    for _ in range(LEAK_RETRIES if leak_action == "regenerate" else 0):
+                        if not leaked:
+                            break
+                        # the cached answer is the leaking one
+                        record = generate_synthetic_record(template, model=item["model"],
+                                                           language=item["language"],
+                                                           augmentation=item["augmentation"])
+                        leaked = matcher.find(record['new_document'])
+            except Exception as e:
+                queue.fail(task_id, token, f"{type(e).__name__}: {e}")
+                continue
+
+            row = {'item_id': task_id,
+                   'original_index': item["example_index"],
+                   'original_text': template,
+                   'model': item["model"],
+                   'language': item["language"],
+                   **record,
+                   'latency': time() - start_time,
+                   'leaked_entities': "; ".join(leaked)}
+            if queue.complete(task_id, token, row):
+                completed += 1
+            else:
+                print(f"\033[090m{worker_name}: lease of {task_id} expired, the result is dropped\033[0m")
+    finally:
+        queue.close()
+    print(f"\033[096m{worker_name}: {completed} tasks completed\033[0m")
+    return completed
+
+
+def run_workers(path: str = DEFAULT_QUEUE_PATH, processes: int = None, **kwargs):
+    """
+    Starts `processes` worker processes (default: one per core) and waits until the queue is drained
+    """
+    processes = processes or os.cpu_count()
+    ctx = mp.get_context("spawn")
+    workers = [ctx.Process(target=work, args=(path, f"worker-{i}"), kwargs=kwargs) for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return [worker.exitcode for worker in workers]
@@ -0,0 +1,314 @@
+import os
+import csv
+import gzip
+import json
+import pandas as pd
+from datetime import datetime
+
+from app_utils.metrics import USAGE_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+OUTPUT_COLUMNS = ['item_id',
+                  'original_index',
+                  'original_text',
+                  'new_document',
+                  'augmentation',
+                  'model',
+                  'language',
+                  *USAGE_COLUMNS,
+                  'leaked_entities',
+                  'duplicate_of']
+
+
+class StreamingCsvWriter:
+    """
+    Appends generated rows to a csv file one at a time.
+    Only the current row is kept in memory, the file is flushed every `flush_every` rows
+    and fsynced every `fsync_every` rows. The DataFrame is built only when `to_dataframe` is called.
+    """
+
+    def __init__(self, path: str, columns: list = None, flush_every: int = 1, fsync_every: int = 10):
+        self.path = path
+        self.flush_every = max(flush_every, 1)
+        self.fsync_every = max(fsync_every, 1)
+        self.rows_written = 0
+
+        columns = list(columns or OUTPUT_COLUMNS)
+        existing_columns = self._read_header(path)
+        self.columns = existing_columns or columns
+
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=self.columns, extrasaction="ignore",
+                                      lineterminator="\n")
+        if not existing_columns:
+            self._writer.writeheader()
+            self.flush(fsync=True)
+
+    @staticmethod
+    def _read_header(path: str):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return next(csv.reader(f), None)
+
+    def write(self, row: dict):
+        self._writer.writerow(row)
+        self.rows_written += 1
+        if self.rows_written % self.fsync_every == 0:
+            self.flush(fsync=True)
+        elif self.rows_written % self.flush_every == 0:
+            self.flush()
+
+    def flush(self, fsync: bool = False):
+        if self._file.closed:
+            return
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self, finish: bool = False):
+        if not self._file.closed:
+            self.flush(fsync=True)
+            self._file.close()
+
+    def to_dataframe(self):
+        self.flush()
+        return pd.read_csv(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+OUTPUT_FORMATS = ("csv", "parquet", "jsonl.gz")
+INDEX_FILE = "_index.json"
+# Uncompressed size of the rows of one part file
+MAX_PART_BYTES = 64 * 1024 ** 2
+# Rows of a Parquet row group, a page of the log viewer reads only the row groups it overlaps
+PARQUET_ROW_GROUP_ROWS = 2_000
+
+
+class PartitionedWriter:
+    """
+    Writes generated rows to a directory of rolling part files (Parquet with zstd or gzipped JSONL)
+    with the `_index.json` metadata file: format, columns and the rows and size of every part.
+    Rows are appended to the small write-ahead file `_pending-NNNNN.jsonl` first, so every written row survives
+    a crash. When the pending rows reach `max_part_bytes` (or the job is finished) they are compacted into the next
+    part file, a resumed job keeps appending to the pending file of the interrupted run
+    """
+
+    def __init__(self, path: str, output_format: str = "parquet", columns: list = None,
+                 max_part_bytes: int = MAX_PART_BYTES, flush_every: int = 1, fsync_every: int = 10):
+        if output_format not in OUTPUT_FORMATS[1:]:
+            raise ValueError(f"Unknown partitioned output format {output_format}, use one of {OUTPUT_FORMATS[1:]}")
+        if output_format == "parquet" and pq is None:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_part_bytes = max_part_bytes
+        self.flush_every = max(flush_every, 1)
+        self.fsync_every = max(fsync_every, 1)
+        self.rows_written = 0
+
+        existing_index = read_index(path)
+        self.index = existing_index or {"format": output_format,
+                                        "compression": "zstd" if output_format == "parquet" else "gzip",
+                                        "columns": list(columns or OUTPUT_COLUMNS),
+                                        "created": datetime.now().isoformat(),
+                                        "rows": 0,
+                                        "parts": []}
+        if self.index["format"] != output_format:
+            raise ValueError(f"{path} is a {self.index['format']} dataset, can't append {output_format} rows")
+        self.output_format = output_format
+        self.columns = self.index["columns"]
+
+        # pending files of the parts that are already in the index were compacted before a crash
+        part_number = len(self.index["parts"])
+        for name in os.listdir(path):
+            if name.startswith("_pending-") and int(name[9:14]) < part_number:
+                os.remove(os.path.join(path, name))
+        self._pending_path = os.path.join(path, f"_pending-{part_number:05d}.jsonl")
+        self._pending_bytes = os.path.getsize(self._pending_path) if os.path.exists(self._pending_path) else 0
+        self._file = open(self._pending_path, "a", encoding="utf-8")
+        if existing_index is None:
+            self._save_index()
+
+    def _part_name(self, number: int):
+        return f"part-{number:05d}.{self.output_format}"
+
+    def _save_index(self):
+        tmp_path = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+
+    def write(self, row: dict):
+        line = json.dumps({column: row.get(column) for column in self.columns}, ensure_ascii=False, default=str)
+        self._file.write(line + "\n")
+        self._pending_bytes += len(line.encode("utf-8")) + 1
+        self.rows_written += 1
+        if self._pending_bytes >= self.max_part_bytes:
+            self.roll()
+        elif self.rows_written % self.fsync_every == 0:
+            self.flush(fsync=True)
+        elif self.rows_written % self.flush_every == 0:
+            self.flush()
+
+    def flush(self, fsync: bool = False):
+        if self._file.closed:
+            return
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def roll(self):
+        """
+        Compacts the pending rows into the next part file and starts a new pending file
+        """
+        self.flush(fsync=True)
+        self._file.close()
+        rows = read_jsonl(self._pending_path)
+        if rows:
+            number = len(self.index["parts"])
+            name = self._part_name(number)
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            df = pd.DataFrame(rows, columns=self.columns)
+            if self.output_format == "parquet":
+                pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path, compression="zstd",
+                               row_group_size=PARQUET_ROW_GROUP_ROWS)
+            else:
+                with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, os.path.join(self.path, name))
+            self.index["parts"].append({"file": name,
+                                        "rows": len(rows),
+                                        "bytes": os.path.getsize(os.path.join(self.path, name)),
+                                        "created": datetime.now().isoformat()})
+            self.index["rows"] += len(rows)
+            self._save_index()
+            os.remove(self._pending_path)
+            self._pending_path = os.path.join(self.path, f"_pending-{number + 1:05d}.jsonl")
+        self._pending_bytes = 0
+        self._file = open(self._pending_path, "a", encoding="utf-8")
+
+    def close(self, finish: bool = False):
+        """
+        The pending rows stay in the write-ahead file (the readers include them) for the next run of the job,
+        with `finish` they are compacted into the last part
+        """
+        if not self._file.closed:
+            if finish and self._pending_bytes:
+                self.roll()
+            self.flush(fsync=True)
+            self._file.close()
+            if os.path.exists(self._pending_path) and os.path.getsize(self._pending_path) == 0:
+                os.remove(self._pending_path)
+
+    def to_dataframe(self, columns: list = None):
+        self.flush()
+        return read_output(self.path, columns=columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # a `with` block that ran to the end wrote the whole output
+        self.close(finish=exc_type is None)
+
+
+def open_writer(path: str, output_format: str = "csv", **kwargs):
+    if output_format == "csv":
+        kwargs.pop("max_part_bytes", None)
+        return StreamingCsvWriter(path, **kwargs)
+    return PartitionedWriter(path, output_format, **kwargs)
+
+
+def read_index(path: str):
+    index_path = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_jsonl(path: str):
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line can be cut by a crash
+                continue
+    return rows
+
+
+def iter_output(path: str, columns: list = None, parts: list = None, chunksize: int = 10_000):
+    """
+    Yields the data of a csv file (in chunks) or of a partitioned dataset (part by part, the pending rows last).
+    Only the `columns` are read from Parquet parts, `parts` selects the part numbers
+    """
+    index = read_index(path) if os.path.isdir(path) else None
+    if index is None:
+        for chunk in pd.read_csv(path, chunksize=chunksize, usecols=columns):
+            yield chunk
+        return
+
+    for number, part in enumerate(index["parts"]):
+        if parts is not None and number not in parts:
+            continue
+        part_path = os.path.join(path, part["file"])
+        if index["format"] == "parquet":
+            # columns missing from a part are read as empty, like for the jsonl parts and the pending rows
+            present = [c for c in columns if c in pq.read_schema(part_path).names] if columns else None
+            df = pd.read_parquet(part_path, columns=present)
+        else:
+            # json.loads of the lines is faster than pd.read_json and keeps the values as they were written
+            with gzip.open(part_path, "rt", encoding="utf-8") as f:
+                df = pd.DataFrame([json.loads(line) for line in f if line.strip()], columns=index["columns"])
+        yield df.reindex(columns=columns) if columns else df
+    if parts is None:
+        pending = os.path.join(path, f"_pending-{len(index['parts']):05d}.jsonl")
+        rows = read_jsonl(pending)
+        if rows:
+            yield pd.DataFrame(rows, columns=columns or index["columns"])
+
+
+def read_output(path: str, columns: list = None, parts: list = None):
+    chunks = list(iter_output(path, columns=columns, parts=parts))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+
+
+def merge_outputs(paths: list, output_path: str, chunksize: int = 10_000, output_format: str = "csv"):
+    """
+    Appends the data of several shards (csv files or partitioned datasets) to one output, reading them in chunks.
+    Rows with an `item_id` that was already merged are skipped. Returns the number of written rows
+    """
+    seen = set()
+    written = 0
+    with open_writer(output_path, output_format, flush_every=chunksize, fsync_every=chunksize) as writer:
+        for path in paths:
+            for chunk in iter_output(path, chunksize=chunksize):
+                if 'item_id' in chunk.columns:
+                    duplicated = chunk['item_id'].notna() & (chunk['item_id'].isin(seen) |
+                                                             chunk['item_id'].duplicated())
+                    chunk = chunk[~duplicated]
+                    seen.update(chunk['item_id'].dropna())
+                # missing values are written as empty fields, not "nan"
+                chunk = chunk.astype(object).where(chunk.notna(), None)
+                for row in chunk.to_dict("records"):
+                    writer.write(row)
+                written += len(chunk)
+    return written
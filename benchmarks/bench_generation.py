@@ -0,0 +1,175 @@
+"""
+End-to-end benchmark of `generate_synthetic_data_batch` against the fake backend.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_generation
+    python -m benchmarks.bench_generation --scales 100,10000 --concurrency 1,16,64 --latency 0.02
+    python -m benchmarks.bench_generation --baseline benchmarks/results/baseline.json --tolerance 0.2
+
+Every scenario runs in a fresh process, so peak RSS is measured per scenario.
+Results are written to a json file, with --baseline the run fails (exit code 1) when docs/sec drops
+or peak RSS grows by more than --tolerance
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+import resource
+import multiprocessing as mp
+import numpy as np
+from time import perf_counter
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+TEMPLATE = """
+Informed voluntary consent for medical intervention at the clinic "Modern Health".
+I, John Doe, born 1985, living at 101 Avenue of the Americas, New York, NY 10013, phone +1 212 555-0147,
+email john.doe@example.com, give my consent to the medical interventions listed below.
+The physician Dr. Anna Smith explained the goals, methods and risks of the treatment.
+""" * 4
+
+EXAMPLES = [TEMPLATE.replace("John Doe", name) for name in ("John Doe", "Maria Ivanova", "Pierre Dupont")]
+
+# The benchmark measures the pipeline, not the quota, so the rate limiter budgets are practically unlimited
+UNLIMITED_RATES = {"default": {"rpm": 10 ** 9, "tpm": 10 ** 12},
+                   "gpt-4o": {"rpm": 10 ** 9, "tpm": 10 ** 12},
+                   "gpt-3.5-turbo": {"rpm": 10 ** 9, "tpm": 10 ** 12}}
+
+
+def _run_scenario(scale: int, concurrency: int, latency: float, error_rate: float, output_tokens: int, queue):
+    os.environ["SDG_RATE_LIMITS"] = json.dumps(UNLIMITED_RATES)
+    os.chdir(tempfile.mkdtemp(prefix="sdg_bench_"))
+
+    from app_utils.backends import FakeBackend, register_backend, set_default_backend
+    from app_utils.metrics import PHASE_TIMER
+    from app_utils.openai_llm import generate_synthetic_data_batch
+
+    register_backend("bench", FakeBackend(latency=("lognormal", latency, 0.5),
+                                          error_rates={429: error_rate / 2, 500: error_rate / 2},
+                                          output_tokens=("uniform", output_tokens // 2, output_tokens * 3 // 2),
+                                          seed=0))
+    set_default_backend("bench")
+
+    latencies = []
+    start_time = perf_counter()
+    generated_file = generate_synthetic_data_batch(EXAMPLES,
+                                                   data_size=scale,
+                                                   data_file="bench.csv",
+                                                   concurrency=concurrency,
+                                                   return_dataframe=False,
+                                                   cache_mode="off",
+                                                   leak_action="off",
+                                                   dedup_action="off",
+                                                   on_item=lambda row, elapsed_time: latencies.append(elapsed_time),
+                                                   verbose=False)
+    wall_time = perf_counter() - start_time
+
+    latencies = np.array(latencies)
+    queue.put({
+        "scale": scale,
+        "concurrency": concurrency,
+        "items": len(latencies),
+        "wall_seconds": wall_time,
+        "docs_per_sec": len(latencies) / wall_time,
+        "latency_p50": float(np.percentile(latencies, 50)),
+        "latency_p95": float(np.percentile(latencies, 95)),
+        "latency_p99": float(np.percentile(latencies, 99)),
+        # ru_maxrss is in kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "output_mb": os.path.getsize(generated_file) / 1024 ** 2,
+        "phases": PHASE_TIMER.summary(),
+    })
+
+
+def run_scenario(scale: int, concurrency: int, latency: float, error_rate: float, output_tokens: int):
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_scenario, args=(scale, concurrency, latency, error_rate, output_tokens, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def compare_with_baseline(results: list, baseline_path: str, tolerance: float):
+    """
+    Returns the list of regressions against the baseline results file
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["scale"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        base = baseline.get((result["scale"], result["concurrency"]))
+        if base is None:
+            continue
+        name = f"scale={result['scale']} concurrency={result['concurrency']}"
+        if result["docs_per_sec"] < base["docs_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: docs/sec {result['docs_per_sec']:.1f} < {base['docs_per_sec']:.1f}")
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_mb']:.1f} MB > {base['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def pretty_print(result: dict):
+    phases = " | ".join(f"{name}: {phase['total_seconds']:.2f}s" for name, phase in sorted(result["phases"].items()))
+    print(f"\033[095mscale {result['scale']:>7} | concurrency {result['concurrency']:>3}\033[0m | "
+          f"\033[096m{result['docs_per_sec']:8.1f} docs/sec\033[0m | "
+          f"p50 {result['latency_p50']:.3f}s p95 {result['latency_p95']:.3f}s p99 {result['latency_p99']:.3f}s | "
+          f"peak RSS {result['peak_rss_mb']:.1f} MB")
+    print(f"\033[090m    {phases}\033[0m")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark of the synthetic data generation pipeline")
+    parser.add_argument("--scales", default="100,10000,100000", help="comma separated numbers of items")
+    parser.add_argument("--concurrency", default="1,16,64", help="comma separated concurrency levels")
+    parser.add_argument("--latency", type=float, default=0.02, help="median fake API latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 429/500 answers")
+    parser.add_argument("--output-tokens", type=int, default=500, help="mean number of generated tokens")
+    parser.add_argument("--max-sync-items", type=int, default=10000,
+                        help="skip scales above this value for concurrency 1")
+    parser.add_argument("--output", default=None, help="results json file")
+    parser.add_argument("--baseline", default=None, help="results json file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scales = [int(s) for s in args.scales.split(",")]
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+
+    results = []
+    for scale in scales:
+        for concurrency in concurrency_levels:
+            if concurrency == 1 and scale > args.max_sync_items:
+                print(f"\033[090mskip scale {scale} for concurrency 1 (--max-sync-items)\033[0m")
+                continue
+            result = run_scenario(scale, concurrency, args.latency, args.error_rate, args.output_tokens)
+            pretty_print(result)
+            results.append(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_generation_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"created": datetime.now().isoformat(),
+                   "python": sys.version,
+                   "platform": platform.platform(),
+                   "config": vars(args),
+                   "results": results}, f, indent=2)
+    print(f"\033[092mResults saved to {output}\033[0m")
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"\033[091mREGRESSION {regression}\033[0m")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+import os
+import sys
+import json
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the tests never wait for the rate limiter
+UNLIMITED = {"rpm": 1_000_000, "tpm": 1_000_000_000}
+os.environ["SDG_RATE_LIMITS"] = json.dumps({"default": UNLIMITED, "gpt-4o": UNLIMITED, "gpt-3.5-turbo": UNLIMITED})
+os.environ["SDG_CACHE_MODE"] = "off"
+
+TEMPLATES = [
+    "John Doe is a doctor. He works at the clinic in New York and lives on the Fifth Avenue.",
+    "The company was founded in 1990 in London. It has 100 employees and two offices.",
+    "Send the parcel to DigitalOcean, 101 Avenue of the Americas, New York, NY 10013, USA.",
+]
+
+
+@pytest.fixture
+def fake_backend(tmp_path, monkeypatch):
+    """
+    Fast in-process backend, the generated data goes to tmp_path/gen_data
+    """
+    from app_utils.backends import FakeBackend, register_backend, set_default_backend
+
+    backend = FakeBackend(latency=("fixed", 0.001), output_tokens=("uniform", 20, 60), seed=0)
+    register_backend("test", backend)
+    set_default_backend("test")
+    monkeypatch.chdir(tmp_path)
+    yield backend
+    set_default_backend(None)
@@ -0,0 +1,155 @@
+import json
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pandas as pd
+import pytest
+
+from conftest import TEMPLATES
+from app_utils.backends import set_default_backend
+from app_utils.clients import close_clients
+from app_utils.openai_llm import generate_synthetic_data_batch
+
+
+def test_batch_api_mode_merges_results(fake_backend, tmp_path):
+    path = generate_synthetic_data_batch(TEMPLATES, 12, "batch.csv", use_batch_api=True, poll_interval=0,
+                                         return_dataframe=False, verbose=False, seed=1)
+    df = pd.read_csv(path)
+    assert len(df) == 12
+    assert df["item_id"].is_unique
+    assert set(df["original_text"]) <= set(TEMPLATES)
+    assert df["new_document"].str.len().gt(0).all()
+    # the request files stay next to the data
+    assert list((tmp_path / "gen_data" / "batches").iterdir())
+
+
+def test_long_templates_are_chunked_outside_of_the_batch(fake_backend, tmp_path):
+    long_template = "\n\n".join(f"Section {i}. John Doe lives in New York, his phone is 555-{i:04d}. " * 20
+                                for i in range(30))
+    df = generate_synthetic_data_batch([long_template, TEMPLATES[0]], 6, "long.csv", use_batch_api=True,
+                                       poll_interval=0, verbose=False, seed=1)
+    assert len(df) == 6
+    assert (df["original_text"] == long_template).any()
+    requests = "".join(path.read_text() for path in (tmp_path / "gen_data" / "batches").glob("*.jsonl"))
+    assert "Section 0." not in requests
+
+
+class _BatchHandler(BaseHTTPRequestHandler):
+    """
+    Files and batches endpoints of the API: a batch is in progress on the first poll and completed on the next one
+    """
+    protocol_version = "HTTP/1.1"
+    files, batches, polls = {}, {}, {}
+
+    def _send(self, data, content_type: str = "application/json"):
+        body = data if isinstance(data, bytes) else json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _add_file(self, content: bytes, name: str, purpose: str):
+        file = {"id": f"file-{len(self.files)}", "object": "file", "bytes": len(content), "created_at": 0,
+                "filename": name, "purpose": purpose, "status": "processed"}
+        self.files[file["id"]] = content
+        return file
+
+    def _complete(self, line: str):
+        request = json.loads(line)
+        content = f"document {request['custom_id']}"
+        return json.dumps({"id": f"req-{request['custom_id']}", "custom_id": request["custom_id"], "error": None,
+                           "response": {"status_code": 200, "body": {
+                               "id": "chatcmpl-batch", "object": "chat.completion", "created": 0,
+                               "model": request["body"]["model"],
+                               "choices": [{"index": 0, "finish_reason": "stop",
+                                            "message": {"role": "assistant", "content": content}}],
+                               "usage": {"prompt_tokens": 50, "completion_tokens": 5, "total_tokens": 55}}}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path.endswith("/files"):
+            form = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+            parts = {part.get_param("name", header="content-disposition"): part for part in form.iter_parts()}
+            purpose = parts["purpose"].get_content().strip()
+            self._send(self._add_file(parts["file"].get_payload(decode=True), parts["file"].get_filename(), purpose))
+        elif self.path.endswith("/batches"):
+            request = json.loads(body)
+            lines = self.files[request["input_file_id"]].decode("utf-8").splitlines()
+            output = self._add_file("\n".join(self._complete(line) for line in lines).encode("utf-8"),
+                                    "output.jsonl", "batch_output")
+            batch = {"id": f"batch-{len(self.batches)}", "object": "batch", "endpoint": request["endpoint"],
+                     "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                     "status": "in_progress", "created_at": 0, "output_file_id": output["id"],
+                     "metadata": request.get("metadata")}
+            self.batches[batch["id"]] = batch
+            self._send(batch)
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        if self.path.endswith("/content"):
+            self._send(self.files[self.path.split("/")[-2]], "application/octet-stream")
+        elif "/batches/" in self.path:
+            batch_id = self.path.split("/")[-1]
+            self.polls[batch_id] = self.polls.get(batch_id, 0) + 1
+            batch = self.batches[batch_id]
+            self._send({**batch, "status": "completed" if self.polls[batch_id] > 1 else "in_progress",
+                        "output_file_id": batch["output_file_id"] if self.polls[batch_id] > 1 else None})
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def batch_server(tmp_path, monkeypatch):
+    """
+    Local stand-in of the API, the requests go through the OpenAI client over HTTP
+    """
+    _BatchHandler.files, _BatchHandler.batches, _BatchHandler.polls = {}, {}, {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _BatchHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(openai, "api_key", "test-key")
+    monkeypatch.chdir(tmp_path)
+    set_default_backend("openai")
+    yield _BatchHandler
+    set_default_backend(None)
+    close_clients()
+    server.shutdown()
+
+
+def test_batch_job_against_the_api(batch_server):
+    df = generate_synthetic_data_batch(TEMPLATES, 8, "batch.csv", use_batch_api=True, poll_interval=0,
+                                       verbose=False, seed=1)
+    assert len(batch_server.batches) == 1
+    assert all(polls == 2 for polls in batch_server.polls.values())
+    assert (df["new_document"] == "document " + df["item_id"]).all()
+    assert (df["cost"] > 0).all()
+
+
+def test_resumed_batch_job_reattaches_to_its_batches(batch_server, tmp_path):
+    class Interrupt(Exception):
+        pass
+
+    def on_item(row, elapsed_time):
+        if row['item_id'].endswith("2"):
+            raise Interrupt()
+
+    with pytest.raises(Interrupt):
+        generate_synthetic_data_batch(TEMPLATES, 8, "batch.csv", use_batch_api=True, poll_interval=0,
+                                      verbose=False, seed=1, on_item=on_item)
+    assert list((tmp_path / "gen_data" / "batches").glob("*_batches.json"))
+    df = generate_synthetic_data_batch(TEMPLATES, 8, "batch.csv", use_batch_api=True, poll_interval=0,
+                                       verbose=False, seed=1, resume=True)
+    # the results of the submitted batch are merged, nothing is paid twice
+    assert len(batch_server.batches) == 1
+    assert len(df) == 8 and df["item_id"].is_unique
+    assert not list((tmp_path / "gen_data" / "batches").glob("*_batches.json"))
@@ -0,0 +1,38 @@
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import TEMPLATES
+from app_utils.cli import main, shard_file_name
+from app_utils.openai_llm import plan_items, shard_items
+
+
+@pytest.fixture
+def examples_file(tmp_path):
+    path = tmp_path / "examples.json"
+    path.write_text(json.dumps([{"text": t, "entities": []} for t in TEMPLATES]), encoding="utf-8")
+    return str(path)
+
+
+def test_shards_are_disjoint_and_cover_the_plan():
+    items = [{'item_id': str(i), **item} for i, item in enumerate(plan_items(TEMPLATES, 30, 0.5, ["a", "b"], "RU",
+                                                                             seed=5))]
+    shards = [shard_items(items, i, 3) for i in range(3)]
+    ids = [item['item_id'] for shard in shards for item in shard]
+    assert sorted(ids) == sorted(item['item_id'] for item in items)
+
+
+@pytest.mark.parametrize("output_format", ["csv", "jsonl.gz"])
+def test_sharded_job_merges_into_one_dataset(fake_backend, examples_file, tmp_path, output_format):
+    extension = ".csv" if output_format == "csv" else ""
+    for shard_index in range(3):
+        assert main(["generate", "--examples", examples_file, "--count", "25", "--seed", "11", "--quiet",
+                     "--output", f"job{extension}", "--format", output_format, "--concurrency", "4",
+                     "--shard-index", str(shard_index), "--shard-count", "3"]) == 0
+    shards = [str(tmp_path / "gen_data" / shard_file_name(f"job{extension}", i, 3)) for i in range(3)]
+    # merging a shard twice doesn't duplicate its rows
+    assert main(["merge", *shards, shards[0], "--output", "merged.csv"]) == 0
+    df = pd.read_csv(tmp_path / "gen_data" / "merged.csv")
+    assert len(df) == 25
+    assert df["item_id"].is_unique
@@ -0,0 +1,61 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app_utils.backends import set_default_backend
+from app_utils.clients import close_clients, get_shared_client
+from app_utils.openai_llm import create_completion
+
+COMPLETION = {"id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+              "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+              "usage": {"prompt_tokens": 5, "completion_tokens": 1, "total_tokens": 6}}
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the connection open between the requests
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps(COMPLETION).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def chat_server(monkeypatch):
+    """
+    Local stand-in of the chat completions endpoint that records the client connections
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ChatHandler)
+    _ChatHandler.connections = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    set_default_backend("openai")
+    yield _ChatHandler.connections
+    set_default_backend(None)
+    close_clients()
+    server.shutdown()
+
+
+def test_shared_client_is_reused(chat_server):
+    assert get_shared_client("test-key") is get_shared_client("test-key")
+    assert get_shared_client("test-key") is not get_shared_client("other-key")
+
+
+def test_requests_reuse_one_connection(chat_server):
+    for _ in range(5):
+        result = create_completion("gpt-4o", [{"role": "user", "content": "hi"}], api_key="test-key")
+        assert result.response.choices[0].message.content == "ok"
+    assert len(chat_server) == 1
@@ -0,0 +1,55 @@
+import pandas as pd
+
+from conftest import TEMPLATES
+from app_utils.dedup import DedupIndex, DuplicateChecker, TEMPLATE, minhash, similarity
+from app_utils.openai_llm import generate_synthetic_data_batch
+
+DOC_A = "The quick brown fox jumps over the lazy dog near the river bank in the morning."
+DOC_B = "Quarterly revenue grew by twelve percent thanks to the new subscription plans in Europe."
+
+
+def test_similar_texts_have_similar_signatures():
+    assert similarity(minhash(DOC_A), minhash(DOC_A + " Again.")) > 0.7
+    assert similarity(minhash(DOC_A), minhash(DOC_B)) < 0.2
+
+
+def test_indexes_sharing_a_file_see_each_other(tmp_path):
+    path = str(tmp_path / "job_minhash.bin")
+    a, b = DedupIndex(path), DedupIndex(path)
+    a.refresh()
+    # b appends between a's refresh and a's own append
+    b.add("b-item", minhash(DOC_B))
+    a.add("a-item", minhash(DOC_A))
+    assert a.item_ids == ["b-item", "a-item"]
+    assert a.query(minhash(DOC_B))[0] == "b-item"
+    assert b.query(minhash(DOC_A))[0] == "a-item"
+    # a new process loads both records from the file
+    assert DedupIndex(path).item_ids == ["b-item", "a-item"]
+    a.close()
+    b.close()
+
+
+def test_checker_flags_copies_of_the_template(tmp_path):
+    checker = DuplicateChecker(DedupIndex(str(tmp_path / "t_minhash.bin")))
+    assert checker.check("1", DOC_A, template=DOC_A)[0] == TEMPLATE
+    duplicate_of, signature = checker.check("1", DOC_A, template=DOC_B)
+    assert duplicate_of == ""
+    checker.add("1", signature)
+    assert checker.check("2", DOC_A)[0] == "1"
+    checker.close()
+
+
+def test_shards_share_the_index(fake_backend, tmp_path):
+    dedup_path = str(tmp_path / "gen_data" / "job_minhash.bin")
+    paths = [generate_synthetic_data_batch(TEMPLATES, 8, f"job_{i}.csv", seed=4, shard_index=i, shard_count=2,
+                                           dedup_action="flag", dedup_path=dedup_path, return_dataframe=False,
+                                           verbose=False)
+             for i in range(2)]
+    index = DedupIndex(dedup_path)
+    first, second = (pd.read_csv(path, dtype={"duplicate_of": str}) for path in paths)
+    # the documents of both shards that were not flagged are in the shared index
+    assert len(index) == first["duplicate_of"].isna().sum() + second["duplicate_of"].isna().sum()
+    assert set(first["duplicate_of"].dropna()) <= set(index.item_ids) | {TEMPLATE}
+    # the fake documents are alike, the second shard finds copies of the first shard's documents
+    assert second["duplicate_of"].isin(first["item_id"]).any()
+    index.close()
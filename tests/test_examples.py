@@ -0,0 +1,57 @@
+import io
+import json
+import os
+
+import pytest
+
+from app_utils.examples import ExampleStore, save_upload, scan_json_array, scan_jsonl
+
+RECORDS = [{'text': f'Пример {i}: "quoted" [brackets] {{braces}} \\ slash', 'entities': [{'label': "PER", 'i': i}]}
+           for i in range(20)]
+
+
+def test_scan_json_array_handles_strings_and_chunk_borders():
+    data = json.dumps(["a]b", {"x": "}\""}, [1, [2]], "\\\""], ensure_ascii=False).encode("utf-8")
+    for chunk_bytes in (1, 3, len(data)):
+        spans = list(scan_json_array(io.BytesIO(data), chunk_bytes=chunk_bytes))
+        assert [json.loads(data[start:end]) for start, end in spans] == json.loads(data)
+
+
+def test_scan_jsonl_skips_blank_lines():
+    data = b'{"text": "a"}\n\n{"text": "b"}\n'
+    assert [json.loads(data[start:end]) for start, end in scan_jsonl(io.BytesIO(data))] == [{"text": "a"}, {"text": "b"}]
+
+
+@pytest.mark.parametrize("extension", [".json", ".jsonl"])
+def test_store_reads_records_from_disk(tmp_path, extension):
+    path = str(tmp_path / ("examples" + extension))
+    with open(path, "w", encoding="utf-8") as f:
+        if extension == ".json":
+            json.dump(RECORDS, f, ensure_ascii=False, indent=2)
+        else:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in RECORDS)
+    store = ExampleStore.open(path)
+    assert os.path.exists(path + ".idx.npy")
+    assert len(store) == len(RECORDS)
+    assert store.text_key == "text" and store.entities_key == "entities"
+    assert list(store) == [record['text'] for record in RECORDS]
+    assert store[-1] == RECORDS[-1]['text']
+    assert store.entities[3] == RECORDS[3]['entities']
+    # the saved index is reused
+    assert ExampleStore.open(path).meta == store.meta
+    with pytest.raises(KeyError):
+        ExampleStore.open(path, text_key="missing")
+    assert store.with_keys(text_key="entities").offsets is store.offsets
+
+
+class _Upload(io.BytesIO):
+    name = "examples.jsonl"
+
+
+def test_save_upload_is_named_by_content(tmp_path):
+    data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in RECORDS).encode("utf-8")
+    first = save_upload(_Upload(data), folder=str(tmp_path))
+    second = save_upload(_Upload(data), folder=str(tmp_path))
+    assert first == second and first.endswith(".jsonl")
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(first)]
+    assert len(ExampleStore.open(first)) == len(RECORDS)
@@ -0,0 +1,102 @@
+import io
+
+import pandas as pd
+import pytest
+
+from app_utils.log_viewer import CsvView, open_view, scan_csv_rows
+from app_utils.writer import PartitionedWriter, StreamingCsvWriter, read_output
+
+ROWS = [{'item_id': str(i), 'new_document': f'line one\nline "two", row {i}', 'model': "gpt-4o" if i % 3 else "mini",
+         'language': "RU" if i % 2 else "EN"} for i in range(50)]
+ROWS[7]['new_document'] = "Привет, Москва"
+
+
+def _write(path, rows):
+    with StreamingCsvWriter(str(path), columns=list(ROWS[0])) as writer:
+        for row in rows:
+            writer.write(row)
+
+
+def test_scan_finds_row_ends_outside_quotes():
+    data = b'a,b\n1,"x\ny"\n2,"say ""hi""\n"\n3,z\n'
+    header = len(b"a,b\n")
+    # a tiny chunk size splits the quoted fields between chunks
+    ends = list(scan_csv_rows(io.BytesIO(data), header, chunk_bytes=3))
+    assert ends == [data.index(b"2,"), data.index(b"3,"), len(data)]
+
+
+def test_pages_match_pandas(tmp_path):
+    path = tmp_path / "data.csv"
+    _write(path, ROWS)
+    view = CsvView(str(path))
+    expected = pd.read_csv(path)
+    assert len(view) == len(expected)
+    page = view.page(10, 20)
+    pd.testing.assert_frame_equal(page.reset_index(drop=True), expected.iloc[10:20].reset_index(drop=True))
+    assert view.stats['model'] == expected['model'].value_counts().to_dict()
+
+
+def test_index_is_extended_when_the_file_grows(tmp_path):
+    path = tmp_path / "data.csv"
+    _write(path, ROWS[:30])
+    assert len(CsvView(str(path))) == 30
+    _write(path, ROWS[30:])
+    # a new view loads the saved offsets and scans only the appended rows
+    view = open_view(str(path))
+    assert len(view) == 50
+    assert view.stats['rows'] == 50
+    assert view.page(49, 50)['item_id'].tolist() == [49]
+
+
+def test_search_is_case_insensitive_and_pages(tmp_path):
+    path = tmp_path / "data.csv"
+    _write(path, ROWS)
+    view = CsvView(str(path))
+    found, next_row = view.search("MINI", limit=5)
+    assert len(found) == 5 and (found['model'] == "mini").all()
+    rest, end = view.search("MINI", start=next_row, limit=100)
+    assert end is None
+    assert len(found) + len(rest) == sum(row['model'] == "mini" for row in ROWS)
+    assert view.search("москва")[0]['item_id'].tolist() == [7]
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "jsonl.gz"])
+def test_dataset_pages_read_only_the_cached_blocks(tmp_path, monkeypatch, output_format):
+    monkeypatch.setattr("app_utils.writer.PARQUET_ROW_GROUP_ROWS", 7)
+    path = str(tmp_path / "data")
+    with PartitionedWriter(path, output_format, columns=list(ROWS[0]), max_part_bytes=2_000) as writer:
+        for row in ROWS:
+            writer.write(row)
+    expected = read_output(path)
+    view = open_view(path)
+    assert len(view) == len(ROWS) and view.stats['rows'] == len(ROWS)
+    if output_format == "parquet":
+        assert len(view.blocks) > len(view.index['parts']) + 1
+
+    decoded = []
+    decode_block = view._decode_block
+    monkeypatch.setattr(view, "_decode_block", lambda *args: decoded.append(args) or decode_block(*args))
+    for _ in range(2):
+        page = view.page(5, 25, ["item_id", "model"])
+        pd.testing.assert_frame_equal(page.reset_index(drop=True),
+                                      expected[["item_id", "model"]].iloc[5:25].reset_index(drop=True))
+    assert len(decoded) == len({args[:2] for args in decoded})
+    assert view.search("москва")[0]['item_id'].tolist() == ["7"]
+
+
+def test_dataset_view_reads_the_appended_pending_rows(tmp_path):
+    path = str(tmp_path / "data")
+    writer = PartitionedWriter(path, "jsonl.gz", columns=list(ROWS[0]))
+    for row in ROWS[:10]:
+        writer.write(row)
+    view = open_view(path)
+    assert len(view) == 10
+    for row in ROWS[10:15]:
+        writer.write(row)
+    assert len(view.refresh()) == 15
+    writer.roll()
+    for row in ROWS[15:20]:
+        writer.write(row)
+    assert len(view.refresh()) == 20
+    assert view.page(8, 18)['item_id'].tolist() == [str(i) for i in range(8, 18)]
+    writer.close()
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from app_utils.openai_llm import generate_synthetic_data_batch
+
+
+def _run(data_file, concurrency):
+    # one template, augmentation, language and model: every item sends the same prompt
+    return generate_synthetic_data_batch(["John Doe lives in New York."], 10, data_file, gpt4_share=1.0,
+                                         augmentations=["Add more details"], language="EN", seed=3,
+                                         concurrency=concurrency, cache_mode="read_through", verbose=False)
+
+
+def test_items_with_the_same_prompt_get_their_own_answers(fake_backend, tmp_path, monkeypatch):
+    monkeypatch.setenv("SDG_CACHE_PATH", str(tmp_path / "responses.sqlite"))
+    first = _run("first.csv", concurrency=1)
+    assert (first['cost'] > 0).all()
+    # the rerun of the same plan replays the answer of every item
+    second = _run("second.csv", concurrency=4)
+    assert (second['cost'] == 0).all()
+    replayed = second.set_index('item_id')['new_document']
+    assert replayed.loc[first['item_id']].tolist() == first['new_document'].tolist()
+    assert len(pd.unique(first['completion_tokens'])) > 1
@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+from conftest import TEMPLATES
+from app_utils.manifest import JobManifest
+from app_utils.openai_llm import generate_synthetic_data_batch
+
+
+class _Interrupt(Exception):
+    pass
+
+
+def _interrupt_after(count: int):
+    saved = []
+
+    def on_item(row, elapsed_time):
+        saved.append(row['item_id'])
+        if len(saved) >= count:
+            raise _Interrupt()
+    return on_item
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_resume_generates_only_pending_items(fake_backend, concurrency):
+    with pytest.raises(_Interrupt):
+        generate_synthetic_data_batch(TEMPLATES, 20, "resume.csv", seed=7, concurrency=concurrency,
+                                      return_dataframe=False, verbose=False, on_item=_interrupt_after(6))
+    path = generate_synthetic_data_batch(TEMPLATES, 20, "resume.csv", seed=7, concurrency=concurrency, resume=True,
+                                         return_dataframe=False, verbose=False)
+    df = pd.read_csv(path)
+    assert len(df) == 20
+    assert df["item_id"].is_unique
+
+
+def test_resume_of_partitioned_output_keeps_one_part(fake_backend, tmp_path):
+    for run in range(2):
+        with pytest.raises(_Interrupt):
+            generate_synthetic_data_batch(TEMPLATES, 20, "resume", seed=7, output_format="jsonl.gz",
+                                          resume=run > 0, return_dataframe=False, verbose=False,
+                                          on_item=_interrupt_after(4))
+    df = generate_synthetic_data_batch(TEMPLATES, 20, "resume", seed=7, output_format="jsonl.gz", resume=True,
+                                       verbose=False)
+    assert len(df) == 20
+    assert df["item_id"].is_unique
+    # the interrupted runs appended to the write-ahead file, the finished job compacted it once
+    assert sorted(p.name for p in (tmp_path / "gen_data" / "resume").iterdir()) == ["_index.json",
+                                                                                     "part-00000.jsonl.gz"]
+
+
+def test_finished_job_is_not_generated_again(fake_backend):
+    path = generate_synthetic_data_batch(TEMPLATES, 5, "done.csv", seed=3, return_dataframe=False, verbose=False)
+    generate_synthetic_data_batch(TEMPLATES, 5, "done.csv", seed=3, resume=True, return_dataframe=False,
+                                  verbose=False)
+    assert len(pd.read_csv(path)) == 5
+
+
+@pytest.mark.parametrize("variants", [1, 3])
+def test_interrupted_job_has_done_a_prefix_of_the_plan(fake_backend, tmp_path, variants):
+    saved = []
+
+    def on_item(row, elapsed_time):
+        saved.append(row['item_id'])
+        if len(saved) == 6:
+            raise _Interrupt()
+
+    with pytest.raises(_Interrupt):
+        generate_synthetic_data_batch(TEMPLATES, 30, "prefix.csv", seed=5, variants=variants,
+                                      return_dataframe=False, verbose=False, on_item=on_item)
+    manifest = JobManifest.load(JobManifest.path_for(str(tmp_path / "gen_data" / "prefix.csv")))
+    assert saved == [item['item_id'] for item in manifest.items[:6]]
+    manifest.close()
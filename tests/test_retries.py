@@ -0,0 +1,39 @@
+import openai
+import pytest
+
+from conftest import TEMPLATES
+from app_utils.backends import FakeBackend
+from app_utils.openai_llm import _retry_delay, generate_synthetic_data_batch
+from app_utils.rate_limit import ModelRateLimiter, get_rate_limiter
+
+
+def _error(code):
+    try:
+        FakeBackend()._raise(code, "gpt-4o")
+    except openai.APIError as e:
+        return e
+
+
+def test_only_rate_limit_errors_pause_the_model(capsys):
+    limiter = ModelRateLimiter()
+    assert _retry_delay("gpt-4o", limiter, 100, 0, 3, _error(500), verbose=False) >= 1
+    assert "gpt-4o" not in limiter._paused_until
+    assert capsys.readouterr().out == ""
+
+    _retry_delay("gpt-4o", limiter, 100, 0, 3, _error(429))
+    assert "gpt-4o" in limiter._paused_until
+    assert "RateLimitError" in capsys.readouterr().out
+
+    with pytest.raises(openai.InternalServerError):
+        _retry_delay("gpt-4o", limiter, 100, 3, 3, _error(500))
+
+
+def test_server_errors_are_retried_quietly(fake_backend, monkeypatch, capsys):
+    fake_backend.error_rates = {500: 0.3}
+    # no waiting between the attempts
+    monkeypatch.setattr("app_utils.openai_llm.parse_duration", lambda value: 0)
+    monkeypatch.setattr("app_utils.openai_llm.backoff_delay", lambda attempt: 0)
+    df = generate_synthetic_data_batch(TEMPLATES, 20, "retries.csv", seed=1, concurrency=4, verbose=False)
+    assert len(df) == 20
+    assert "gpt-4o" not in get_rate_limiter()._paused_until
+    assert "retry in" not in capsys.readouterr().out
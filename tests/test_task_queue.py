@@ -0,0 +1,90 @@
+import json
+from time import sleep
+
+import pandas as pd
+import pytest
+
+from conftest import TEMPLATES
+from app_utils.task_queue import LeaseHeartbeat, TaskQueue, enqueue_plan, work
+
+
+def _items(n: int):
+    return [{'item_id': f"job-{i}", 'template': TEMPLATES[0], 'example_index': 0, 'augmentation': "",
+             'model': "gpt-4o", 'language': "EN"} for i in range(n)]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.sqlite"), visibility_timeout=0.2, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def test_expired_lease_goes_to_another_worker(queue, tmp_path):
+    queue.enqueue("job", _items(1))
+    (task_id, token, _, _), = queue.lease()
+    assert queue.lease() == []
+    sleep(0.3)
+    other = TaskQueue(queue.path, visibility_timeout=0.2)
+    (_, new_token, _, _), = other.lease()
+    # the late worker's result is dropped, the current holder saves it
+    assert not queue.complete(task_id, token, {'item_id': task_id})
+    assert other.complete(task_id, new_token, {'item_id': task_id})
+    assert queue.stats("job") == {'done': 1, 'dead': 0}
+    other.close()
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    queue.enqueue("job", _items(1))
+    (task_id, token, _, _), = queue.lease()
+    with LeaseHeartbeat(queue.path, task_id, token, visibility_timeout=0.2) as heartbeat:
+        sleep(0.5)
+        assert queue.lease() == []
+    assert not heartbeat.lost
+    assert queue.complete(task_id, token, {'item_id': task_id})
+
+
+def test_failed_task_moves_to_dead_letter_and_back(queue, monkeypatch):
+    # failed tasks are available again at once
+    monkeypatch.setattr("app_utils.task_queue.backoff_delay", lambda attempt: 0)
+    queue.enqueue("job", _items(1))
+    for _ in range(2):
+        (task_id, token, _, _), = queue.lease()
+        queue.fail(task_id, token, "boom")
+    assert queue.stats("job")["dead"] == 1
+    # enqueueing the plan again doesn't revive the dead task
+    assert queue.enqueue("job", _items(1)) == 0
+    assert queue.requeue_dead("job") == 1
+    assert queue.stats("job") == {'pending': 1, 'dead': 0}
+
+
+def test_workers_drain_the_queue_and_export(fake_backend, tmp_path):
+    path = str(tmp_path / "tasks.sqlite")
+    queue = TaskQueue(path)
+    job_id = enqueue_plan(queue, TEMPLATES, 10, seed=2)
+    assert enqueue_plan(queue, TEMPLATES, 10, seed=2) == job_id
+    assert work(path, "worker-test") == 10
+    output = str(tmp_path / "export.csv")
+    assert queue.export(job_id, output) == 10
+    df = pd.read_csv(output)
+    assert df["item_id"].is_unique
+    assert set(df["original_text"]) <= set(TEMPLATES)
+    queue.close()
+
+
+@pytest.mark.parametrize("leak_action", ["off", "flag", "regenerate"])
+def test_workers_check_the_entities_of_the_examples(fake_backend, tmp_path, leak_action):
+    from app_utils.examples import ExampleStore
+
+    examples_path = tmp_path / "examples.json"
+    # every fake document starts with "token0 token1 ..."
+    examples_path.write_text(json.dumps([{'text': text, 'entities': ["Token1"]} for text in TEMPLATES]))
+    path = str(tmp_path / "tasks.sqlite")
+    queue = TaskQueue(path)
+    job_id = enqueue_plan(queue, ExampleStore.open(str(examples_path)), 6, seed=2)
+    assert work(path, "worker-test", leak_action=leak_action) == 6
+    output = str(tmp_path / "export.csv")
+    queue.export(job_id, output)
+    leaked = pd.read_csv(output, keep_default_na=False)["leaked_entities"]
+    assert (leaked == ("" if leak_action == "off" else "Token1")).all()
+    queue.close()
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from app_utils.writer import PartitionedWriter, read_index, read_output
+
+COLUMNS = ["item_id", "new_document", "language"]
+
+
+def _rows(start, stop):
+    return [{'item_id': i, 'new_document': f"document {i}", 'language': "EN"} for i in range(start, stop)]
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "jsonl.gz"])
+def test_close_keeps_pending_rows_for_the_next_run(tmp_path, output_format):
+    path = str(tmp_path / "out")
+    writer = PartitionedWriter(path, output_format, columns=COLUMNS)
+    for row in _rows(0, 5):
+        writer.write(row)
+    writer.close()
+    # an interrupted run doesn't create a part, the readers include the pending rows
+    assert read_index(path)["parts"] == []
+    assert read_output(path)["item_id"].tolist() == list(range(5))
+
+    with PartitionedWriter(path, output_format, columns=COLUMNS) as writer:
+        for row in _rows(5, 10):
+            writer.write(row)
+    index = read_index(path)
+    assert [part["rows"] for part in index["parts"]] == [10]
+    assert not any(name.startswith("_pending-") for name in os.listdir(path))
+    assert read_output(path)["item_id"].tolist() == list(range(10))
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "jsonl.gz"])
+def test_missing_columns_are_read_as_empty(tmp_path, output_format):
+    path = str(tmp_path / "out")
+    with PartitionedWriter(path, output_format, columns=COLUMNS) as writer:
+        for row in _rows(0, 3):
+            writer.write(row)
+    df = read_output(path, columns=["item_id", "approved"])
+    assert list(df.columns) == ["item_id", "approved"]
+    assert df["item_id"].tolist() == [0, 1, 2]
+    assert df["approved"].isna().all()
+
+
+def test_rows_over_the_part_size_roll_into_new_parts(tmp_path):
+    path = str(tmp_path / "out")
+    with PartitionedWriter(path, "jsonl.gz", columns=COLUMNS, max_part_bytes=200) as writer:
+        for row in _rows(0, 20):
+            writer.write(row)
+    index = read_index(path)
+    assert len(index["parts"]) > 1
+    assert index["rows"] == 20
+    assert read_output(path, parts=[0])["item_id"].tolist() == list(range(index["parts"][0]["rows"]))